@@ -7,7 +7,7 @@
 # -------------------------------------------------------------------------------
 __version__ = "3.1.42"
 
-import os, json
+import os, sys, json
 
 try:
     WX_OFFS_PATH = os.path.join(os.path.dirname(__file__), "WX_OFFS.json")
@@ -17,18 +17,32 @@ except:
     WX_OFFS = {}
     WX_OFFS_PATH = None
 
-from .wx_core import BiasAddr, get_wx_info, get_wx_db, batch_decrypt, decrypt, get_core_db
-from .wx_core import merge_db, decrypt_merge, merge_real_time_db, all_merge_real_time_db
-from .db import DBHandler, MsgHandler, MicroHandler, MediaHandler, OpenIMContactHandler, FavoriteHandler, \
-    PublicMsgHandler
-from .api import start_server, gen_fastapi_app
-from .api.export import export_html, export_csv, export_json
+from .wx_core import batch_decrypt, decrypt, decrypt_to_connection, verify_integrity
+from .wx_core import merge_db, decrypt_merge, merge_real_time_db, all_merge_real_time_db, get_merge_timing, \
+    RealTimeSync, estimate_decrypt_merge, estimate_merge, build_msg_fts
+from .db import DBHandler, get_db_handler, MsgHandler, MicroHandler, MediaHandler, OpenIMContactHandler, \
+    FavoriteHandler, PublicMsgHandler
+
+if sys.platform == "win32":  # 读取微信进程内存、本地服务(local_server)仅支持Windows，其他平台只能使用解密、合并等功能
+    from .wx_core import BiasAddr, get_wx_info, get_wx_db, get_core_db
+    from .api import start_server, gen_fastapi_app
+    from .api.export import export_html, export_csv, export_json
+else:  # 其他平台上使用时再导入，导入失败时提示仅支持Windows
+    from .wx_core.utils import windows_only_getattr
+
+    __getattr__ = windows_only_getattr(__name__, {
+        "BiasAddr": ".wx_core.get_bias_addr", "get_wx_info": ".wx_core.wx_info", "get_wx_db": ".wx_core.wx_info",
+        "get_core_db": ".wx_core.wx_info", "start_server": ".api", "gen_fastapi_app": ".api",
+        "export_html": ".api.export", "export_csv": ".api.export", "export_json": ".api.export"})
 
 # PYWXDUMP_ROOT_PATH = os.path.dirname(__file__)
 # db_init = DBPool("DBPOOL_INIT")
 
 
-__all__ = ["BiasAddr", "get_wx_info", "get_wx_db", "batch_decrypt", "decrypt", "get_core_db",
-           "merge_db", "decrypt_merge", "merge_real_time_db", "all_merge_real_time_db",
-           "DBHandler", "MsgHandler", "MicroHandler", "MediaHandler", "OpenIMContactHandler", "FavoriteHandler",
-           "PublicMsgHandler", "start_server", "WX_OFFS", "WX_OFFS_PATH", "__version__"]
+__all__ = ["batch_decrypt", "decrypt", "decrypt_to_connection", "verify_integrity",
+           "merge_db", "decrypt_merge", "merge_real_time_db", "all_merge_real_time_db", "get_merge_timing",
+           "RealTimeSync", "estimate_decrypt_merge", "estimate_merge", "build_msg_fts",
+           "DBHandler", "get_db_handler", "MsgHandler", "MicroHandler", "MediaHandler", "OpenIMContactHandler",
+           "FavoriteHandler", "PublicMsgHandler", "WX_OFFS", "WX_OFFS_PATH", "__version__"]
+if sys.platform == "win32":
+    __all__ += ["BiasAddr", "get_wx_info", "get_wx_db", "get_core_db", "start_server"]
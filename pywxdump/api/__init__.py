@@ -27,6 +27,7 @@ from .remote_server import rs_api
 from .local_server import ls_api
 
 from pywxdump import __version__
+from pywxdump.wx_core.utils import set_key_cache_path
 
 
 def gen_fastapi_app(handler, origins=None):
@@ -146,6 +147,7 @@ def start_server(port=5000, online=False, debug=False, isopenBrowser=True,
     os.environ["PYWXDUMP_WORK_PATH"] = work_path
     os.environ["PYWXDUMP_CONF_FILE"] = conf_file
     os.environ["PYWXDUMP_AUTO_SETTING"] = auto_setting
+    set_key_cache_path(os.path.join(work_path, "key_cache.json"))  # 缓存派生密钥，避免重复计算PBKDF2
 
     with open(env_file, "w", encoding="utf-8") as f:
         f.write(f"PYWXDUMP_WORK_PATH = '{work_path}'\n")
@@ -8,7 +8,7 @@
 import csv
 import json
 import os
-from pywxdump.db import DBHandler
+from pywxdump.db import get_db_handler
 
 
 def export_csv(wxid, outpath, db_config, my_wxid="我", page_size=5000):
@@ -17,7 +17,7 @@ def export_csv(wxid, outpath, db_config, my_wxid="我", page_size=5000):
         if not os.path.exists(outpath):
             os.makedirs(outpath)
 
-    db = DBHandler(db_config, my_wxid)
+    db = get_db_handler(db_config, my_wxid)
 
     count = db.get_msgs_count(wxid)
     chatCount = count.get(wxid, 0)
@@ -28,33 +28,37 @@ def export_csv(wxid, outpath, db_config, my_wxid="我", page_size=5000):
         page_size = chatCount + 1
 
     users = {}
-    for i in range(0, chatCount, page_size):
-        start_index = i
-        data, users_t = db.get_msgs(wxid, start_index, page_size)
-        print(users, users_t)
-        users.update(users_t)
-
-        if len(data) == 0:
-            return False, "没有聊天记录"
-
-        save_path = os.path.join(outpath, f"{wxid}_{i}_{i + page_size}.csv")
-
-        with open(save_path, "w", encoding="utf-8", newline='') as f:
-            csv_writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
-
-            csv_writer.writerow(["id", "MsgSvrID", "type_name", "is_sender", "talker", "room_name", "msg", "src",
-                                 "CreateTime"])
-            for row in data:
-                id = row.get("id", "")
-                MsgSvrID = row.get("MsgSvrID", "")
-                type_name = row.get("type_name", "")
-                is_sender = row.get("is_sender", "")
-                talker = row.get("talker", "")
-                room_name = row.get("room_name", "")
-                msg = row.get("msg", "")
-                src = row.get("src", "")
-                CreateTime = row.get("CreateTime", "")
-                csv_writer.writerow([id, MsgSvrID, type_name, is_sender, talker, room_name, msg, src, CreateTime])
+    f = None
+    count = 0
+    try:
+        # 逐条读取并写入，内存占用与聊天记录数量无关
+        for row, user in db.iter_msgs(wxid, batch_size=min(page_size, 5000)):
+            if count % page_size == 0:
+                if f:
+                    f.close()
+                save_path = os.path.join(outpath, f"{wxid}_{count}_{count + page_size}.csv")
+                f = open(save_path, "w", encoding="utf-8", newline='')
+                csv_writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+                csv_writer.writerow(["id", "MsgSvrID", "type_name", "is_sender", "talker", "room_name", "msg", "src",
+                                     "CreateTime"])
+            if user:
+                users[row.get("talker", "")] = user
+            id = row.get("id", "")
+            MsgSvrID = row.get("MsgSvrID", "")
+            type_name = row.get("type_name", "")
+            is_sender = row.get("is_sender", "")
+            talker = row.get("talker", "")
+            room_name = row.get("room_name", "")
+            msg = row.get("msg", "")
+            src = row.get("src", "")
+            CreateTime = row.get("CreateTime", "")
+            csv_writer.writerow([id, MsgSvrID, type_name, is_sender, talker, room_name, msg, src, CreateTime])
+            count += 1
+    finally:
+        if f:
+            f.close()
+    if count == 0:
+        return False, "没有聊天记录"
     with open(os.path.join(outpath, "users.json"), "w", encoding="utf-8") as f:
         json.dump(users, f, ensure_ascii=False, indent=4)
     return True, f"导出成功: {outpath}"
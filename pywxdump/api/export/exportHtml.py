@@ -7,7 +7,7 @@
 # -------------------------------------------------------------------------------
 import json
 import os
-from pywxdump.db import DBHandler
+from pywxdump.db import get_db_handler
 
 
 def export_html(wxid, outpath, db_config, my_wxid="我"):
@@ -16,28 +16,34 @@ def export_html(wxid, outpath, db_config, my_wxid="我"):
         if not os.path.exists(outpath):
             os.makedirs(outpath)
 
-    db = DBHandler(db_config, my_wxid)
+    db = get_db_handler(db_config, my_wxid)
 
     count = db.get_msgs_count(wxid)
     chatCount = count.get(wxid, 0)
     if chatCount == 0:
         return False, "没有聊天记录"
 
-    msgs, users = db.get_msgs(wxid, 0, chatCount + 1)
-    if len(msgs) == 0:
-        return False, "没有聊天记录"
-
-    data_js = (
-        "localStorage.setItem('isUseLocalData', 't')  //  't' : 'f' \n"
-        f"const local_msg_count = {chatCount}\n"
-        f"const local_mywxid = '{my_wxid}' \n"
-        f"const local_user_list = {json.dumps(users, ensure_ascii=False, indent=None )} \n"
-        f"const local_msg_list = {json.dumps(msgs, ensure_ascii=False, indent=None )} \n"
-    )
-
+    users = {}
+    count = 0
     save_path = os.path.join(outpath, f"data.js")
     with open(save_path, "w", encoding="utf-8") as f:
-        f.write(data_js)
+        f.write(
+            "localStorage.setItem('isUseLocalData', 't')  //  't' : 'f' \n"
+            f"const local_msg_count = {chatCount}\n"
+            f"const local_mywxid = '{my_wxid}' \n"
+            "const local_msg_list = ["
+        )
+        # 逐条写入，内存占用与聊天记录数量无关
+        for msg, user in db.iter_msgs(wxid, batch_size=5000):
+            if user:
+                users[msg.get("talker", "")] = user
+            f.write(("," if count else "") + json.dumps(msg, ensure_ascii=False, indent=None))
+            count += 1
+        f.write("] \n")
+        f.write(f"const local_user_list = {json.dumps(users, ensure_ascii=False, indent=None)} \n")
+    if count == 0:
+        os.remove(save_path)
+        return False, "没有聊天记录"
 
     return True, f"导出成功: {outpath}"
 
@@ -7,7 +7,7 @@
 # -------------------------------------------------------------------------------
 import json
 import os
-from pywxdump.db import DBHandler
+from pywxdump.db import get_db_handler
 
 
 def export_json(wxid, outpath, db_config, my_wxid="我", indent=4):
@@ -16,24 +16,28 @@ def export_json(wxid, outpath, db_config, my_wxid="我", indent=4):
         if not os.path.exists(outpath):
             os.makedirs(outpath)
 
-    db = DBHandler(db_config, my_wxid)
+    db = get_db_handler(db_config, my_wxid)
 
     count = db.get_msgs_count(wxid)
     chatCount = count.get(wxid, 0)
     if chatCount == 0:
         return False, "没有聊天记录"
     users = {}
-    page_size = chatCount + 1
-    for i in range(0, chatCount, page_size):
-        start_index = i
-        data, users_t = db.get_msgs(wxid, start_index, page_size)
-        users.update(users_t)
-        if len(data) == 0:
-            return False, "没有聊天记录"
-
-        save_path = os.path.join(outpath, f"{wxid}_{i}_{i + page_size}.json")
-        with open(save_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=indent)
+    count = 0
+    save_path = os.path.join(outpath, f"{wxid}_0_{chatCount + 1}.json")
+    with open(save_path, "w", encoding="utf-8") as f:
+        # 逐条写入 JSON 数组，内存占用与聊天记录数量无关
+        f.write("[")
+        for msg, user in db.iter_msgs(wxid, batch_size=5000):
+            if user:
+                users[msg.get("talker", "")] = user
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(msg, ensure_ascii=False, indent=indent))
+            count += 1
+        f.write("\n]")
+    if count == 0:
+        os.remove(save_path)
+        return False, "没有聊天记录"
     with open(os.path.join(outpath, "users.json"), "w", encoding="utf-8") as f:
         json.dump(users, f, ensure_ascii=False, indent=indent)
     return True, f"导出成功: {outpath}"
@@ -214,10 +214,7 @@ def get_real_time_msg():
     if not merge_path or not key or not wx_path:
         return ReJson(1002, body="msg_path or media_path or wx_path or key is required")
 
-    real_time_exe_path = gc.get_conf(gc.at, "real_time_exe_path")
-
-    code, ret = all_merge_real_time_db(key=key, wx_path=wx_path, merge_path=merge_path,
-                                       real_time_exe_path=real_time_exe_path)
+    code, ret = all_merge_real_time_db(key=key, wx_path=wx_path, merge_path=merge_path)
     if code:
         return ReJson(0, ret)
     else:
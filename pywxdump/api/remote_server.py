@@ -17,8 +17,8 @@ from fastapi import APIRouter, Response, Body, Query, Request
 from starlette.responses import StreamingResponse, FileResponse
 
 import pywxdump
-from pywxdump import decrypt_merge, get_core_db
-from pywxdump.db import DBHandler
+from pywxdump import decrypt_merge, get_core_db, estimate_decrypt_merge, build_msg_fts
+from pywxdump.db import get_db_handler
 from pywxdump.db.utils import download_file, dat2img
 
 from .export import export_csv, export_json, export_html
@@ -67,7 +67,7 @@ def user_session_list():
     my_wxid = gc.get_conf(gc.at, "last")
     if not my_wxid: return ReJson(1001, body="my_wxid is required")
     db_config = gc.get_conf(my_wxid, "db_config")
-    db = DBHandler(db_config, my_wxid=my_wxid)
+    db = get_db_handler(db_config, my_wxid=my_wxid)
     ret = db.get_session_list()
     return ReJson(0, list(ret.values()))
 
@@ -83,7 +83,7 @@ def user_labels_dict():
     my_wxid = gc.get_conf(gc.at, "last")
     if not my_wxid: return ReJson(1001, body="my_wxid is required")
     db_config = gc.get_conf(my_wxid, "db_config")
-    db = DBHandler(db_config, my_wxid=my_wxid)
+    db = get_db_handler(db_config, my_wxid=my_wxid)
     user_labels_dict = db.get_labels()
     return ReJson(0, user_labels_dict)
 
@@ -101,7 +101,7 @@ def user_list(word: str = Body("", embed=True), wxids: List[str] = Body(None), l
     my_wxid = gc.get_conf(gc.at, "last")
     if not my_wxid: return ReJson(1001, body="my_wxid is required")
     db_config = gc.get_conf(my_wxid, "db_config")
-    db = DBHandler(db_config, my_wxid=my_wxid)
+    db = get_db_handler(db_config, my_wxid=my_wxid)
     users = db.get_user(word=word, wxids=wxids, labels=labels)
     return ReJson(0, users)
 
@@ -120,16 +120,17 @@ def msg_count(wxids: Optional[List[str]] = Body(..., embed=True)):
     my_wxid = gc.get_conf(gc.at, "last")
     if not my_wxid: return ReJson(1001, body="my_wxid is required")
     db_config = gc.get_db_config()
-    db = DBHandler(db_config, my_wxid=my_wxid)
+    db = get_db_handler(db_config, my_wxid=my_wxid)
     count = db.get_msgs_count(wxids)
     return ReJson(0, count)
 
 
 @rs_api.api_route('/msg_list', methods=["GET", 'POST'])
 @error9999
-def get_msgs(wxid: str = Body(...), start: int = Body(...), limit: int = Body(...)):
+def get_msgs(wxid: str = Body(...), start: int = Body(0), limit: int = Body(...), cursor: str = Body(None)):
     """
     获取联系人的聊天记录
+    传入 cursor 时按游标分页(第一页传空字符串)，返回下一页的 cursor(没有下一页时为 null)，忽略 start
     :return:
     """
 
@@ -137,11 +138,58 @@ def get_msgs(wxid: str = Body(...), start: int = Body(...), limit: int = Body(..
     if not my_wxid: return ReJson(1001, body="my_wxid is required")
     db_config = gc.get_conf(my_wxid, "db_config")
 
-    db = DBHandler(db_config, my_wxid=my_wxid)
+    db = get_db_handler(db_config, my_wxid=my_wxid)
+    if cursor is not None:
+        try:
+            msgs, users, next_cursor = db.get_msgs_by_cursor(wxids=wxid, cursor=cursor, page_size=limit)
+        except ValueError:
+            return ReJson(1002, body="cursor error")
+        return ReJson(0, {"msg_list": msgs, "user_list": users, "cursor": next_cursor})
     msgs, users = db.get_msgs(wxids=wxid, start_index=start, page_size=limit)
     return ReJson(0, {"msg_list": msgs, "user_list": users})
 
 
+@rs_api.api_route('/msg_search', methods=["GET", 'POST'])
+@error9999
+def search_msgs(query: str = Body(..., embed=True), wxid: str = Body(""), start_time: int = Body(0),
+                end_time: int = Body(0), limit: int = Body(50), offset: int = Body(0)):
+    """
+    全文搜索聊天记录(需要先建立全文索引 /msg_fts_build)
+    :return: msg_list 中每条消息的 snippet 为关键词附近的文本
+    """
+    if not query or not query.strip():
+        return ReJson(1002, body="query is required")
+    my_wxid = gc.get_conf(gc.at, "last")
+    if not my_wxid: return ReJson(1001, body="my_wxid is required")
+    db_config = gc.get_conf(my_wxid, "db_config")
+
+    db = get_db_handler(db_config, my_wxid=my_wxid)
+    if "msg_fts" not in db.existed_tables:
+        return ReJson(1002, body="未建立全文索引，请先调用 /msg_fts_build")
+    msgs, wxid_list = db.search_msgs(query, wxid=wxid, start_time=start_time, end_time=end_time, limit=limit,
+                                     offset=offset, my_talker=my_wxid) or ([], [])
+    users = db.get_user(wxids=wxid_list) if wxid_list else {}
+    return ReJson(0, {"msg_list": msgs, "user_list": users})
+
+
+@rs_api.api_route('/msg_fts_build', methods=["GET", 'POST'])
+@error9999
+def msg_fts_build():
+    """
+    建立(或增量更新)聊天记录的全文索引，之后合并数据库时自动增量更新
+    :return: 新增的索引条数
+    """
+    my_wxid = gc.get_conf(gc.at, "last")
+    if not my_wxid: return ReJson(1001, body="my_wxid is required")
+    db_config = gc.get_conf(my_wxid, "db_config")
+    if db_config.get("type", "sqlite") != "sqlite":
+        return ReJson(1002, body="只支持合并后的数据库")
+    code, ret = build_msg_fts(db_config.get("path", ""))
+    if not code:
+        return ReJson(2001, body=ret)
+    return ReJson(0, {"count": ret})
+
+
 @rs_api.get('/imgsrc')
 @asyncError9999
 async def get_imgsrc(request: Request):
@@ -266,7 +314,7 @@ def get_audio(request: Request):
     if not os.path.exists(os.path.dirname(savePath)):
         os.makedirs(os.path.dirname(savePath))
 
-    db = DBHandler(db_config, my_wxid=my_wxid)
+    db = get_db_handler(db_config, my_wxid=my_wxid)
     wave_data = db.get_audio(MsgSvrID, is_play=False, is_wave=True, save_path=savePath, rate=24000)
     if not wave_data:
         return ReJson(1001, body="wave_data is required")
@@ -368,10 +416,14 @@ def get_export_endb(request: ExportEndbRequest):
     return ReJson(0, body=outpath)
 
 
+export_dedb_progress = {}  # 导出解密数据库的最新进度事件 {my_wxid: event}，由 /export_dedb_progress 轮询
+
+
 class ExportDedbRequest(BaseModel):
     wx_path: str = ""
     outpath: str = ""
     key: str = ""
+    workers: int = 1  # 并行解密、合并的进程数，参考 decrypt_merge
 
 
 @rs_api.api_route('/export_dedb', methods=["GET", "POST"])
@@ -402,14 +454,58 @@ def get_export_dedb(request: ExportDedbRequest):
     if not os.path.exists(outpath):
         os.makedirs(outpath)
     assert isinstance(outpath, str)
-    code, merge_save_path = decrypt_merge(wx_path=wx_path, key=key, outpath=outpath)
-    time.sleep(1)
+    export_dedb_progress[my_wxid] = {"phase": "start"}
+    code, merge_save_path = decrypt_merge(wx_path=wx_path, key=key, outpath=outpath, workers=request.workers,
+                                          progress_callback=lambda event: export_dedb_progress.update({my_wxid: event}))
     if code:
         return ReJson(0, body=merge_save_path)
     else:
+        export_dedb_progress[my_wxid] = {"phase": "error", "error": str(merge_save_path)}
         return ReJson(2001, body=merge_save_path)
 
 
+@rs_api.api_route('/export_dedb_estimate', methods=["GET", "POST"])
+@error9999
+def get_export_dedb_estimate(request: ExportDedbRequest):
+    """
+    导出解密数据库前的预估(只解密 sqlite_master 和抽样的页)：每个数据库各表的行数，以及输出大小、磁盘占用和耗时
+    :return:
+    """
+    key = request.key
+    wx_path = request.wx_path
+
+    my_wxid = gc.get_conf(gc.at, "last")
+    if not my_wxid: return ReJson(1001, body="my_wxid is required")
+
+    if not key:
+        key = gc.get_conf(my_wxid, "key")
+    if not wx_path:
+        wx_path = gc.get_conf(my_wxid, "wx_path")
+    if not key:
+        return ReJson(1002, body=f"key is required: {key}")
+    if not wx_path or not os.path.exists(wx_path):
+        return ReJson(1001, body=f"wx_path not exists: {wx_path}")
+
+    code, ret = estimate_decrypt_merge(wx_path=wx_path, key=key) or (False, "estimate error")
+    if code:
+        return ReJson(0, body=ret)
+    else:
+        return ReJson(2001, body=ret)
+
+
+@rs_api.api_route('/export_dedb_progress', methods=["GET", "POST"])
+@error9999
+def get_export_dedb_progress():
+    """
+    导出解密数据库的进度，在 /export_dedb 执行期间轮询
+    :return: {"phase": 阶段, "db": 数据库, "table": 表名, "rows": 行数, "bytes": 已处理字节数, "total_bytes": 总字节数,
+              "elapsed": 已用时间(秒), "eta": 预计剩余时间(秒)}，完成(done)时 tables 为各表的行数和用时；未开始时为空
+    """
+    my_wxid = gc.get_conf(gc.at, "last")
+    if not my_wxid: return ReJson(1001, body="my_wxid is required")
+    return ReJson(0, body=export_dedb_progress.get(my_wxid, {}))
+
+
 @rs_api.api_route('/export_csv', methods=["GET", 'POST'])
 def get_export_csv(wxid: str = Body(..., embed=True)):
     """
@@ -524,7 +620,7 @@ def get_date_count(request: DateCountRequest):
     my_wxid = gc.get_conf(gc.at, "last")
     if not my_wxid: return ReJson(1001, body="my_wxid is required")
     db_config = gc.get_conf(my_wxid, "db_config")
-    db = DBHandler(db_config, my_wxid=my_wxid)
+    db = get_db_handler(db_config, my_wxid=my_wxid)
     date_count = db.get_date_count(wxid=wxid, start_time=start_time, end_time=end_time, time_format=time_format)
     return ReJson(0, date_count)
 
@@ -548,8 +644,8 @@ def get_top_talker_count(request: TopTalkerCountRequest):
     my_wxid = gc.get_conf(gc.at, "last")
     if not my_wxid: return ReJson(1001, body="my_wxid is required")
     db_config = gc.get_conf(my_wxid, "db_config")
-    date_count = DBHandler(db_config, my_wxid=my_wxid).get_top_talker_count(top=top, start_time=start_time,
-                                                                            end_time=end_time)
+    date_count = get_db_handler(db_config, my_wxid=my_wxid).get_top_talker_count(top=top, start_time=start_time,
+                                                                                 end_time=end_time)
     return ReJson(0, date_count)
 
 
@@ -572,7 +668,7 @@ def get_wordcloud(request: WordCloudRequest):
     my_wxid = gc.get_conf(gc.at, "last")
     if not my_wxid: return ReJson(1001, body="my_wxid is required")
     db_config = gc.get_conf(my_wxid, "db_config")
-    db = DBHandler(db_config, my_wxid=my_wxid)
+    db = get_db_handler(db_config, my_wxid=my_wxid)
 
     if target == "signature":
         users = db.get_user()
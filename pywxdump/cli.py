@@ -185,6 +185,8 @@ class MainDecrypt(BaseSubMainClass):
         parser.add_argument("-o", "--out_path", type=str, default=os.path.join(os.getcwd(), "decrypted"),
                             help="输出路径(必须是目录)[默认为当前路径下decrypted文件夹]", required=False,
                             metavar="")
+        parser.add_argument("-w", "--workers", type=int, default=1,
+                            help="(可选)并行解密的进程数[默认为1，0表示使用全部CPU核心]", required=False, metavar="")
         return parser
 
     def run(self, args):
@@ -193,6 +195,7 @@ class MainDecrypt(BaseSubMainClass):
         key = args.key
         db_path = args.db_path
         out_path = args.out_path
+        workers = args.workers
 
         if not os.path.exists(db_path):
             print(f"[-] 数据库路径不存在：{db_path}")
@@ -203,7 +206,7 @@ class MainDecrypt(BaseSubMainClass):
             print(f"[+] 创建输出文件夹：{out_path}")
 
         # 调用 decrypt 函数，并传入参数
-        result = batch_decrypt(key, db_path, out_path, True)
+        result = batch_decrypt(key, db_path, out_path, True, workers=workers)
         return result
 
 
@@ -219,6 +222,10 @@ class MainMerge(BaseSubMainClass):
                             help="输出路径(目录或文件名)[默认为当前路径下decrypted文件夹下merge_***.db]",
                             required=False,
                             metavar="")
+        parser.add_argument("--partition", type=str, choices=["year", "quarter"], default=None,
+                            help="MSG 按年或季度分区保存(MSG 为所有分区的视图)[默认不分区]", required=False)
+        parser.add_argument("--fts", action="store_true", default=False,
+                            help="建立聊天记录的全文索引(用于搜索聊天记录)", required=False)
         return parser
 
     def run(self, args):
@@ -245,7 +252,7 @@ class MainMerge(BaseSubMainClass):
 
         print(f"[*] 合并中...（用时较久，耐心等待）")
         dbpaths = [{"db_path": i} for i in dbpaths if os.path.exists(i)]  # 去除不存在的路径
-        result = merge_db(dbpaths, out_path)
+        result = merge_db(dbpaths, out_path, partition=args.partition, fts=args.fts)
 
         print(f"[+] 合并完成：{result}")
         return result
@@ -5,7 +5,12 @@
 # Author:       xaoyaoo
 # Date:         2024/04/15
 # -------------------------------------------------------------------------------
-from .utils import download_file, dat2img
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .utils import download_file, dat2img, db_loger, encode_cursor, decode_cursor
 
 from .dbFavorite import FavoriteHandler
 from .dbMSG import MsgHandler
@@ -21,16 +26,22 @@ class DBHandler(MicroHandler, MediaHandler, OpenIMContactHandler, PublicMsgHandl
                 FavoriteHandler, SnsHandler):
     _class_name = "DBHandler"
 
-    def __init__(self, db_config, my_wxid, *args, **kwargs):
+    def __init__(self, db_config, my_wxid, add_index=True, *args, **kwargs):
+        """
+        :param db_config: 数据库配置，参考 DatabaseBase
+        :param my_wxid: 当前登录的wxid
+        :param add_index: 是否创建加速查询的索引；多次创建同一数据库的 DBHandler 时使用 get_db_handler，只创建一次
+        """
         self.config = db_config
         self.my_wxid = my_wxid
 
         super().__init__(self.config)
-        # 加速查询索引
-        self.Micro_add_index()
-        self.Msg_add_index()
-        self.PublicMsg_add_index()
-        self.Media_add_index()
+        # 加速查询索引（直接读取的加密数据库为只读，无法创建索引）
+        if add_index and self.config.get("type") != "sqlite_encrypted":
+            self.Micro_add_index()
+            self.Msg_add_index()
+            self.PublicMsg_add_index()
+            self.Media_add_index()
 
     def get_user(self, word=None, wxids=None, labels=None):
         """
@@ -73,6 +84,88 @@ class DBHandler(MicroHandler, MediaHandler, OpenIMContactHandler, PublicMsgHandl
         users = self.get_user(wxids=wxid_list)
         return msgs, users
 
+    def _get_msgs_page(self, state: dict, page_size=500, wxids: list or str = "", msg_type: str = "",
+                       msg_sub_type: str = "", start_createtime=None, end_createtime=None):
+        """
+        从 state 记录的位置读取一页聊天记录(MSG 和 PublicMsg 按 CreateTime 合并排序)，并把 state 更新到这一页之后
+        :param state: 读取位置 {"m": MSG 的 [CreateTime, rowid], "p": PublicMsg 的 [CreateTime, rowid], "n": 已读取的条数}
+        :return: (聊天记录列表(格式同 get_msgs), 是否还有下一页)
+        """
+        offset = int(state.get("n", 0))  # 之前各页的消息数，用于生成消息的 id
+        sources = (("m", "MSG"), ("p", "PublicMsg"))
+        rows = []
+        has_more = False
+        for order, (source, table) in enumerate(sources):
+            part = self.get_msg_rows_by_cursor(table, wxids=wxids, after=state.get(source), page_size=page_size,
+                                               msg_type=msg_type, msg_sub_type=msg_sub_type,
+                                               start_createtime=start_createtime,
+                                               end_createtime=end_createtime) or []
+            has_more = has_more or len(part) >= page_size
+            rows += [(row[5] is not None, row[5] or 0, order, row[-1], source, row) for row in part]
+        rows.sort(key=lambda r: r[:4])  # 与 SQL 的排序一致：CreateTime 为空的在前，相同时先 MSG 后 PublicMsg
+        has_more = has_more or len(rows) > page_size
+        rows = rows[:page_size]
+
+        msgs = []
+        for i, (_, _, _, rowid, source, row) in enumerate(rows):
+            state[source] = [row[5], rowid]
+            msgs.append(self.get_msg_detail(row[:-1] + (offset + i + 1,), my_talker=self.my_wxid))
+        state["n"] = offset + len(msgs)
+        return msgs, has_more and bool(msgs)
+
+    def get_msgs_by_cursor(self, wxids: list or str = "", cursor: str = None, page_size=500, msg_type: str = "",
+                           msg_sub_type: str = "", start_createtime=None, end_createtime=None):
+        """
+        按游标分页获取聊天记录(MSG 和 PublicMsg 按 CreateTime 合并排序)，每页耗时与页码无关
+        :param wxids: [wxid]
+        :param cursor: 上一页返回的游标，为空时从第一页开始
+        :param page_size: 页大小
+        :param msg_type: 消息类型
+        :param msg_sub_type: 消息子类型
+        :param start_createtime: 开始时间
+        :param end_createtime: 结束时间
+        :return: (聊天记录列表(格式同 get_msgs), 用户dict, 下一页的游标(没有下一页时为 None))；游标格式错误时抛出 ValueError
+        """
+        state = decode_cursor(cursor) if cursor else {}
+        msgs, has_more = self._get_msgs_page(state, page_size, wxids=wxids, msg_type=msg_type,
+                                             msg_sub_type=msg_sub_type, start_createtime=start_createtime,
+                                             end_createtime=end_createtime)
+        users = self.get_user(wxids=list({msg["talker"] for msg in msgs})) if msgs else {}
+        return msgs, users, encode_cursor(state) if has_more else None
+
+    def iter_msgs(self, wxids: list or str = "", start_createtime=None, end_createtime=None, batch_size=1000,
+                  msg_type: str = "", msg_sub_type: str = "", user_cache_size=1000):
+        """
+        逐条读取聊天记录的生成器(MSG 和 PublicMsg 按 CreateTime 合并排序)，每次从数据库读取 batch_size 条，
+        内存占用与聊天记录总数无关，适合导出和统计
+        :param wxids: [wxid]
+        :param start_createtime: 开始时间
+        :param end_createtime: 结束时间
+        :param batch_size: 每批读取的条数
+        :param msg_type: 消息类型
+        :param msg_sub_type: 消息子类型
+        :param user_cache_size: 联系人缓存的最大数量(LRU)，每批只查询缓存中没有的联系人
+        :return: 生成 (聊天记录(格式同 get_msgs), 发送者的联系人信息(没有时为 {}))
+        """
+        users = OrderedDict()  # {wxid: 联系人信息}
+        state = {}
+        has_more = True
+        while has_more:
+            msgs, has_more = self._get_msgs_page(state, batch_size, wxids=wxids, msg_type=msg_type,
+                                                 msg_sub_type=msg_sub_type, start_createtime=start_createtime,
+                                                 end_createtime=end_createtime)
+            talkers = {msg["talker"] for msg in msgs}
+            missing = [wxid for wxid in talkers if wxid not in users]
+            if missing:
+                found = self.get_user(wxids=missing) or {}
+                users.update({wxid: found.get(wxid, {}) for wxid in missing})  # 不存在的联系人也缓存，避免重复查询
+            for wxid in talkers:
+                users.move_to_end(wxid)
+            while len(users) > max(user_cache_size, len(talkers)):  # 当前批次用到的联系人不淘汰
+                users.popitem(last=False)
+            for msg in msgs:
+                yield msg, users[msg["talker"]]
+
     def get_msgs_count(self, wxids: list = ""):
         chat_count = self.get_m_msg_count(wxids)
         chat_count1 = self.get_plc_msg_count(wxids)
@@ -82,5 +175,48 @@ class DBHandler(MicroHandler, MediaHandler, OpenIMContactHandler, PublicMsgHandl
         return count
 
 
-__all__ = ["DBHandler", "FavoriteHandler", "MsgHandler", "MicroHandler", "MediaHandler",
+_db_handlers = {}  # {(db_config, my_wxid): (文件标识, DBHandler)}
+_db_handlers_lock = threading.Lock()
+
+
+def _db_file_id(db_config):
+    """
+    数据库文件标识 (st_dev, st_ino, st_size, st_mtime_ns)，文件被替换或修改后变化；非文件数据库返回 None
+    """
+    db_path = db_config.get("path", "")
+    if not db_path:
+        return None
+    stat = os.stat(db_path)  # 文件不存在时抛出 FileNotFoundError，与 DBHandler 一致
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def get_db_handler(db_config, my_wxid):
+    """
+    获取(或创建) DBHandler，进程内按 (db_config, my_wxid) 复用：索引创建和表信息读取只在第一次或数据库文件变化后执行
+    :param db_config: 数据库配置，参考 DatabaseBase
+    :param my_wxid: 当前登录的wxid
+    :return: DBHandler
+    """
+    key = (json.dumps(db_config, sort_keys=True, default=str), my_wxid)
+    file_id = _db_file_id(db_config)
+    with _db_handlers_lock:
+        cached = _db_handlers.get(key)
+        if cached and cached[0] == file_id:
+            return cached[1]
+        db = DBHandler(db_config, my_wxid=my_wxid)
+        _db_handlers[key] = (_db_file_id(db_config), db)  # 创建索引会修改文件，创建后再读取文件标识
+        if cached:
+            db_loger.info(f"数据库已变化，重新创建 DBHandler: {db_config.get('path', '')}")
+    return db
+
+
+def clear_db_handlers():
+    """
+    清空 get_db_handler 的缓存(不关闭连接池)
+    """
+    with _db_handlers_lock:
+        _db_handlers.clear()
+
+
+__all__ = ["DBHandler", "get_db_handler", "clear_db_handlers", "FavoriteHandler", "MsgHandler", "MicroHandler", "MediaHandler",
            "OpenIMContactHandler", "PublicMsgHandler", "OpenIMMediaHandler", "SnsHandler"]
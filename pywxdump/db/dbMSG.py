@@ -12,7 +12,10 @@ import lz4.block
 import blackboxprotobuf
 
 from .dbbase import DatabaseBase
-from .utils import db_error, timestamp2str, xml2dict, match_BytesExtra, type_converter
+from .utils import db_error, db_loger, timestamp2str, xml2dict, match_BytesExtra, type_converter, FTS_TABLE, \
+    FTS_META_TABLE, fts_query, fts_unsplit
+
+FTS_SORT_LIMIT = 2000  # 全文搜索命中的行数不超过该值时直接排序，否则按 CreateTime 索引的顺序扫描
 
 
 class MsgHandler(DatabaseBase):
@@ -26,9 +29,42 @@ class MsgHandler(DatabaseBase):
         # 检查是否存在索引
         if not self.tables_exist("MSG"):
             return
-        self.execute("CREATE INDEX IF NOT EXISTS idx_MSG_StrTalker ON MSG(StrTalker);")
-        self.execute("CREATE INDEX IF NOT EXISTS idx_MSG_CreateTime ON MSG(CreateTime);")
-        self.execute("CREATE INDEX IF NOT EXISTS idx_MSG_StrTalker_CreateTime ON MSG(StrTalker, CreateTime);")
+        # 按时间分区时 MSG 为视图，索引建在各个分区表上
+        tables = [name for name, _, _ in self.get_msg_partitions()] or ["MSG"]
+        sqls = []
+        for table in tables:
+            sqls.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_StrTalker ON {table}(StrTalker);")
+            sqls.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_CreateTime ON {table}(CreateTime);")
+            sqls.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_StrTalker_CreateTime "
+                        f"ON {table}(StrTalker, CreateTime);")
+        self.execute_write_many(sqls)
+
+    def get_msg_partitions(self):
+        """
+        获取 MSG 的时间分区(merge_db 的 partition 参数)，未分区时返回空列表
+        :return: [(分区表名, 开始时间戳, 结束时间戳(不包含)),...] 按时间排序
+        """
+        if "msg_partitions" not in self.existed_tables:  # 不用 tables_exist，未分区时不记录警告
+            return []
+        return self.execute("SELECT name, start_time, end_time FROM msg_partitions ORDER BY start_time;") or []
+
+    def msg_source(self, start_time=None, end_time=None):
+        """
+        查询消息时 FROM 的表：未分区时为 MSG；按时间分区时只包含与 [start_time, end_time] 相交的分区
+        :param start_time: 开始时间戳，为空表示不限制
+        :param end_time: 结束时间戳，为空表示不限制
+        :return: 表名或子查询
+        """
+        partitions = self.get_msg_partitions()
+        tables = [name for name, p_start, p_end in partitions
+                  if (not end_time or p_start <= end_time) and (not start_time or p_end > start_time)]
+        if not partitions or len(tables) == len(partitions):
+            return "MSG"
+        if not tables:  # 时间范围内没有分区，保留列信息，查询结果为空
+            return f"(SELECT * FROM {partitions[0][0]} WHERE 0 = 1)"
+        if len(tables) == 1:
+            return tables[0]
+        return "(" + " UNION ALL ".join(f"SELECT * FROM {table}" for table in tables) + ")"
 
     @db_error
     def get_m_msg_count(self, wxids: list = ""):
@@ -97,7 +133,7 @@ class MsgHandler(DatabaseBase):
             "MsgSequence,StrContent,MsgServerSeq,StrTalker,DisplayContent,Reserved0,Reserved1,Reserved3,"
             "Reserved4,Reserved5,Reserved6,CompressContent,BytesExtra,BytesTrans,Reserved2,"
             "ROW_NUMBER() OVER (ORDER BY CreateTime ASC) AS id "
-            "FROM MSG WHERE 1=1 "
+            f"FROM {self.msg_source(start_createtime, end_createtime)} WHERE 1=1 "
             f"{sql_wxid}"
             f"{sql_type}"
             f"{sql_sub_type}"
@@ -115,6 +151,140 @@ class MsgHandler(DatabaseBase):
         wxid_list = {d['talker'] for d in rdata}  # 创建一个无重复的 wxid 列表
         return rdata, list(wxid_list)
 
+    @db_error
+    def get_msg_rows_by_cursor(self, table="MSG", wxids: list or str = "", after=None, page_size=500,
+                               msg_type: str = "", msg_sub_type: str = "", start_createtime=None,
+                               end_createtime=None):
+        """
+        按 (CreateTime, rowid) 的位置分页(keyset)读取聊天记录的原始行，翻到第N页与第一页的耗时相同
+        :param table: MSG 或 PublicMsg
+        :param wxids: [wxid]
+        :param after: 上一页最后一行的 (CreateTime, rowid)，为空时从头开始；按时间分区时分区之间 CreateTime 不重叠，
+                      (CreateTime, rowid) 仍然唯一
+        :param page_size: 页大小
+        :param msg_type: 消息类型
+        :param msg_sub_type: 消息子类型
+        :param start_createtime: 开始时间
+        :param end_createtime: 结束时间
+        :return: 原始行列表，最后一列为 rowid，按 (CreateTime, rowid) 排序
+        """
+        if not self.tables_exist(table):
+            return []
+
+        if isinstance(wxids, str) and wxids:
+            wxids = [wxids]
+        param = ()
+        sql_wxid, param = (f"AND StrTalker in ({', '.join('?' for _ in wxids)}) ",
+                           param + tuple(wxids)) if wxids else ("", param)
+        sql_type, param = ("AND Type=? ", param + (msg_type,)) if msg_type else ("", param)
+        sql_sub_type, param = ("AND SubType=? ", param + (msg_sub_type,)) if msg_type and msg_sub_type else ("", param)
+        sql_start_createtime, param = ("AND CreateTime>=? ", param + (start_createtime,)) if start_createtime else (
+            "", param)
+        sql_end_createtime, param = ("AND CreateTime<=? ", param + (end_createtime,)) if end_createtime else ("", param)
+        if not after:
+            sql_after = ""
+        elif after[0] is None:  # CreateTime 为空的行排在最前面
+            sql_after, param = "AND (CreateTime IS NOT NULL OR _rowid>?) ", param + (after[1],)
+        else:
+            sql_after, param = "AND (CreateTime, _rowid)>(?, ?) ", param + tuple(after)
+
+        # 按时间分区时分区互不重叠，按时间顺序逐个分区读取，读满一页即停止，避免对所有分区的结果排序
+        tables = [table]
+        partitions = self.get_msg_partitions() if table == "MSG" else []
+        if partitions:
+            start_time = max(start_createtime or 0, (after or (0,))[0] or 0)
+            tables = [name for name, p_start, p_end in partitions
+                      if (not end_createtime or p_start <= end_createtime) and (not start_time or p_end > start_time)]
+
+        rows = []
+        for source in tables:
+            sql = (
+                "SELECT localId,TalkerId,MsgSvrID,Type,SubType,CreateTime,IsSender,Sequence,StatusEx,FlagEx,Status,"
+                "MsgSequence,StrContent,MsgServerSeq,StrTalker,DisplayContent,Reserved0,Reserved1,Reserved3,"
+                "Reserved4,Reserved5,Reserved6,CompressContent,BytesExtra,BytesTrans,Reserved2,_rowid "
+                f"FROM (SELECT rowid AS _rowid, * FROM {source}) WHERE 1=1 "
+                f"{sql_wxid}"
+                f"{sql_type}"
+                f"{sql_sub_type}"
+                f"{sql_start_createtime}"
+                f"{sql_end_createtime}"
+                f"{sql_after}"
+                f"ORDER BY CreateTime ASC, _rowid ASC LIMIT ?"
+            )
+            rows += self.execute(sql, param + (page_size - len(rows),)) or []
+            if len(rows) >= page_size:
+                break
+        return rows
+
+    @db_error
+    def search_msgs(self, query: str, wxid: str = "", start_time: int = 0, end_time: int = 0, limit: int = 50,
+                    offset: int = 0, highlight=("<em>", "</em>"), my_talker="我"):
+        """
+        全文搜索聊天记录(需要先建立全文索引，参考 pywxdump.wx_core.msg_fts)，按时间倒序
+        :param query: 关键词，多个关键词用空格分隔(同时包含)，中文按连续的字匹配
+        :param wxid: 只搜索该联系人或群的聊天记录，为空时搜索全部
+        :param start_time: 开始时间戳，为0表示不限制
+        :param end_time: 结束时间戳，为0表示不限制
+        :param limit: 返回的条数
+        :param offset: 跳过的条数
+        :param highlight: 关键词高亮的前后标记
+        :param my_talker: 我
+        :return: (聊天记录列表(格式同 get_msg_list，增加 "snippet": 关键词附近的文本), wxid列表)；没有全文索引时返回 ([], [])
+        """
+        if FTS_TABLE not in self.existed_tables:  # 不用 tables_exist，避免每次搜索都记录警告
+            db_loger.warning(f"未建立全文索引: {self.config.get('path', '')}")
+            return [], []
+        match = fts_query(query)
+        if not match:
+            return [], []
+
+        param = (match,)
+        sql_wxid, param = ("AND StrTalker=? ", param + (wxid,)) if wxid else ("", param)
+        sql_start_time, param = ("AND CreateTime>=? ", param + (start_time,)) if start_time else ("", param)
+        sql_end_time, param = ("AND CreateTime<=? ", param + (end_time,)) if end_time else ("", param)
+        # 在 FTS_META_TABLE 中按联系人、时间过滤和排序，只对返回的行读取全文索引的内容并生成 snippet。
+        # 命中的行不多时按主键读取后排序；命中很多时按 CreateTime 索引的顺序扫描，取满一页即停止，不对所有命中的行排序
+        # (fts_rowid 前的 + 使该条件不使用主键)
+        sql_hits = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? LIMIT ?"
+        is_many_hits = len(self.execute(sql_hits, (match, FTS_SORT_LIMIT + 1)) or []) > FTS_SORT_LIMIT
+        sql = (
+            f"SELECT tbl, msg_rowid, snippet({FTS_TABLE}, 0, ?, ?, '...', 24) FROM ("
+            f"SELECT fts_rowid, CreateTime FROM {FTS_META_TABLE} "
+            f"WHERE {'+' if is_many_hits else ''}fts_rowid IN "
+            f"(SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?) "
+            f"{sql_wxid}"
+            f"{sql_start_time}"
+            f"{sql_end_time}"
+            f"ORDER BY CreateTime DESC, fts_rowid DESC LIMIT ? OFFSET ?) AS m "
+            f"CROSS JOIN {FTS_TABLE} ON {FTS_TABLE}.rowid = m.fts_rowid "  # 按 rowid 逐行读取，不再扫描全部命中的行
+            f"WHERE {FTS_TABLE} MATCH ? "
+            f"ORDER BY m.CreateTime DESC, m.fts_rowid DESC"
+        )
+        hits = self.execute(sql, (highlight[0], highlight[1]) + param + (limit, offset, match)) or []
+
+        rows = {}
+        for tbl in {tbl for tbl, _, _ in hits}:
+            if tbl.lower() not in self.existed_tables:
+                continue
+            rowids = [rowid for t, rowid, _ in hits if t == tbl]
+            sql = (
+                "SELECT localId,TalkerId,MsgSvrID,Type,SubType,CreateTime,IsSender,Sequence,StatusEx,FlagEx,Status,"
+                "MsgSequence,StrContent,MsgServerSeq,StrTalker,DisplayContent,Reserved0,Reserved1,Reserved3,"
+                "Reserved4,Reserved5,Reserved6,CompressContent,BytesExtra,BytesTrans,Reserved2,rowid "
+                f"FROM {tbl} WHERE rowid IN ({', '.join('?' for _ in rowids)})"
+            )
+            rows.update({(tbl, row[-1]): row for row in self.execute(sql, tuple(rowids)) or []})
+
+        rdata = []
+        for i, (tbl, rowid, snippet) in enumerate(hits):
+            row = rows.get((tbl, rowid))
+            if row is None:
+                continue
+            msg = self.get_msg_detail(row[:-1] + (offset + i + 1,), my_talker=my_talker)
+            msg["snippet"] = fts_unsplit(snippet)
+            rdata.append(msg)
+        return rdata, list({d['talker'] for d in rdata})
+
     @db_error
     def get_date_count(self, wxid='', start_time: int = 0, end_time: int = 0, time_format='%Y-%m-%d'):
         """
@@ -143,7 +313,7 @@ class MsgHandler(DatabaseBase):
                "       COUNT(*) AS total_count ,"
                "       SUM(CASE WHEN IsSender = 1 THEN 1 ELSE 0 END) AS sender_count, "
                "       SUM(CASE WHEN IsSender = 0 THEN 1 ELSE 0 END) AS receiver_count "
-               "FROM MSG "
+               f"FROM {self.msg_source(start_time, end_time) if sql_time else 'MSG'} "
                "WHERE StrTalker NOT LIKE '%chatroom%' "
                f"{sql_wxid} {sql_time} "
                f"GROUP BY date ORDER BY date ASC;")
@@ -184,7 +354,7 @@ class MsgHandler(DatabaseBase):
             "SELECT StrTalker, COUNT(*) AS count,"
             "SUM(CASE WHEN IsSender = 1 THEN 1 ELSE 0 END) AS sender_count, "
             "SUM(CASE WHEN IsSender = 0 THEN 1 ELSE 0 END) AS receiver_count "
-            "FROM MSG "
+            f"FROM {self.msg_source(start_time, end_time) if sql_time else 'MSG'} "
             "WHERE StrTalker NOT LIKE '%chatroom%' "
             f"{sql_time} "
             "GROUP BY StrTalker ORDER BY count DESC "
@@ -22,37 +22,38 @@ class MicroHandler(DatabaseBase):
         """
         添加索引, 加快查询速度
         """
+        sqls = []
         # 为 Session 表添加索引
         if self.tables_exist("Session"):
-            self.execute("CREATE INDEX IF NOT EXISTS idx_Session_strUsrName_nTime ON Session(strUsrName, nTime);")
-            self.execute("CREATE INDEX IF NOT EXISTS idx_Session_nOrder ON Session(nOrder);")
-            self.execute("CREATE INDEX IF NOT EXISTS idx_Session_nTime ON Session(nTime);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_Session_strUsrName_nTime ON Session(strUsrName, nTime);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_Session_nOrder ON Session(nOrder);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_Session_nTime ON Session(nTime);")
 
         # 为 Contact 表添加索引
 
         if self.tables_exist("Contact"):
-            self.execute("CREATE INDEX IF NOT EXISTS idx_Contact_UserName ON Contact(UserName);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_Contact_UserName ON Contact(UserName);")
 
         # 为 ContactHeadImgUrl 表添加索引
         if self.tables_exist('ContactHeadImgUrl'):
-            self.execute("CREATE INDEX IF NOT EXISTS idx_ContactHeadImgUrl_usrName ON ContactHeadImgUrl(usrName);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_ContactHeadImgUrl_usrName ON ContactHeadImgUrl(usrName);")
 
         # 为 ChatInfo 表添加索引
         if self.tables_exist('ChatInfo'):
-            self.execute("CREATE INDEX IF NOT EXISTS idx_ChatInfo_Username_LastReadedCreateTime "
-                         "ON ChatInfo(Username, LastReadedCreateTime);")
-            self.execute(
-                "CREATE INDEX IF NOT EXISTS idx_ChatInfo_LastReadedCreateTime ON ChatInfo(LastReadedCreateTime);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_ChatInfo_Username_LastReadedCreateTime "
+                        "ON ChatInfo(Username, LastReadedCreateTime);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_ChatInfo_LastReadedCreateTime ON ChatInfo(LastReadedCreateTime);")
 
         # 为 Contact 表添加复合索引
         if self.tables_exist('Contact'):
-            self.execute("CREATE INDEX IF NOT EXISTS idx_Contact_search "
-                         "ON Contact(UserName, NickName, Remark, Alias, QuanPin, PYInitial, RemarkQuanPin, RemarkPYInitial);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_Contact_search "
+                        "ON Contact(UserName, NickName, Remark, Alias, QuanPin, PYInitial, RemarkQuanPin, RemarkPYInitial);")
 
         # 为 ChatRoom 和 ChatRoomInfo 表添加索引
         if self.tables_exist(['ChatRoomInfo', "ChatRoom"]):
-            self.execute("CREATE INDEX IF NOT EXISTS idx_ChatRoom_ChatRoomName ON ChatRoom(ChatRoomName);")
-            self.execute("CREATE INDEX IF NOT EXISTS idx_ChatRoomInfo_ChatRoomName ON ChatRoomInfo(ChatRoomName);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_ChatRoom_ChatRoomName ON ChatRoom(ChatRoomName);")
+            sqls.append("CREATE INDEX IF NOT EXISTS idx_ChatRoomInfo_ChatRoomName ON ChatRoomInfo(ChatRoomName);")
+        self.execute_write_many(sqls)  # 一个连接、一个事务中创建所有索引，某个索引失败时不影响其他索引
 
     @db_error
     def get_labels(self, id_is_key=True):
@@ -20,12 +20,11 @@ class PublicMsgHandler(MsgHandler):
         # 检查是否存在索引
         if not self.tables_exist("PublicMsg"):
             return
-        sql = "CREATE INDEX IF NOT EXISTS idx_PublicMsg_StrTalker ON PublicMsg(StrTalker);"
-        self.execute(sql)
-        sql = "CREATE INDEX IF NOT EXISTS idx_PublicMsg_CreateTime ON PublicMsg(CreateTime);"
-        self.execute(sql)
-        sql = "CREATE INDEX IF NOT EXISTS idx_PublicMsg_StrTalker_CreateTime ON PublicMsg(StrTalker, CreateTime);"
-        self.execute(sql)
+        self.execute_write_many([
+            "CREATE INDEX IF NOT EXISTS idx_PublicMsg_StrTalker ON PublicMsg(StrTalker);",
+            "CREATE INDEX IF NOT EXISTS idx_PublicMsg_CreateTime ON PublicMsg(CreateTime);",
+            "CREATE INDEX IF NOT EXISTS idx_PublicMsg_StrTalker_CreateTime ON PublicMsg(StrTalker, CreateTime);",
+        ])
 
     @db_error
     def get_plc_msg_count(self, wxids: list = ""):
@@ -8,7 +8,9 @@
 import importlib
 import os
 import sqlite3
+import threading
 import time
+from urllib.parse import quote
 
 from .utils import db_loger
 from dbutils.pooled_db import PooledDB
@@ -19,6 +21,193 @@ from dbutils.pooled_db import PooledDB
 # db_loger = logging.getLogger("db_prepare")
 
 
+class SqliteConnection:
+    """
+    SqlitePool 分配给当前线程的连接，接口与 PooledDB 返回的连接相同；close() 只恢复状态，不关闭底层连接
+    """
+
+    def __init__(self, pool, con):
+        self._pool = pool
+        self._con = con
+
+    def cursor(self):
+        return self._con.cursor()
+
+    @property
+    def text_factory(self):
+        return self._con.text_factory
+
+    @text_factory.setter
+    def text_factory(self, value):
+        self._con.text_factory = value
+
+    def commit(self):
+        self._con.commit()
+
+    def rollback(self):
+        self._con.rollback()
+
+    def ping(self):
+        """
+        健康检查：连接不可用时丢弃，下次使用时重新连接
+        :return: 连接是否可用
+        """
+        return self._pool.ping(self._con)
+
+    def close(self):
+        self._con.text_factory = str  # 查询失败时 execute 可能没有恢复 text_factory
+
+
+class SqlitePool:
+    """
+    SQLite 只读连接池：每个线程持有一个长期复用的只读连接(mode=ro)，保留页缓存并启用 mmap，
+    避免每次查询都重新打开数据库、重新解析 schema；线程结束后其连接在下次建立新连接时关闭。
+    每次取连接时检查文件是否被替换(合并时 os.replace 生成新文件)，定期 ping 检查连接是否可用。
+    只读连接无法创建索引，写操作使用 write_connection() 打开的临时读写连接。
+    """
+
+    def __init__(self, db_path: str, mmap_size: int = 256 * 1024 * 1024, cache_size: int = 64 * 1024,
+                 ping_interval: float = 30):
+        """
+        :param db_path: 数据库路径
+        :param mmap_size: 内存映射的最大字节数，0 表示不使用 mmap
+        :param cache_size: 每个连接的页缓存大小(KB)
+        :param ping_interval: 健康检查的间隔(秒)
+        """
+        self.db_path = os.path.abspath(db_path)
+        self.uri = f"file:{quote(self.db_path.replace(chr(92), '/'))}?mode=ro"
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.ping_interval = ping_interval
+        self._local = threading.local()
+        self._connections = {}  # {线程id: (线程, 连接)}，用于统计和关闭
+        self._lock = threading.Lock()
+        self._generation = 0  # close() 后递增，各线程下次取连接时据此关闭自己的旧连接
+        self._stats = {"created": 0, "closed": 0, "queries": 0, "reconnects": 0, "pings": 0, "errors": 0,
+                       "writes": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _file_id(self):
+        stat = os.stat(self.db_path)
+        return stat.st_dev, stat.st_ino
+
+    def _open(self):
+        con = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        con.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        con.execute(f"PRAGMA cache_size=-{int(self.cache_size)}")
+        con.execute("PRAGMA temp_store=MEMORY")
+        thread = threading.current_thread()
+        with self._lock:
+            self._stats["created"] += 1
+            # 关闭已结束线程的连接
+            dead = [ident for ident, (t, _) in self._connections.items() if not t.is_alive()]
+            for ident in dead:
+                self._close_con(self._connections.pop(ident)[1])
+            self._connections[thread.ident] = (thread, con)
+        return con
+
+    def _close_con(self, con):
+        try:
+            con.close()
+        except Exception as e:
+            db_loger.warning(f"关闭连接失败: {self.db_path} {e}")
+        self._stats["closed"] += 1
+
+    def _discard(self):
+        """
+        关闭当前线程的连接；连接已被 close() 关闭(不在 _connections 中)时只清除引用
+        """
+        con = getattr(self._local, "con", None)
+        self._local.con = None
+        if con is None:
+            return
+        with self._lock:
+            ident = threading.get_ident()
+            if ident in self._connections and self._connections[ident][1] is con:
+                del self._connections[ident]
+                self._close_con(con)
+
+    def ping(self, con=None):
+        """
+        健康检查，失败时丢弃当前线程的连接
+        :return: 连接是否可用
+        """
+        con = con or getattr(self._local, "con", None)
+        if con is None:
+            return False
+        self._count("pings")
+        try:
+            con.execute("PRAGMA schema_version").fetchone()
+            self._local.last_ping = time.time()
+            return True
+        except sqlite3.Error as e:
+            db_loger.warning(f"数据库连接不可用，重新连接: {self.db_path} {e}")
+            self._count("errors")
+            self._discard()
+            return False
+
+    def connection(self):
+        """
+        获取当前线程的只读连接
+        :return: SqliteConnection
+        """
+        con = getattr(self._local, "con", None)
+        file_id = self._file_id()  # 文件不存在时抛出 FileNotFoundError
+        if con is not None and self._local.generation != self._generation:  # 连接池已 close()，关闭本线程的旧连接
+            self._discard()
+            con = None
+        elif con is not None and file_id != self._local.file_id:
+            db_loger.info(f"数据库文件已替换，重新连接: {self.db_path}")
+            self._count("reconnects")
+            self._discard()
+            con = None
+        elif con is not None and time.time() - self._local.last_ping > self.ping_interval and not self.ping(con):
+            self._count("reconnects")
+            con = None
+        if con is None:
+            con = self._local.con = self._open()
+            self._local.file_id = file_id
+            self._local.generation = self._generation
+            self._local.last_ping = time.time()
+        self._count("queries")
+        return SqliteConnection(self, con)
+
+    def write_connection(self):
+        """
+        打开一个临时的读写连接(创建索引等写操作)，使用后由调用者关闭
+        :return: sqlite3.Connection
+        """
+        self._count("writes")
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def stats(self):
+        """
+        连接池统计
+        :return: {"path", "connections": 当前打开的连接数, "threads": [持有连接的线程名], "created", "closed",
+                  "queries", "reconnects", "pings", "errors", "writes", "mmap_size", "cache_size"}
+        """
+        with self._lock:
+            threads = [t.name for t, _ in self._connections.values()]
+            return {"path": self.db_path, "connections": len(threads), "threads": threads, **self._stats,
+                    "mmap_size": self.mmap_size, "cache_size": self.cache_size}
+
+    def close(self):
+        """
+        关闭连接池：当前线程和已结束线程的连接立即关闭；其他线程的连接可能正在查询，
+        由各线程下次取连接时自行关闭(generation 已变化)，之后重新连接
+        """
+        ident = threading.get_ident()
+        with self._lock:
+            self._generation += 1
+            closing = [i for i, (t, _) in self._connections.items() if i == ident or not t.is_alive()]
+            for i in closing:
+                self._close_con(self._connections.pop(i)[1])
+        self._local.con = None
+
+
 class DatabaseSingletonBase:
     # _singleton_instances = {}  # 使用字典存储不同db_path对应的单例实例
     _class_name = "DatabaseSingletonBase"
@@ -47,14 +236,26 @@ class DatabaseSingletonBase:
             db_path = db_config.get("path", "")
             if not os.path.exists(db_path):
                 raise FileNotFoundError(f"文件不存在: {db_path}")
+            pool = SqlitePool(  # 每个线程复用一个只读连接，保留页缓存
+                db_path,
+                mmap_size=db_config.get("mmap_size", 256 * 1024 * 1024),
+                cache_size=db_config.get("cache_size", 64 * 1024),
+            )
+        elif db_type == "sqlite_encrypted":
+            db_path = db_config.get("path", "")
+            if not os.path.exists(db_path):
+                raise FileNotFoundError(f"文件不存在: {db_path}")
+            from pywxdump.wx_core.encrypted_vfs import EncryptedConnection  # 需要安装 apsw
             pool = PooledDB(
-                creator=sqlite3,  # 使用 sqlite3 作为连接创建者
-                maxconnections=0,  # 连接池最大连接数
-                mincached=4,  # 初始化时，链接池中至少创建的空闲的链接，0表示不创建
-                maxusage=1,  # 一个链接最多被重复使用的次数，None表示无限制
-                blocking=True,  # 连接池中如果没有可用连接后，是否阻塞等待。True，等待；False，不等待然后报错
-                ping=0,  # ping 数据库判断是否服务正常
-                database=db_path
+                creator=EncryptedConnection,  # 直接读取加密数据库，按需解密
+                maxconnections=0,
+                mincached=1,
+                maxusage=0,  # 复用连接，保留已解密的页缓存
+                blocking=True,
+                ping=0,
+                failures=EncryptedConnection.failures,
+                key=db_config.get("encrypt_key", ""),
+                db_path=db_path
             )
         elif db_type == "mysql":
             mysql_config = {
@@ -88,13 +289,21 @@ class DatabaseBase(DatabaseSingletonBase):
             "type": "sqlite",
             "path": r"C:\***\wxdump_work\merge_all.db"
         }
+        加密数据库可直接打开(需要安装 apsw)，无需先解密:
+        db_config = {
+            "key": "test2",
+            "type": "sqlite_encrypted",
+            "path": r"C:\***\WeChat Files\wxid_***\Msg\Multi\MSG0.db",
+            "encrypt_key": "64位16进制密钥"
+        }
         """
         self.config = db_config
         self.pool = self.connect(self.config)
         self.__get_existed_tables()
 
     def __get_existed_tables(self):
-        sql = "SELECT tbl_name FROM sqlite_master WHERE type = 'table' and tbl_name!='sqlite_sequence';"
+        # 包含视图：按时间分区合并的数据库中 MSG 为视图
+        sql = "SELECT tbl_name FROM sqlite_master WHERE type IN ('table', 'view') and tbl_name!='sqlite_sequence';"
         existing_tables = self.execute(sql)
         if existing_tables:
             self.existed_tables = [row[0].lower() for row in existing_tables]
@@ -146,17 +355,78 @@ class DatabaseBase(DatabaseSingletonBase):
                 return rdata
             except Exception as e2:
                 db_loger.error(f"{sql=}\n{params=}\n{e1=}\n{e2=}\n", exc_info=True)
+                if isinstance(connection, SqliteConnection):
+                    connection.ping()  # 连接已损坏时丢弃
                 return None
         finally:
             connection.close()
 
+    def execute_write(self, sql, params=None):
+        """
+        执行写操作(创建索引等)，sqlite 的查询连接为只读，写操作使用临时的读写连接
+        :param sql: SQL语句 (str)
+        :param params: 参数 (tuple)
+        :return: 是否成功 (bool)
+        """
+        return self.execute_write_many([(sql, params)])
+
+    def execute_write_many(self, sqls):
+        """
+        在同一个连接、同一个事务中执行多条写操作(如 *_add_index 中的多个 CREATE INDEX)，只提交一次；
+        每条语句单独回滚(sqlite 使用 SAVEPOINT)，一条失败时记录日志并继续执行其余语句
+        :param sqls: SQL语句列表，元素为 sql (str) 或 (sql, params)
+        :return: 是否全部成功 (bool)
+        """
+        sqls = [(sql, None) if isinstance(sql, str) else sql for sql in sqls]
+        if not sqls:
+            return True
+        is_sqlite = isinstance(self.pool, SqlitePool)
+        connection = self.pool.write_connection() if is_sqlite else self.pool.connection()
+        is_ok = True
+        try:
+            cursor = connection.cursor()
+            if is_sqlite:
+                cursor.execute("BEGIN")  # sqlite3 模块不会为 CREATE INDEX 等语句自动开启事务
+            for sql, params in sqls:
+                if is_sqlite:
+                    cursor.execute("SAVEPOINT execute_write")
+                try:
+                    if params:
+                        cursor.execute(sql, params)
+                    else:
+                        cursor.execute(sql)
+                    if is_sqlite:
+                        cursor.execute("RELEASE execute_write")
+                except Exception as e:
+                    db_loger.error(f"{sql=}\n{params=}\n{e=}\n", exc_info=True)
+                    if is_sqlite:
+                        cursor.execute("ROLLBACK TO execute_write")
+                        cursor.execute("RELEASE execute_write")
+                    is_ok = False
+            connection.commit()
+            return is_ok
+        except Exception as e:
+            db_loger.error(f"{e=}\n", exc_info=True)
+            connection.rollback()
+            return False
+        finally:
+            connection.close()
+
+    def pool_stats(self):
+        """
+        连接池统计，参考 SqlitePool.stats；其他类型的连接池只返回基本信息
+        """
+        if isinstance(self.pool, SqlitePool):
+            return self.pool.stats()
+        return {"path": self.config.get("path", ""), "type": self.config.get("type", "sqlite")}
+
     def close(self):
+        """
+        关闭连接池；连接池由相同 key 的所有实例共享，实例销毁时不关闭
+        """
         self.pool.close()
         db_loger.info(f"关闭数据库 - {self.config}")
 
-    def __del__(self):
-        self.close()
-
 # class MsgDb(DatabaseBase):
 #
 #     def p(self, *args, **kwargs):
@@ -7,7 +7,10 @@
 # -------------------------------------------------------------------------------
 from ._loger import db_loger
 from .common_utils import timestamp2str, xml2dict, silk2audio, bytes2str, get_md5, name2typeid, typeid2name, \
-    type_converter, match_BytesExtra, db_error, download_file, dat2img
+    type_converter, match_BytesExtra, db_error, download_file, dat2img, encode_cursor, decode_cursor, \
+    FTS_TABLE, FTS_META_TABLE, fts_split, fts_unsplit, fts_query
 
 __all__ = ["db_loger", "timestamp2str", "xml2dict", "silk2audio", "bytes2str", "get_md5", "name2typeid", "typeid2name",
-           "type_converter", "match_BytesExtra", "db_error", "download_file", "dat2img"]
+           "type_converter", "match_BytesExtra", "db_error", "download_file", "dat2img",
+           "encode_cursor", "decode_cursor", "FTS_TABLE", "FTS_META_TABLE", "fts_split", "fts_unsplit",
+           "fts_query"]
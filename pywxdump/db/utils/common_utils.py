@@ -5,7 +5,9 @@
 # Author:       xaoyaoo
 # Date:         2024/04/15
 # -------------------------------------------------------------------------------
+import base64
 import hashlib
+import json
 import os
 import re
 import time
@@ -37,6 +39,66 @@ def db_error(func):
     return wrapper
 
 
+def encode_cursor(data: dict):
+    """
+    分页游标编码为不透明的字符串(url安全)
+    :param data: 游标内容
+    :return: 游标字符串
+    """
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    解码 encode_cursor 生成的游标
+    :param cursor: 游标字符串
+    :return: 游标内容 dict，格式错误时抛出 ValueError
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw.decode("utf-8"))
+    except Exception as e:
+        raise ValueError(f"cursor error: {cursor}") from e
+    if not isinstance(data, dict):
+        raise ValueError(f"cursor error: {cursor}")
+    return data
+
+
+FTS_TABLE = "msg_fts"  # 合并后数据库中聊天记录的全文索引(由 pywxdump.wx_core.msg_fts 建立)
+FTS_META_TABLE = "msg_fts_meta"  # 全文索引每行对应的 StrTalker、CreateTime，带普通索引，用于过滤和按时间排序
+FTS_SEPARATOR = "\u200b"
+FTS_CJK_PATTERN = re.compile("([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])")
+
+
+def fts_split(text: str):
+    """
+    写入全文索引前处理文本：unicode61 分词器把连续的中日韩文字当作一个词，在每个中日韩字符两侧插入零宽空格(分隔符)
+    """
+    return FTS_CJK_PATTERN.sub(FTS_SEPARATOR + r"\1" + FTS_SEPARATOR, text) if text else ""
+
+
+def fts_unsplit(text: str):
+    """
+    去掉 fts_split 插入的分隔符(snippet 返回前)
+    """
+    return text.replace(FTS_SEPARATOR, "") if text else text
+
+
+def fts_query(query: str):
+    """
+    把用户输入的关键词转换为 FTS5 查询：按空白拆分为多个词(AND)，每个词作为短语，中日韩文字按字拆开
+    :param query: 关键词，如 "吃饭 hello"
+    :return: FTS5 MATCH 表达式，如 '"吃 饭" "hello"'；没有有效关键词时返回 ""
+    """
+    terms = []
+    for word in (query or "").split():
+        word = FTS_CJK_PATTERN.sub(r" \1 ", word).replace('"', '""').strip()
+        if word:
+            terms.append(f'"{" ".join(word.split())}"')
+    return " ".join(terms)
+
+
 def type_converter(type_id_or_name: [str, tuple]):
     """
     消息类型ID与名称转换
@@ -5,7 +5,18 @@
 # Author:       xaoyaoo
 # Date:         2023/08/21
 # -------------------------------------------------------------------------------
-from .wx_info import get_wx_info, get_wx_db, get_core_db
-from .get_bias_addr import BiasAddr
-from .decryption import batch_decrypt, decrypt
-from .merge_db import merge_db, decrypt_merge, merge_real_time_db, all_merge_real_time_db
+import sys
+
+from .utils import windows_only_getattr
+
+if sys.platform == "win32":  # 读取微信进程内存相关的模块仅支持Windows，其他平台只能使用解密、合并等功能
+    from .wx_info import get_wx_info, get_wx_db, get_core_db
+    from .get_bias_addr import BiasAddr
+else:  # 其他平台上使用时再导入，导入失败时提示仅支持Windows
+    __getattr__ = windows_only_getattr(__name__, {
+        "get_wx_info": ".wx_info", "get_wx_db": ".wx_info", "get_core_db": ".wx_info", "BiasAddr": ".get_bias_addr"})
+from .decryption import batch_decrypt, decrypt, decrypt_to_connection, verify_integrity, decrypt_wal
+from .merge_db import merge_db, decrypt_merge, merge_real_time_db, all_merge_real_time_db, get_merge_timing
+from .real_time import RealTimeSync
+from .merge_estimate import estimate_decrypt_merge, estimate_merge
+from .msg_fts import build_msg_fts
@@ -15,26 +15,361 @@
 import hmac
 import hashlib
 import os
-from typing import Union, List
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Union, List, Callable
 from Cryptodome.Cipher import AES
+from Cryptodome.Util.strxor import strxor
 # from Crypto.Cipher import AES # 如果上面的导入失败，可以尝试使用这个
 
-from .utils import wx_core_error, wx_core_loger
+from .utils import wx_core_error, wx_core_loger, derive_keys, cache_derived_keys
 
 SQLITE_FILE_HEADER = "SQLite format 3\x00"  # SQLite文件头
 
 KEY_SIZE = 32
 DEFAULT_PAGESIZE = 4096
+SALT_SIZE = 16  # 第一页开头的盐值长度
+RESERVE_SIZE = 48  # 每页末尾的保留段长度: IV(16) + HMAC(20) + 填充(12)
+DEFAULT_BATCH_PAGES = 256  # 流式解密时每批读取的页数(256页即1MB)
+MIN_WORKER_PAGES = 1024  # 单文件多进程解密时，每个进程至少分配的页数(4MB)，文件过小时不启用多进程
+HMAC_SIZE = 20  # HMAC-SHA1 长度
+MANIFEST_SUFFIX = ".pages"  # 增量解密的页摘要清单文件后缀，与解密后的文件放在一起
+WAL_SUFFIX = "-wal"  # 微信运行时新写入的页先保存在 数据库路径-wal 中，checkpoint 后才写回数据库文件
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+WAL_MAGIC = (0x377f0682, 0x377f0683)
+
+
+def page_hmac(mac_key: bytes, page, pgno: int):
+    """
+    计算单页的HMAC-SHA1（第一页跳过盐值，末尾追加小端序页号）
+    :param mac_key: HMAC密钥
+    :param page: 一页加密数据(bytes or memoryview)
+    :param pgno: 页号，从1开始
+    :return: (计算得到的HMAC, 页中保存的HMAC)
+    """
+    start = SALT_SIZE if pgno == 1 else 0
+    end = len(page) - RESERVE_SIZE + 16
+    hash_mac = hmac.new(mac_key, page[start:end], hashlib.sha1)
+    hash_mac.update(pgno.to_bytes(4, "little"))
+    return hash_mac.digest(), bytes(page[end:end + 20])
+
+
+def _decrypt_pages(enc_key: bytes, src: memoryview, dst: memoryview, pgno: int = 1, chain: memoryview = None):
+    """
+    解密连续的若干页，结果直接写入 dst 中相同的偏移处，不产生中间拷贝
+    整页部分不再每页创建一个CBC对象：先用一个ECB对象一次解密所有页，再与"前一个密文块"整体异或完成CBC
+    （每页第一个块的前一块为该页的IV），最后还原每页末尾的保留段；不足一页的部分按页单独解密
+    :param enc_key: 解密密钥
+    :param src: 加密数据
+    :param dst: 输出缓冲区，长度不小于 src，不能与 src 重叠
+    :param pgno: src 中第一页的页号
+    :param chain: 与 src 等长的临时缓冲区，用于存放异或用的密文块，流式解密时复用以避免每批重新分配
+    :return:
+    """
+    end = DEFAULT_PAGESIZE - RESERVE_SIZE
+    full = len(src) - len(src) % DEFAULT_PAGESIZE
+    if full:
+        chain = memoryview(bytearray(full)) if chain is None else chain[:full]
+        AES.new(enc_key, AES.MODE_ECB).decrypt(src[:full], output=dst[:full])
+        chain[16:] = src[:full - 16]
+        for offset in range(0, full, DEFAULT_PAGESIZE):
+            chain[offset:offset + 16] = src[offset + end:offset + end + 16]
+        if pgno == 1:  # 第一页从盐值之后开始加密
+            chain[SALT_SIZE:SALT_SIZE + 16] = src[end:end + 16]
+        strxor(dst[:full], chain, output=dst[:full])
+        for offset in range(0, full, DEFAULT_PAGESIZE):
+            dst[offset + end:offset + DEFAULT_PAGESIZE] = src[offset + end:offset + DEFAULT_PAGESIZE]
+        if pgno == 1:
+            dst[:SALT_SIZE] = SQLITE_FILE_HEADER.encode()
+        pgno += full // DEFAULT_PAGESIZE
+
+    if full < len(src):
+        page = src[full:]
+        end = len(page) - RESERVE_SIZE
+        start = SALT_SIZE if pgno == 1 else 0
+        AES.new(enc_key, AES.MODE_CBC, page[end:end + 16]).decrypt(
+            page[start:end], output=dst[full + start:full + end])
+        dst[full + end:full + len(page)] = page[end:]
+        if pgno == 1:
+            dst[full:full + SALT_SIZE] = SQLITE_FILE_HEADER.encode()
+
+
+def _decrypt_stream(enc_key: bytes, fin, fout, batch_pages: int = DEFAULT_BATCH_PAGES, pgno: int = 1,
+                    page_count: int = None):
+    """
+    流式解密：按批读取到复用的缓冲区中解密后立即写出，内存占用与文件大小无关
+    :param enc_key: 解密密钥
+    :param fin: 加密数据库文件对象(rb)，已定位到第 pgno 页的起始位置
+    :param fout: 输出文件对象，已定位到第 pgno 页的起始位置
+    :param batch_pages: 每批读取的页数
+    :param pgno: 起始页号，从1开始
+    :param page_count: 最多解密的页数，None 表示解密到文件末尾
+    :return: 解密的页数
+    """
+    buf = bytearray(batch_pages * DEFAULT_PAGESIZE)
+    out = bytearray(len(buf))
+    src, dst, chain = memoryview(buf), memoryview(out), memoryview(bytearray(len(buf)))
+    start_pgno = pgno
+    while page_count is None or pgno - start_pgno < page_count:
+        if page_count is None:
+            n = fin.readinto(buf)
+        else:
+            n = fin.readinto(src[:min(batch_pages, page_count - (pgno - start_pgno)) * DEFAULT_PAGESIZE])
+        if not n:
+            break
+        _decrypt_pages(enc_key, src[:n], dst, pgno, chain)
+        fout.write(dst[:n])
+        pgno += (n + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE
+    return pgno - start_pgno
+
+
+def _decrypt_page_range(enc_key: bytes, db_path: str, out_path: str, pgno: int, page_count: int):
+    """
+    解密文件中一段连续的页，写入预分配好的输出文件的对应偏移处（进程池任务）
+    :param enc_key: 解密密钥
+    :param db_path: 加密数据库路径
+    :param out_path: 输出路径，必须已预分配到与加密文件相同的大小
+    :param pgno: 起始页号，从1开始
+    :param page_count: 页数
+    :return: 解密的页数
+    """
+    offset = (pgno - 1) * DEFAULT_PAGESIZE
+    with open(db_path, "rb") as fin, open(out_path, "r+b") as fout:
+        fin.seek(offset)
+        fout.seek(offset)
+        return _decrypt_stream(enc_key, fin, fout, pgno=pgno, page_count=page_count)
+
+
+def _parallel_decrypt_file(enc_key: bytes, db_path: str, out_path: str, workers: int):
+    """
+    单文件多进程解密：按页号切分为 workers 段连续的页，各进程分别解密并写入输出文件的对应位置
+    :return: 解密的页数
+    """
+    file_size = os.path.getsize(db_path)
+    total_pages = (file_size + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE
+    with open(out_path, "wb") as deFile:
+        deFile.truncate(file_size)  # 预分配输出文件
+
+    step = (total_pages + workers - 1) // workers
+    ranges = [(pgno, min(step, total_pages - pgno + 1)) for pgno in range(1, total_pages + 1, step)]
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_decrypt_page_range, enc_key, db_path, out_path, pgno, count)
+                   for pgno, count in ranges]
+        return sum(future.result() for future in futures)
+
+
+def _read_manifest(out_path: str, salt: bytes):
+    """
+    读取增量解密的页摘要清单: 盐值(16) + 上次加密文件大小(8) + 每页保存的HMAC(20*页数)
+    :return: (上次加密文件大小, 每页HMAC拼接的bytes)，清单不存在或与当前文件不匹配时返回 None
+    """
+    manifest_path = out_path + MANIFEST_SUFFIX
+    if not os.path.exists(out_path) or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "rb") as f:
+        data = f.read()
+    if len(data) < SALT_SIZE + 8 or data[:SALT_SIZE] != salt:
+        return None
+    size = int.from_bytes(data[SALT_SIZE:SALT_SIZE + 8], "little")
+    digests = data[SALT_SIZE + 8:]
+    if os.path.getsize(out_path) != size or len(digests) != (size + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE * HMAC_SIZE:
+        return None
+    return size, digests
+
+
+def _write_manifest(out_path: str, salt: bytes, size: int, digests: bytes):
+    with open(out_path + MANIFEST_SUFFIX, "wb") as f:
+        f.write(salt + size.to_bytes(8, "little") + digests)
+
+
+def _page_digests(src: memoryview):
+    """
+    取出每页中保存的HMAC，作为页内容的摘要
+    """
+    return b"".join(src[i + DEFAULT_PAGESIZE - RESERVE_SIZE + 16:i + DEFAULT_PAGESIZE - RESERVE_SIZE + 16 + HMAC_SIZE]
+                    for i in range(0, len(src), DEFAULT_PAGESIZE))
+
+
+def _decrypt_stream_manifest(enc_key: bytes, fin, fout, batch_pages: int = DEFAULT_BATCH_PAGES):
+    """
+    全量流式解密，同时收集每页的摘要，用于生成增量解密的清单
+    :return: 每页HMAC拼接的bytes
+    """
+    buf = bytearray(batch_pages * DEFAULT_PAGESIZE)
+    out = bytearray(len(buf))
+    src, dst, chain = memoryview(buf), memoryview(out), memoryview(bytearray(len(buf)))
+    digests = []
+    pgno = 1
+    while True:
+        n = fin.readinto(buf)
+        if not n:
+            break
+        _decrypt_pages(enc_key, src[:n], dst, pgno, chain)
+        fout.write(dst[:n])
+        digests.append(_page_digests(src[:n]))
+        pgno += (n + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE
+    return b"".join(digests)
+
+
+def _decrypt_incremental(enc_key: bytes, fin, out_path: str, old_digests: bytes,
+                         batch_pages: int = DEFAULT_BATCH_PAGES):
+    """
+    增量解密：与上次的页摘要比较，只解密并覆盖写入密文发生变化的页，文件变短时截断输出文件
+    :param enc_key: 解密密钥
+    :param fin: 加密数据库文件对象(rb)，从文件开头读取
+    :param out_path: 上次解密的输出文件
+    :param old_digests: 上次的页摘要
+    :return: (每页HMAC拼接的bytes, 重新解密的页数)
+    """
+    buf = bytearray(batch_pages * DEFAULT_PAGESIZE)
+    out = bytearray(len(buf))
+    src, dst, chain = memoryview(buf), memoryview(out), memoryview(bytearray(len(buf)))
+    digests = []
+    changed = 0
+    pgno = 1
+    size = 0
+    with open(out_path, "r+b") as fout:
+        while True:
+            n = fin.readinto(buf)
+            if not n:
+                break
+            batch_digests = _page_digests(src[:n])
+            old = old_digests[(pgno - 1) * HMAC_SIZE:(pgno - 1) * HMAC_SIZE + len(batch_digests)]
+            # 找出连续变化的页段 [run_start, run_end)，整段解密后一次写出
+            run_start = None
+            page_num = len(batch_digests) // HMAC_SIZE
+            for i in range(page_num + 1):
+                digest = slice(i * HMAC_SIZE, (i + 1) * HMAC_SIZE)
+                is_changed = i < page_num and batch_digests[digest] != old[digest]
+                if is_changed and run_start is None:
+                    run_start = i
+                elif not is_changed and run_start is not None:
+                    start, end = run_start * DEFAULT_PAGESIZE, min(i * DEFAULT_PAGESIZE, n)
+                    _decrypt_pages(enc_key, src[start:end], dst[start:end], pgno + run_start, chain)
+                    fout.seek(size + start)
+                    fout.write(dst[start:end])
+                    changed += i - run_start
+                    run_start = None
+            digests.append(batch_digests)
+            pgno += page_num
+            size += n
+        fout.truncate(size)
+    return b"".join(digests), changed
+
+
+def _read_wal_pages(mac_key: bytes, wal_path: str):
+    """
+    读取WAL中已提交的页(同一页只保留最后一次提交的版本)
+    帧的盐值与WAL头不同(上一轮WAL留下的旧帧)或页的HMAC校验失败(正在写入的帧)时停止读取，
+    最后一个提交帧之后的帧属于未提交的事务，同样忽略
+    :param mac_key: HMAC密钥
+    :param wal_path: WAL文件路径
+    :return: (提交后数据库的页数, {pgno: 加密页})，没有已提交的帧时返回 (0, {})
+    """
+    if not os.path.exists(wal_path):
+        return 0, {}
+    with open(wal_path, "rb") as f:
+        header = f.read(WAL_HEADER_SIZE)
+        if (len(header) < WAL_HEADER_SIZE or int.from_bytes(header[:4], "big") not in WAL_MAGIC
+                or int.from_bytes(header[8:12], "big") != DEFAULT_PAGESIZE):
+            return 0, {}
+        db_pages, committed, pending = 0, {}, {}
+        while True:
+            frame_header = f.read(WAL_FRAME_HEADER_SIZE)
+            page = f.read(DEFAULT_PAGESIZE)
+            if len(frame_header) < WAL_FRAME_HEADER_SIZE or len(page) < DEFAULT_PAGESIZE:
+                break
+            if frame_header[8:16] != header[16:24]:
+                break
+            pgno = int.from_bytes(frame_header[:4], "big")
+            hash_mac, stored_mac = page_hmac(mac_key, page, pgno)
+            if hash_mac != stored_mac:
+                break
+            pending[pgno] = page
+            commit_pages = int.from_bytes(frame_header[4:8], "big")
+            if commit_pages:
+                committed.update(pending)
+                pending.clear()
+                db_pages = commit_pages
+    return db_pages, {pgno: page for pgno, page in committed.items() if pgno <= db_pages}
+
+
+def _apply_wal(enc_key: bytes, mac_key: bytes, wal_path: str, out_path: str):
+    """
+    把WAL中已提交的页解密后覆盖写入解密后的数据库，并按最后一次提交时的页数截断或扩展文件
+    :return: 写入的页号列表
+    """
+    db_pages, pages = _read_wal_pages(mac_key, wal_path)
+    if not db_pages:
+        return []
+    out = memoryview(bytearray(DEFAULT_PAGESIZE))
+    with open(out_path, "r+b") as fout:
+        fout.truncate(db_pages * DEFAULT_PAGESIZE)
+        for pgno in sorted(pages):
+            _decrypt_pages(enc_key, memoryview(pages[pgno]), out, pgno)
+            fout.seek((pgno - 1) * DEFAULT_PAGESIZE)
+            fout.write(out)
+    return sorted(pages)
+
+
+def _invalidate_digests(digests: bytes, pages: list, size: int):
+    """
+    WAL中的页写入解密后的文件后，清空这些页在清单中的摘要(并按新的文件大小补齐)，
+    下次增量解密时无论数据库文件中的这些页是否变化都重新解密
+    """
+    page_count = (size + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE
+    digests = bytearray(digests[:page_count * HMAC_SIZE].ljust(page_count * HMAC_SIZE, b"\x00"))
+    for pgno in pages:
+        digests[(pgno - 1) * HMAC_SIZE:pgno * HMAC_SIZE] = bytes(HMAC_SIZE)
+    return bytes(digests)
+
+
+@wx_core_error
+def decrypt_wal(key: str, db_path: str, out_path: str):
+    """
+    只把 db_path-wal 中已提交的页解密写入上次解密的输出文件(数据库文件本身没有变化时使用，不用扫描整个数据库)
+    :param key: 密钥 64位16进制字符串
+    :param db_path: 加密数据库路径
+    :param out_path: 上次解密的输出文件
+    :return: (True, 写入的页数) or (False, 错误信息)
+    """
+    if not os.path.exists(db_path) or not os.path.exists(out_path):
+        return False, f"[-] db_path:'{db_path}' or out_path:'{out_path}' File not found!"
+    if len(key) != 64:
+        return False, f"[-] key:'{key}' Len Error!"
+    password = bytes.fromhex(key.strip())
+    with open(db_path, "rb") as file:
+        first = file.read(DEFAULT_PAGESIZE)
+    salt = first[:SALT_SIZE]
+    enc_key, mac_key = derive_keys(password, salt)
+    hash_mac, stored_mac = page_hmac(mac_key, first, 1)
+    if hash_mac != stored_mac:
+        return False, f"[-] Key Error! (key:'{key}'; db_path:'{db_path}')"
+    cache_derived_keys(password, salt, (enc_key, mac_key))
+
+    manifest = _read_manifest(out_path, salt)
+    pages = _apply_wal(enc_key, mac_key, db_path + WAL_SUFFIX, out_path)
+    if manifest and pages:
+        size = os.path.getsize(out_path)
+        _write_manifest(out_path, salt, size, _invalidate_digests(manifest[1], pages, size))
+    return True, len(pages)
 
 
 # 通过密钥解密数据库
 @wx_core_error
-def decrypt(key: str, db_path: str, out_path: str):
+def decrypt(key: str, db_path: str, out_path: str, workers: int = 1, incremental: bool = False, wal: bool = False):
     """
     通过密钥解密数据库
     :param key: 密钥 64位16进制字符串
     :param db_path:  待解密的数据库路径(必须是文件)
     :param out_path:  解密后的数据库输出路径(必须是文件)
+    :param workers: 单个文件内并行解密的进程数，1 表示不并行，0 或 None 表示使用全部CPU核心；
+                    文件较小(每个进程分不到 MIN_WORKER_PAGES 页)时自动减少进程数
+    :param incremental: 增量解密，在输出文件旁保存每页的摘要清单(out_path + ".pages")，
+                        再次解密时只重新解密密文发生变化的页；清单不存在或不匹配时全量解密
+    :param wal: 同时解密 db_path-wal 中已提交的页(微信运行时尚未写回数据库文件的新数据)
     :return:
     """
     if not os.path.exists(db_path) or not os.path.isfile(db_path):
@@ -48,41 +383,273 @@ def decrypt(key: str, db_path: str, out_path: str):
     password = bytes.fromhex(key.strip())
 
     try:
-        with open(db_path, "rb") as file:
-            blist = file.read()
+        file = open(db_path, "rb")
     except Exception as e:
         return False, f"[-] db_path:'{db_path}' {e}!"
 
-    salt = blist[:16]
-    first = blist[16:4096]
-    if len(salt) != 16:
-        return False, f"[-] db_path:'{db_path}' File Error!"
-    mac_salt = bytes([(salt[i] ^ 58) for i in range(16)])
-    byteHmac = hashlib.pbkdf2_hmac("sha1", password, salt, 64000, KEY_SIZE)
-    mac_key = hashlib.pbkdf2_hmac("sha1", byteHmac, mac_salt, 2, KEY_SIZE)
-    hash_mac = hmac.new(mac_key, blist[16:4064], hashlib.sha1)
-    hash_mac.update(b'\x01\x00\x00\x00')
+    with file:
+        first = file.read(DEFAULT_PAGESIZE)
+        salt = first[:SALT_SIZE]
+        if len(salt) != SALT_SIZE:
+            return False, f"[-] db_path:'{db_path}' File Error!"
+        enc_key, mac_key = derive_keys(password, salt)
+        hash_mac, stored_mac = page_hmac(mac_key, first, 1)
+        if hash_mac != stored_mac:
+            return False, f"[-] Key Error! (key:'{key}'; db_path:'{db_path}'; out_path:'{out_path}' )"
+        cache_derived_keys(password, salt, (enc_key, mac_key))
 
-    if hash_mac.digest() != first[-32:-12]:
-        return False, f"[-] Key Error! (key:'{key}'; db_path:'{db_path}'; out_path:'{out_path}' )"
+        if incremental:
+            file.seek(0)
+            manifest = _read_manifest(out_path, salt)
+            if manifest:
+                digests, changed = _decrypt_incremental(enc_key, file, out_path, manifest[1])
+                wx_core_loger.info(f"增量解密 {db_path} 更新 {changed}/{len(digests) // HMAC_SIZE} 页")
+            else:
+                with open(out_path, "wb") as deFile:
+                    digests = _decrypt_stream_manifest(enc_key, file, deFile)
+            if wal:
+                pages = _apply_wal(enc_key, mac_key, db_path + WAL_SUFFIX, out_path)
+                digests = _invalidate_digests(digests, pages, os.path.getsize(out_path)) if pages else digests
+            _write_manifest(out_path, salt, os.path.getsize(out_path), digests)
+            return True, [db_path, out_path, key]
 
-    with open(out_path, "wb") as deFile:
-        deFile.write(SQLITE_FILE_HEADER.encode())
-        for i in range(0, len(blist), 4096):
-            tblist = blist[i:i + 4096] if i > 0 else blist[16:i + 4096]
-            deFile.write(AES.new(byteHmac, AES.MODE_CBC, tblist[-48:-32]).decrypt(tblist[:-48]))
-            deFile.write(tblist[-48:])
+        if not workers or workers < 0:
+            workers = os.cpu_count() or 1
+        total_pages = (os.path.getsize(db_path) + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE
+        workers = min(workers, total_pages // MIN_WORKER_PAGES)
+        if workers > 1:
+            _parallel_decrypt_file(enc_key, db_path, out_path, workers)
+        else:
+            file.seek(0)
+            with open(out_path, "wb") as deFile:
+                _decrypt_stream(enc_key, file, deFile)
+    if wal:
+        _apply_wal(enc_key, mac_key, db_path + WAL_SUFFIX, out_path)
 
     return True, [db_path, out_path, key]
 
+
+class _TempFileConnection(sqlite3.Connection):
+    """
+    decrypt_to_connection 回退方案使用的连接，关闭时删除临时解密文件
+    """
+    temp_path = None
+
+    def close(self):
+        super().close()
+        if self.temp_path and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+            self.temp_path = None
+
+
+@wx_core_error
+def decrypt_to_connection(key: str, db_path: str):
+    """
+    解密数据库到内存，返回只读的 sqlite3 连接，明文不落盘
+    python>=3.11 时使用 sqlite3.Connection.deserialize 直接加载；否则解密到临时文件(优先使用 /dev/shm)，
+    POSIX 下打开后立即删除临时文件，Windows 下连接关闭时删除
+    :param key: 密钥 64位16进制字符串
+    :param db_path: 待解密的数据库路径(必须是文件)
+    :return: (True, sqlite3.Connection) or (False, 错误信息)
+    """
+    if not os.path.exists(db_path) or not os.path.isfile(db_path):
+        return False, f"[-] db_path:'{db_path}' File not found!"
+    if len(key) != 64:
+        return False, f"[-] key:'{key}' Len Error!"
+
+    password = bytes.fromhex(key.strip())
+    with open(db_path, "rb") as file:
+        first = file.read(DEFAULT_PAGESIZE)
+        salt = first[:SALT_SIZE]
+        if len(salt) != SALT_SIZE:
+            return False, f"[-] db_path:'{db_path}' File Error!"
+        enc_key, mac_key = derive_keys(password, salt)
+        hash_mac, stored_mac = page_hmac(mac_key, first, 1)
+        if hash_mac != stored_mac:
+            return False, f"[-] Key Error! (key:'{key}'; db_path:'{db_path}')"
+        cache_derived_keys(password, salt, (enc_key, mac_key))
+        file.seek(0)
+
+        if hasattr(sqlite3.Connection, "deserialize"):
+            # 整个文件读入一个 bytearray 后原地解密，deserialize 复制到 SQLite 后立即释放
+            buf = bytearray(os.path.getsize(db_path))
+            del buf[file.readinto(buf):]
+            data = memoryview(buf)
+            # 原地解密：逐批复制到临时缓冲区，再解密写回原位置
+            src = memoryview(bytearray(DEFAULT_BATCH_PAGES * DEFAULT_PAGESIZE))
+            chain = memoryview(bytearray(len(src)))
+            for offset in range(0, len(data), len(src)):
+                n = min(len(src), len(data) - offset)
+                src[:n] = data[offset:offset + n]
+                _decrypt_pages(enc_key, src[:n], data[offset:offset + n], offset // DEFAULT_PAGESIZE + 1, chain)
+            data.release()
+            if buf[18:20] == b"\x02\x02":  # WAL模式的数据库无法从内存中打开，改为legacy模式(只读，不影响数据)
+                buf[18:20] = b"\x01\x01"
+            connection = sqlite3.connect(":memory:", check_same_thread=False)
+            connection.deserialize(buf)
+            del buf
+            connection.execute("PRAGMA query_only = ON;")
+            return True, connection
+
+        tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None  # tmpfs
+        fd, temp_path = tempfile.mkstemp(suffix=".db", prefix="de_", dir=tmp_dir)
+        with os.fdopen(fd, "w+b") as deFile:
+            _decrypt_stream(enc_key, file, deFile)
+            deFile.seek(18)
+            if deFile.read(2) == b"\x02\x02":  # 改为legacy模式，只读打开时不需要 -wal/-shm 文件
+                deFile.seek(18)
+                deFile.write(b"\x01\x01")
+    connection = sqlite3.connect(f"file:{temp_path}?mode=ro", uri=True, check_same_thread=False,
+                                 factory=_TempFileConnection)
+    if os.name == "posix":
+        # 读取表结构(打开文件)后立即删除临时文件，连接仍可通过已打开的文件描述符读取，调用者没有关闭连接时明文也不会留在磁盘上
+        connection.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        os.remove(temp_path)
+    else:
+        connection.temp_path = temp_path  # Windows 不能删除已打开的文件，连接关闭时删除
+    return True, connection
+
+
+def _verify_page_range(mac_key: bytes, db_path: str, pgno: int, page_count: int,
+                       batch_pages: int = DEFAULT_BATCH_PAGES):
+    """
+    校验一段连续页的HMAC（线程池任务，hmac/sha1 计算时会释放GIL）
+    :return: 校验失败的页号列表
+    """
+    buf = bytearray(batch_pages * DEFAULT_PAGESIZE)
+    src = memoryview(buf)
+    bad_pages = []
+    end_pgno = pgno + page_count
+    with open(db_path, "rb") as f:
+        f.seek((pgno - 1) * DEFAULT_PAGESIZE)
+        while pgno < end_pgno:
+            n = f.readinto(src[:min(batch_pages, end_pgno - pgno) * DEFAULT_PAGESIZE])
+            if not n:
+                break
+            for offset in range(0, n, DEFAULT_PAGESIZE):
+                page = src[offset:offset + DEFAULT_PAGESIZE]
+                hash_mac, stored_mac = page_hmac(mac_key, page, pgno)
+                if len(page) != DEFAULT_PAGESIZE or hash_mac != stored_mac:  # 不完整的页同样视为损坏
+                    bad_pages.append(pgno)
+                pgno += 1
+    return bad_pages
+
+
+@wx_core_error
+def verify_integrity(key: str, db_path: str, workers: int = 0):
+    """
+    校验加密数据库每一页的HMAC，找出损坏或复制不完整的页（decrypt 只校验第一页）
+    :param key: 密钥 64位16进制字符串
+    :param db_path: 加密数据库路径
+    :param workers: 线程数，0 或 None 表示使用全部CPU核心
+    :return: (True, {"db_path": db_path, "pages": 总页数, "bad_pages": [[起始页号, 结束页号],...]})
+             所有页完好时 bad_pages 为空；(False, 错误信息)
+    """
+    if not os.path.exists(db_path) or not os.path.isfile(db_path):
+        return False, f"[-] db_path:'{db_path}' File not found!"
+    if len(key) != 64:
+        return False, f"[-] key:'{key}' Len Error!"
+
+    password = bytes.fromhex(key.strip())
+    with open(db_path, "rb") as file:
+        first = file.read(DEFAULT_PAGESIZE)
+    salt = first[:SALT_SIZE]
+    if len(salt) != SALT_SIZE:
+        return False, f"[-] db_path:'{db_path}' File Error!"
+    enc_key, mac_key = derive_keys(password, salt)
+    hash_mac, stored_mac = page_hmac(mac_key, first, 1)
+    if hash_mac != stored_mac:
+        return False, f"[-] Key Error! (key:'{key}'; db_path:'{db_path}')"
+    cache_derived_keys(password, salt, (enc_key, mac_key))
+
+    total_pages = (os.path.getsize(db_path) + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE
+    if not workers or workers < 0:
+        workers = os.cpu_count() or 1
+    step = max((total_pages + workers - 1) // workers, MIN_WORKER_PAGES)
+    ranges = [(pgno, min(step, total_pages - pgno + 1)) for pgno in range(1, total_pages + 1, step)]
+    bad_pages = []
+    with ThreadPoolExecutor(max_workers=min(workers, len(ranges) or 1)) as executor:
+        for ret in executor.map(lambda r: _verify_page_range(mac_key, db_path, *r), ranges):
+            bad_pages += ret
+
+    # 合并连续的损坏页为区间
+    bad_ranges = []
+    for pgno in bad_pages:
+        if bad_ranges and bad_ranges[-1][1] == pgno - 1:
+            bad_ranges[-1][1] = pgno
+        else:
+            bad_ranges.append([pgno, pgno])
+    if bad_ranges:
+        wx_core_loger.warning(f"数据库页校验失败: {db_path} {bad_ranges}")
+    return True, {"db_path": db_path, "pages": total_pages, "bad_pages": bad_ranges}
+
+
+def _decrypt_worker(args, incremental: bool = False):
+    """
+    进程池中执行的解密任务（decrypt被装饰器包装后无法直接被pickle）
+    :param args: [key, db_path, out_path]
+    :param incremental: 是否增量解密
+    :return: decrypt 的返回值
+    """
+    ret = decrypt(*args, incremental=incremental)
+    if ret is None:
+        return False, f"[-] db_path:'{args[1]}' decrypt error!"
+    return ret
+
+
+def _run_decrypt_tasks(process_list: list, workers: int = 1, progress_callback: Callable = None,
+                       incremental: bool = False):
+    """
+    执行解密任务列表，workers>1 时使用进程池并行解密，大文件优先调度
+    :param process_list: [[key, input_db_path, output_db_path],...]
+    :param workers: 进程数，0 或 None 表示使用全部CPU核心
+    :param progress_callback: 进度回调 progress_callback(done_count, total_count, decrypt_result)
+    :param incremental: 是否增量解密
+    :return: 与 process_list 顺序一致的解密结果列表
+    """
+    total = len(process_list)
+    if not workers or workers < 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, total)
+
+    result = [None] * total
+    if workers <= 1:
+        for i, args in enumerate(process_list):
+            result[i] = _decrypt_worker(args, incremental)  # 解密
+            if progress_callback:
+                progress_callback(i + 1, total, result[i])
+        return result
+
+    # 大文件优先调度，避免最后只剩一个大文件在单核上解密
+    order = sorted(range(total), key=lambda i: os.path.getsize(process_list[i][1]), reverse=True)
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_decrypt_worker, process_list[i], incremental): i for i in order}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result[i] = future.result()
+            except Exception as e:
+                wx_core_loger.error(f"decrypt error: {process_list[i][1]} {e}", exc_info=True)
+                result[i] = (False, f"[-] db_path:'{process_list[i][1]}' {e}!")
+            done += 1
+            if progress_callback:
+                progress_callback(done, total, result[i])
+    return result
+
+
 @wx_core_error
-def batch_decrypt(key: str, db_path: Union[str, List[str]], out_path: str, is_print: bool = False):
+def batch_decrypt(key: str, db_path: Union[str, List[str]], out_path: str, is_print: bool = False,
+                  workers: int = 1, progress_callback: Callable = None, incremental: bool = False):
     """
     批量解密数据库
     :param key: 密钥 64位16进制字符串
     :param db_path: 待解密的数据库路径(文件或文件夹)
     :param out_path: 解密后的数据库输出路径(文件夹)
-    :param is_logging: 是否打印日志
+    :param is_print: 是否打印日志
+    :param workers: 并行解密的进程数，1 表示在当前进程中依次解密，0 或 None 表示使用全部CPU核心
+    :param progress_callback: 进度回调 progress_callback(done_count, total_count, decrypt_result)，每解密完成一个文件调用一次
+    :param incremental: 增量解密，只重新解密自上次解密后发生变化的页，参考 decrypt
     :return: (bool, [[input_db_path, output_db_path, key],...])
     """
     if not isinstance(key, str) or not isinstance(out_path, str) or not os.path.exists(out_path) or len(key) != 64:
@@ -140,9 +707,8 @@ def batch_decrypt(key: str, db_path: Union[str, List[str]], out_path: str, is_pr
         wx_core_loger.error(error, exc_info=True)
         return False, error
 
-    result = []
-    for i in process_list:
-        result.append(decrypt(*i))  # 解密
+    result = _run_decrypt_tasks(process_list, workers=workers, progress_callback=progress_callback,
+                                incremental=incremental)
 
     # 删除空文件夹
     for root, dirs, files in os.walk(out_path, topdown=False):
@@ -165,3 +731,4 @@ def batch_decrypt(key: str, db_path: Union[str, List[str]], out_path: str, is_pr
         print(f"[+] 共 {len(result)} 个文件, 成功 {success_count} 个, 失败 {fail_count} 个")
         print("=" * 32)
     return True, result
+
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-#
+# -------------------------------------------------------------------------------
+# Name:         encrypted_vfs.py
+# Description:  基于 apsw 的只读 SQLite VFS，直接查询加密数据库，按需解密 SQLite 请求的页
+# Date:         2026/10/18
+# 注：需要安装 apsw (pip install apsw)，未安装时 open_encrypted_db 会抛出 ImportError
+# 用法：
+#     conn = open_encrypted_db(key, r"C:\***\MSG0.db")
+#     conn.execute("SELECT * FROM MSG ORDER BY CreateTime DESC LIMIT 50").fetchall()
+# -------------------------------------------------------------------------------
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+from .decryption import DEFAULT_PAGESIZE, SALT_SIZE, page_hmac, _decrypt_pages
+from .utils import derive_keys, cache_derived_keys, wx_core_loger
+
+try:
+    import apsw
+except ImportError:
+    apsw = None
+
+VFS_NAME = "wxdump_encrypted"
+DEFAULT_CACHE_PAGES = 2048  # 每个连接的LRU页缓存大小(2048页即8MB)
+
+_vfs = None
+_vfs_lock = threading.Lock()
+
+
+class EncryptedVFSFile(apsw.VFSFile if apsw else object):
+    """
+    加密数据库文件：读取时按页解密，并缓存最近使用的明文页；只读，拒绝一切写操作
+    """
+
+    def __init__(self, vfs_name, name, flags):
+        super().__init__("", name, flags)  # 继承默认VFS，读取原始(加密)数据
+        key = name.uri_parameter("key") or ""
+        self.cache_pages = int(name.uri_parameter("cache_pages") or DEFAULT_CACHE_PAGES)
+        self.cache = OrderedDict()  # {pgno: 明文页}
+
+        first = super().xRead(DEFAULT_PAGESIZE, 0)
+        salt = first[:SALT_SIZE]
+        if len(key) != 64 or len(salt) != SALT_SIZE:
+            super().xClose()
+            raise apsw.CantOpenError(f"[-] key or db_path Error! ({name.filename()})")
+        password = bytes.fromhex(key)
+        self.enc_key, mac_key = derive_keys(password, salt)
+        hash_mac, stored_mac = page_hmac(mac_key, first, 1)
+        if hash_mac != stored_mac:
+            super().xClose()
+            raise apsw.CantOpenError(f"[-] Key Error! ({name.filename()})")
+        cache_derived_keys(password, salt, (self.enc_key, mac_key))
+
+    def _read_page(self, pgno: int):
+        page = self.cache.get(pgno)
+        if page is not None:
+            self.cache.move_to_end(pgno)
+            return page
+
+        data = super().xRead(DEFAULT_PAGESIZE, (pgno - 1) * DEFAULT_PAGESIZE)
+        page = bytearray(len(data))
+        _decrypt_pages(self.enc_key, memoryview(data), memoryview(page), pgno)
+        if pgno == 1 and page[18:20] == b"\x02\x02":  # 只读打开时不使用WAL，与解密后的文件保持一致
+            page[18:20] = b"\x01\x01"
+        self.cache[pgno] = page
+        if len(self.cache) > self.cache_pages:
+            self.cache.popitem(last=False)
+        return page
+
+    def xRead(self, amount, offset):
+        result = bytearray()
+        pgno = offset // DEFAULT_PAGESIZE + 1
+        start = offset % DEFAULT_PAGESIZE
+        while len(result) < amount:
+            page = self._read_page(pgno)
+            if len(page) <= start:
+                break  # 读到文件末尾，返回不足的数据，由SQLite按短读处理
+            result += page[start:start + amount - len(result)]
+            pgno += 1
+            start = 0
+        return bytes(result)
+
+    def xWrite(self, data, offset):
+        raise apsw.ReadOnlyError("encrypted database is read-only")
+
+    def xTruncate(self, newsize):
+        raise apsw.ReadOnlyError("encrypted database is read-only")
+
+    def xSync(self, flags):
+        pass
+
+
+class EncryptedVFS(apsw.VFS if apsw else object):
+    """
+    只对主数据库文件解密，其余文件(日志等)直接交给默认VFS处理
+    """
+
+    def __init__(self, name=VFS_NAME):
+        super().__init__(name, "")
+        self.vfs_name = name
+
+    def xOpen(self, name, flags):
+        if isinstance(name, apsw.URIFilename) and flags[0] & apsw.SQLITE_OPEN_MAIN_DB:
+            return EncryptedVFSFile(self.vfs_name, name, flags)
+        return super().xOpen(name, flags)
+
+
+def _register_vfs():
+    global _vfs
+    if apsw is None:
+        raise ImportError("open_encrypted_db 需要安装 apsw: pip install apsw")
+    with _vfs_lock:
+        if _vfs is None:
+            _vfs = EncryptedVFS()
+            wx_core_loger.info(f"注册加密数据库VFS: {VFS_NAME}")
+    return _vfs
+
+
+def open_encrypted_db(key: str, db_path: str, cache_pages: int = DEFAULT_CACHE_PAGES):
+    """
+    以只读方式直接打开加密数据库，查询时按需解密页，无需先解密整个文件
+    :param key: 密钥 64位16进制字符串
+    :param db_path: 加密数据库路径
+    :param cache_pages: LRU页缓存大小(页数)
+    :return: apsw.Connection
+    """
+    _register_vfs()
+    uri = f"file:{quote(db_path.replace(chr(92), '/'))}?key={key.strip()}&cache_pages={int(cache_pages)}"
+    return apsw.Connection(uri, flags=apsw.SQLITE_OPEN_READONLY | apsw.SQLITE_OPEN_URI, vfs=VFS_NAME)
+
+
+class EncryptedConnection:
+    """
+    apsw 连接的 DB-API 风格封装，供 DatabaseBase 的连接池使用
+    """
+    threadsafety = 1  # DB-API: 线程间可共享模块，不共享连接
+    failures = (apsw.IOError, apsw.CantOpenError) if apsw else ()  # 连接池遇到这些错误时重新建立连接
+
+    def __init__(self, key: str, db_path: str, cache_pages: int = DEFAULT_CACHE_PAGES):
+        self._con = open_encrypted_db(key, db_path, cache_pages)
+        self.text_factory = str  # 兼容 sqlite3.Connection 的属性，apsw 中无实际作用
+
+    def cursor(self):
+        return self._con.cursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._con.close()
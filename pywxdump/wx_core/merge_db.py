@@ -5,18 +5,34 @@
 # Author:       xaoyaoo
 # Date:         2023/12/03
 # -------------------------------------------------------------------------------
+import calendar
+import hashlib
+import json
 import logging
 import os
+import re
 import shutil
 import sqlite3
-import subprocess
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List
 
 from .decryption import batch_decrypt
-from .wx_info import get_core_db
+from .msg_fts import FTS_TABLE, FTS_LOG_TABLE, update_msg_fts, msg_fts_exists, build_msg_fts
 from .utils import wx_core_loger, wx_core_error, CORE_DB_TYPE
 
+# 合并时按天然主键去重的表 {表名: 主键列}，其余表按整行内容的哈希(ROW_HASH_COLUMN)去重
+MERGE_ROW_KEYS = {
+    "MSG": ("MsgSvrID", "StrTalker", "CreateTime"),
+    "PublicMsg": ("MsgSvrID", "StrTalker", "CreateTime"),
+    "Media": ("Reserved0",),
+}
+ROW_HASH_COLUMN = "_row_hash"
+MERGE_CACHE_SIZE = 131072  # 合并时输出数据库的页缓存大小(KB)
+MSG_PARTITION_TABLE = "msg_partitions"  # 按时间分区时记录 MSG 的分区表及其时间范围
+SCHEMA_CACHE_TABLE = "merge_schema_cache"  # 保存每个源数据库的合并计划，表结构没有变化时跳过读取表结构
+CREATE_INDEX_PATTERN = re.compile(r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?", re.I)
+
 
 @wx_core_error
 def execute_sql(connection, sql, params=None):
@@ -64,12 +80,18 @@ def check_create_sync_log(connection):
     sync_log_status = execute_sql(connection, "SELECT name FROM sqlite_master WHERE type='table' AND name='sync_log'")
     if len(sync_log_status) < 1:
         #  db_path 微信数据库路径，tbl_name 表名，src_count 源数据库记录数，current_count 当前合并后的数据库对应表记录数
+        #  max_rowid, max_create_time 上次合并时源表的最大rowid和CreateTime(水位线)，下次只合并水位线之后的行
+        #  merge_rows, merge_time 上次合并该表时写入的行数和用时(秒)
         sync_record_create_sql = ("CREATE TABLE sync_log ("
                                   "id INTEGER PRIMARY KEY AUTOINCREMENT,"
                                   "db_path TEXT NOT NULL,"
                                   "tbl_name TEXT NOT NULL,"
                                   "src_count INT,"
                                   "current_count INT,"
+                                  "max_rowid INT,"
+                                  "max_create_time INT,"
+                                  "merge_rows INT,"
+                                  "merge_time REAL,"
                                   "createTime INT DEFAULT (strftime('%s', 'now')), "
                                   "updateTime INT DEFAULT (strftime('%s', 'now'))"
                                   ");")
@@ -80,10 +102,362 @@ def check_create_sync_log(connection):
         # 创建联合索引，防止重复
         out_cursor.execute("CREATE UNIQUE INDEX idx_sync_log_db_tbl ON sync_log (db_path, tbl_name);")
         connection.commit()
+    else:
+        # 旧版本创建的 sync_log 没有水位线及用时字段，补充后第一次合并仍按记录数判断
+        sync_log_columns = [i[1] for i in execute_sql(connection, "PRAGMA main.table_info(sync_log)")]
+        for column, column_type in (("max_rowid", "INT"), ("max_create_time", "INT"), ("merge_rows", "INT"),
+                                    ("merge_time", "REAL")):
+            if column not in sync_log_columns:
+                out_cursor.execute(f"ALTER TABLE sync_log ADD COLUMN {column} {column_type}")
+        connection.commit()
     out_cursor.close()
     return True
 
 
+def row_hash(*values):
+    """
+    计算一行数据的64位哈希，参数依次为每列的 typeof(col), CAST(col AS BLOB)
+    NULL 与 '' 视为相同，整数与值相等的浮点数视为相同，与原来对所有列 COALESCE(col, '') 建唯一索引的去重规则一致
+    :return: 有符号64位整数
+    """
+    hash_obj = hashlib.blake2b(digest_size=8)
+    for i in range(0, len(values), 2):
+        col_type, data = values[i], values[i + 1] or b""
+        if col_type == "null":
+            col_type = "text"
+        elif col_type == "real" and float(data).is_integer():
+            col_type, data = "integer", str(int(float(data))).encode()
+        hash_obj.update(f"{col_type}{len(data)}:".encode())
+        hash_obj.update(data)
+    return int.from_bytes(hash_obj.digest(), "little", signed=True)
+
+
+def check_create_row_key(connection, table: str, columns: list, is_deferred: bool = False, key_table: str = None):
+    """
+    创建去重用的唯一索引，INSERT OR IGNORE 依靠该索引忽略重复的行
+    有天然主键(MERGE_ROW_KEYS)的表对主键建索引；其余表增加一列 ROW_HASH_COLUMN 保存整行内容的哈希，对该列建索引；
+    旧版本合并的数据库中已有对所有列 COALESCE 的唯一索引，继续沿用
+    :param connection: SQLite连接
+    :param table: 表名
+    :param columns: 源表的列名
+    :param is_deferred: 暂不创建索引，数据导入完成后由 build_row_key_index 去重并创建
+    :param key_table: 按该表名查找天然主键，默认为 table（MSG 的分区表使用 MSG 的主键）
+    :return: {"index": 索引名, "key": 索引的列表达式, "column": 需要额外写入的列名或None, "expr": 计算该列的SQL表达式}
+             沿用旧索引时返回 None
+    """
+    indexes = execute_sql(connection, "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=?", (table,))
+    if f"{table}_unique_index" in [i[0] for i in indexes]:
+        return None
+
+    key_columns = MERGE_ROW_KEYS.get(key_table or table)
+    if key_columns and set(key_columns) <= set(columns):
+        row_key = {"index": f"{table}_key_index", "column": None, "expr": None,
+                   "key": ','.join(f"COALESCE({column}, '')" for column in key_columns)}
+    else:
+        out_columns = [i[1] for i in execute_sql(connection, f"PRAGMA main.table_info({table})")]
+        if ROW_HASH_COLUMN not in out_columns:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN {ROW_HASH_COLUMN} INTEGER")
+        # 列的顺序固定，保证多次合并时同一行的哈希相同
+        hash_args = ','.join(f"typeof({column}), CAST({column} AS BLOB)" for column in sorted(columns))
+        row_key = {"index": f"{table}_row_hash_index", "column": ROW_HASH_COLUMN, "expr": f"row_hash({hash_args})",
+                   "key": ROW_HASH_COLUMN}
+    if not is_deferred:
+        connection.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {row_key['index']} ON {table} ({row_key['key']})")
+    return row_key
+
+
+def build_row_key_index(connection, table: str, row_key: dict):
+    """
+    批量导入完成后创建唯一索引；有重复的行时先去重，每组保留最先插入的一行，与先建索引再 INSERT OR IGNORE 的结果相同
+    :param connection: SQLite连接
+    :param table: 表名
+    :param row_key: check_create_row_key 的返回值
+    :return:
+    """
+    sql_create_index = f"CREATE UNIQUE INDEX IF NOT EXISTS {row_key['index']} ON {table} ({row_key['key']})"
+    connection.execute("SAVEPOINT build_index")
+    try:
+        connection.execute(sql_create_index)
+    except sqlite3.IntegrityError:
+        connection.execute("ROLLBACK TO build_index")
+        connection.execute(f"DELETE FROM {table} WHERE rowid NOT IN "
+                           f"(SELECT MIN(rowid) FROM {table} GROUP BY {row_key['key']})")
+        connection.execute(sql_create_index)
+    connection.execute("RELEASE build_index")
+
+
+def set_bulk_load_pragmas(connection, is_new: bool):
+    """
+    合并时的写入参数：新建的数据库写入临时文件，日志只保存在内存中(用于单个表出错时回滚)且不同步磁盘，出错时直接删除；
+    向已有数据库追加时使用WAL日志，合并完成后恢复原来的日志模式
+    :param connection: SQLite连接
+    :param is_new: 是否为新建的数据库
+    :return: 原来的日志模式
+    """
+    journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+    connection.execute(f"PRAGMA journal_mode={'MEMORY' if is_new else 'WAL'}")
+    connection.execute(f"PRAGMA synchronous={'OFF' if is_new else 'NORMAL'}")
+    connection.execute(f"PRAGMA cache_size=-{MERGE_CACHE_SIZE}")
+    connection.execute("PRAGMA temp_store=MEMORY")
+    return journal_mode
+
+
+def msg_partition_periods(start_time: int, end_time: int, partition: str):
+    """
+    按年或季度(UTC)划分时间段
+    :param start_time: 开始时间戳
+    :param end_time: 结束时间戳
+    :param partition: "year" 或 "quarter"
+    :return: [(分区表名, 开始时间戳, 结束时间戳(不包含)),...] 覆盖 start_time 到 end_time 所在的时间段
+    """
+    months = 12 if partition == "year" else 3
+    start, end = time.gmtime(max(start_time, 0)), time.gmtime(max(end_time, 0))
+    year, month = start.tm_year, (start.tm_mon - 1) // months * months + 1
+    periods = []
+    while (year, month) <= (end.tm_year, end.tm_mon):
+        next_year, next_month = (year + 1, 1) if month + months > 12 else (year, month + months)
+        name = f"MSG_{year}" if partition == "year" else f"MSG_{year}Q{(month - 1) // 3 + 1}"
+        periods.append((name, calendar.timegm((year, month, 1, 0, 0, 0)),
+                        calendar.timegm((next_year, next_month, 1, 0, 0, 0))))
+        year, month = next_year, next_month
+    return periods
+
+
+def check_msg_partition(connection, partition: str = None):
+    """
+    确定合并时 MSG 的分区方式：已按时间分区的数据库沿用原来的方式；已有 MSG 表(未分区)的数据库不再分区
+    :param connection: SQLite连接
+    :param partition: None(不分区), "year" 或 "quarter"
+    :return: None, "year" 或 "quarter"
+    """
+    if partition not in (None, "year", "quarter"):
+        raise ValueError(f"partition 只能为 None, 'year' 或 'quarter': {partition}")
+    exists = dict(execute_sql(connection, "SELECT name, type FROM sqlite_master WHERE name IN (?, ?)",
+                              ("MSG", MSG_PARTITION_TABLE)))
+    if MSG_PARTITION_TABLE in exists:
+        names = [row[0] for row in execute_sql(connection, f"SELECT name FROM {MSG_PARTITION_TABLE}")]
+        if names:
+            return "quarter" if "Q" in names[0] else "year"
+        return partition or "year"
+    if exists.get("MSG") == "table":
+        if partition:
+            wx_core_loger.warning(f"数据库中已有未分区的 MSG 表，忽略 partition={partition}")
+        return None
+    if partition:
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {MSG_PARTITION_TABLE} ("
+                           "name TEXT PRIMARY KEY, start_time INT NOT NULL, end_time INT NOT NULL)")
+        connection.commit()
+    return partition
+
+
+def create_msg_view(connection):
+    """
+    重新创建 MSG 视图(UNION ALL 所有分区表)，按时间顺序排列分区
+    不同版本微信的 MSG 列可能不同(分区表按第一次写入它的源数据库建表)，视图的列为所有分区表的列的并集，
+    分区表中没有的列为 NULL
+    :param connection: SQLite连接
+    :return:
+    """
+    # 合并时附加的源数据库中也有 MSG 表，这里必须指定 main
+    names = [row[0] for row in execute_sql(connection, f"SELECT name FROM main.{MSG_PARTITION_TABLE} ORDER BY start_time")]
+    connection.execute("DROP VIEW IF EXISTS main.MSG")
+    if not names:
+        return
+    partition_columns = {name: [row[1] for row in execute_sql(connection, f"PRAGMA main.table_info({name})")]
+                         for name in names}
+    columns = []
+    for name in names:
+        columns += [column for column in partition_columns[name]
+                    if column.lower() not in {i.lower() for i in columns}]
+    selects = []
+    for name in names:
+        existed = {column.lower() for column in partition_columns[name]}
+        select_columns = [column if column.lower() in existed else f"NULL AS {column}" for column in columns]
+        selects.append(f"SELECT {','.join(select_columns)} FROM {name}")
+    connection.execute("CREATE VIEW main.MSG AS " + " UNION ALL ".join(selects))
+
+
+def merge_msg_partitions(connection, alias: str, columns: list, where_clauses: list, params: list, partition: str,
+                         deferred_keys: dict = None):
+    """
+    把源数据库中的 MSG 按 CreateTime 写入对应的分区表(不存在时创建)，有新的分区时重建 MSG 视图
+    CreateTime 为空的行写入 1970 年所在的分区；去重主键包含 CreateTime，同一条消息总是写入同一个分区
+    :param connection: SQLite连接
+    :param alias: 源数据库别名
+    :param columns: 源表的列名
+    :param where_clauses: 源表的筛选条件(水位线、时间范围)
+    :param params: 筛选条件的参数
+    :param partition: "year" 或 "quarter"
+    :param deferred_keys: 批量导入模式下延后创建的唯一索引 {table: row_key}，None 表示立即创建索引
+    :return: 写入的行数
+    """
+    where = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    min_time, max_time = execute_sql(connection, f"SELECT MIN(IFNULL(CreateTime, 0)), MAX(IFNULL(CreateTime, 0)) "
+                                                 f"FROM {alias}.MSG {where}", tuple(params))[0]
+    if min_time is None:
+        return 0
+    existed = {row[0] for row in execute_sql(connection, f"SELECT name FROM {MSG_PARTITION_TABLE}")}
+    created, rows = 0, 0
+    for name, start_time, end_time in msg_partition_periods(min_time, max_time, partition):
+        period = "(CreateTime >= ? AND CreateTime < ?" + (" OR CreateTime IS NULL)" if start_time <= 0 else ")")
+        period_where = " AND ".join(where_clauses + [period])
+        period_params = tuple(params) + (start_time, end_time)
+        if not execute_sql(connection, f"SELECT EXISTS(SELECT 1 FROM {alias}.MSG WHERE {period_where})",
+                           period_params)[0][0]:
+            continue
+        if name not in existed:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {name} AS SELECT * FROM {alias}.MSG WHERE 0 = 1")
+            connection.execute(f"INSERT INTO {MSG_PARTITION_TABLE} (name, start_time, end_time) VALUES (?, ?, ?)",
+                               (name, start_time, end_time))
+            existed.add(name)
+            created += 1
+        row_key = check_create_row_key(connection, name, columns, is_deferred=deferred_keys is not None,
+                                       key_table="MSG")
+        if deferred_keys is not None and row_key:
+            deferred_keys[name] = row_key
+        select_columns = columns + [row_key["expr"]] if row_key and row_key["column"] else columns
+        insert_columns = columns + [row_key["column"]] if row_key and row_key["column"] else columns
+        cursor = connection.execute(f"INSERT OR IGNORE INTO {name} ({','.join(insert_columns)}) "
+                                    f"SELECT {','.join(select_columns)} FROM {alias}.MSG WHERE {period_where}",
+                                    period_params)
+        rows += cursor.rowcount
+    if created:
+        create_msg_view(connection)
+    return rows
+
+
+class MergeProgress:
+    """
+    解密/合并进度：按已处理的数据量(字节)估算剩余时间，每次更新调用 callback(event)，event 为:
+    {"phase": 阶段(decrypt/merge/index/check/combine/done), "db": 源数据库路径, "table": 表名, "rows": 写入的行数,
+     "bytes": 本阶段已处理的字节数, "total_bytes": 本阶段总字节数, "elapsed": 已用时间(秒), "eta": 预计剩余时间(秒)或None}
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.start_time = time.time()
+        self.phase_time = self.start_time
+        self.total_bytes = 0
+        self.done_bytes = 0
+        self.event = {}
+
+    def start_phase(self, total_bytes: int):
+        """
+        开始新的阶段，剩余时间按本阶段的处理速度估算
+        :param total_bytes: 本阶段需要处理的字节数
+        """
+        self.phase_time = time.time()
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+
+    def update(self, phase: str, db: str = None, table: str = None, rows: int = None, add_bytes: int = 0, **extra):
+        """
+        更新进度并调用回调函数，回调函数出错时只记录日志，不影响合并
+        :param add_bytes: 本次新处理完成的字节数
+        :param extra: 其他需要发送的信息
+        :return: event
+        """
+        now = time.time()
+        self.done_bytes += add_bytes
+        eta = None
+        if 0 < self.done_bytes < self.total_bytes:
+            eta = round((now - self.phase_time) * (self.total_bytes - self.done_bytes) / self.done_bytes, 1)
+        elif self.total_bytes and self.done_bytes >= self.total_bytes:
+            eta = 0
+        self.event = {"phase": phase, "db": db, "table": table, "rows": rows, "bytes": self.done_bytes,
+                      "total_bytes": self.total_bytes, "elapsed": round(now - self.start_time, 1), "eta": eta}
+        self.event.update(extra)
+        if self.callback:
+            try:
+                self.callback(self.event)
+            except Exception as e:
+                wx_core_loger.warning(f"进度回调出错: {e}", exc_info=True)
+        return self.event
+
+
+def plan_merge_table(connection, alias: str, table: str, init_create_sql: str, is_deferred: bool, partition: str):
+    """
+    生成一个表的合并计划：读取源表的列，在输出数据库中建表并创建去重用的唯一索引
+    :param connection: SQLite连接
+    :param alias: 源数据库别名
+    :param table: 表名
+    :param init_create_sql: 源表的建表语句
+    :param is_deferred: 延后创建唯一索引(批量导入模式)
+    :param partition: MSG 的分区方式，参考 check_msg_partition
+    :return: {"columns": 列名, "has_rowid": bool, "has_create_time": bool, "row_key": check_create_row_key 的返回值,
+              "partitioned": 是否写入MSG分区表}，不需要合并的表返回 None
+    """
+    if table.startswith("sqlite_"):  # sqlite_sequence, sqlite_stat1 等内部表
+        return None
+    if "CREATE TABLE".lower() not in str(init_create_sql).lower():
+        return None
+    # 获取表中的字段名
+    columns = execute_sql(connection, f"PRAGMA {alias}.table_info({table})")
+    if table == "ChatInfo" and len(columns) > 12:  # bizChat中的ChatInfo表与MicroMsg中的ChatInfo表字段不同
+        return None
+    columns = [i[1] if isinstance(i[1], str) else i[1].decode() for i in columns]
+    if not columns:
+        return None
+    is_partitioned = bool(partition) and table == "MSG"  # 分区表及其唯一索引由 merge_msg_partitions 创建
+    row_key = None
+    if not is_partitioned:
+        # 创建表table
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT *  FROM {alias}.{table} WHERE 0 = 1;")
+        # 创建去重用的唯一索引
+        row_key = check_create_row_key(connection, table, columns, is_deferred=is_deferred)
+    return {"columns": columns, "has_rowid": "WITHOUT ROWID" not in init_create_sql.upper(),
+            "has_create_time": "CreateTime" in columns, "row_key": row_key, "partitioned": is_partitioned}
+
+
+def check_create_schema_cache(connection):
+    """
+    检查是否存在表 SCHEMA_CACHE_TABLE，用于保存每个源数据库的合并计划(plan_merge_table)，
+    源数据库的表结构没有变化时，下次合并直接使用
+    """
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {SCHEMA_CACHE_TABLE} ("
+                       "db_path TEXT PRIMARY KEY, schema_hash TEXT NOT NULL, plans TEXT NOT NULL, "
+                       "updateTime INT DEFAULT (strftime('%s', 'now')))")
+
+
+def get_schema_hash(connection, alias: str):
+    """
+    源数据库表结构的哈希：sqlite_master 中所有对象的类型、名称和建表语句。
+    不使用 schema_version：不同的文件(如重新解密、替换后的数据库)的 schema_version 可能相同而表结构不同
+    :param connection: SQLite连接
+    :param alias: 源数据库别名
+    :return: md5 十六进制字符串
+    """
+    rows = connection.execute(f"SELECT type, name, sql FROM {alias}.sqlite_master ORDER BY name").fetchall()
+    return hashlib.md5(json.dumps(rows, ensure_ascii=False, default=repr).encode("utf-8")).hexdigest()
+
+
+def load_merge_plans(connection, db_path: str, schema_hash: str):
+    """
+    读取保存的合并计划，表结构已变化或输出数据库中缺少计划中的表时返回 None
+    :param connection: SQLite连接
+    :param db_path: 源数据库路径(微信数据库的原始路径)
+    :param schema_hash: 源数据库当前的表结构哈希，参考 get_schema_hash
+    :return: {table: plan} or None
+    """
+    cached = execute_sql(connection, f"SELECT plans FROM main.{SCHEMA_CACHE_TABLE} WHERE db_path=? AND schema_hash=?",
+                         (db_path, schema_hash))
+    if not cached:
+        return None
+    plans = json.loads(cached[0][0])
+    out_tables = {row[0] for row in execute_sql(connection, "SELECT name FROM main.sqlite_master WHERE type='table'")}
+    if any(table not in out_tables for table, plan in plans.items() if not plan["partitioned"]):
+        return None
+    return plans
+
+
+def save_merge_plans(connection, db_path: str, schema_hash: str, plans: dict):
+    """
+    保存合并计划，参考 load_merge_plans
+    """
+    connection.execute(f"INSERT OR REPLACE INTO main.{SCHEMA_CACHE_TABLE} (db_path, schema_hash, plans, updateTime) "
+                       "VALUES (?, ?, ?, strftime('%s', 'now'))", (db_path, schema_hash, json.dumps(plans)))
+
+
 @wx_core_error
 def check_create_file_md5(connection):
     """
@@ -94,7 +468,8 @@ def check_create_file_md5(connection):
 
 @wx_core_error
 def merge_db(db_paths: List[dict], save_path: str = "merge.db", is_merge_data: bool = True,
-             startCreateTime: int = 0, endCreateTime: int = 0):
+             startCreateTime: int = 0, endCreateTime: int = 0, partition: str = None, progress_callback=None,
+             fts: bool = False):
     """
     合并数据库 会忽略主键以及重复的行。
     :param db_paths: [{"db_path": "xxx", "de_path": "xxx"},...]
@@ -103,7 +478,17 @@ def merge_db(db_paths: List[dict], save_path: str = "merge.db", is_merge_data: b
     :param is_merge_data: bool 是否合并数据(如果为False，则只解密，并创建表，不插入数据)
     :param startCreateTime: 开始时间戳 主要用于MSG数据库的合并
     :param endCreateTime:  结束时间戳 主要用于MSG数据库的合并
+    :param partition: MSG 按时间分区："year"(每年一个表 MSG_2023) 或 "quarter"(每季度一个表 MSG_2023Q1)，
+                        MSG 为所有分区的 UNION ALL 视图；None 表示不分区。向已有数据库追加时沿用其原来的方式
+    :param progress_callback: 进度回调 progress_callback(event)，event 的格式参考 MergeProgress；也可以直接传入 MergeProgress
+                        每合并完一个表发送一次 merge 事件，结束时的 done 事件中 tables 为各表写入的行数和用时(按用时排序)
+    :param fts: 建立聊天记录的全文索引(参考 msg_fts)；save_path 中已有全文索引时总是增量更新
     :return:
+    注：追加合并时按 sync_log 中的水位线(最大rowid，WITHOUT ROWID 的表为最大CreateTime)只复制新增的行，
+        源数据库中已合并的行被修改(如撤回、编辑)时不会同步，需要删除 save_path 后重新全量合并；
+        save_path 不存在时使用批量导入模式：写入临时文件(日志保存在内存中，不同步磁盘)，每个源数据库一个事务，
+        数据导入完成后再去重建索引，校验(quick_check)并 ANALYZE 后重命名为 save_path；
+        save_path 已存在时在原文件上以WAL模式追加，同样每个源数据库一个事务
     """
     if os.path.isdir(save_path):
         save_path = os.path.join(save_path, f"merge_{int(time.time())}.db")
@@ -116,13 +501,25 @@ def merge_db(db_paths: List[dict], save_path: str = "merge.db", is_merge_data: b
                      }
     else:
         raise TypeError("db_paths 类型错误")
-    outdb = sqlite3.connect(save_path)
+    is_bulk_load = not os.path.exists(save_path)
+    out_path = f"{save_path}.tmp" if is_bulk_load else save_path
+    if is_bulk_load and os.path.exists(out_path):
+        os.remove(out_path)  # 上次合并中断留下的临时文件
+    outdb = sqlite3.connect(out_path)
+    outdb.create_function("row_hash", -1, row_hash, deterministic=True)
+    journal_mode = set_bulk_load_pragmas(outdb, is_bulk_load)
 
     is_sync_log = check_create_sync_log(outdb)
     if not is_sync_log:
         wx_core_loger.warning("创建同步记录表失败")
+    partition = check_msg_partition(outdb, partition)
+    check_create_schema_cache(outdb)
 
     out_cursor = outdb.cursor()
+    deferred_keys = {}  # 批量导入模式下延后创建的唯一索引 {table: row_key}
+    timing = {}  # 各表写入的行数和用时 {table: [rows, seconds]}
+    progress = progress_callback if isinstance(progress_callback, MergeProgress) else MergeProgress(progress_callback)
+    progress.start_phase(sum(os.path.getsize(db[1]) for db in databases.values() if os.path.exists(db[1])))
 
     # 将MSG_db_paths中的数据合并到out_db_path中
     for alias, db in databases.items():
@@ -133,93 +530,344 @@ def merge_db(db_paths: List[dict], save_path: str = "merge.db", is_merge_data: b
         sql_attach = f"ATTACH DATABASE '{de_path}' AS {alias}"
         out_cursor.execute(sql_attach)
         outdb.commit()
-        sql_query_tbl_name = f"SELECT tbl_name, sql FROM {alias}.sqlite_master WHERE type='table' ORDER BY tbl_name;"
-        tables = execute_sql(outdb, sql_query_tbl_name)
-        for table in tables:
-            table, init_create_sql = table[0], table[1]
-            table = table if isinstance(table, str) else table.decode()
-            init_create_sql = init_create_sql if isinstance(init_create_sql, str) else init_create_sql.decode()
-            if table == "sqlite_sequence":
-                continue
-            if "CREATE TABLE".lower() not in str(init_create_sql).lower():
-                continue
-            # 获取表中的字段名
-            sql_query_columns = f"PRAGMA table_info({table})"
-            columns = execute_sql(outdb, sql_query_columns)
-            if table == "ChatInfo" and len(columns) > 12:  # bizChat中的ChatInfo表与MicroMsg中的ChatInfo表字段不同
-                continue
-            col_type = {
-                (i[1] if isinstance(i[1], str) else i[1].decode(),
-                 i[2] if isinstance(i[2], str) else i[2].decode())
-                for i in columns}
-            columns = [i[0] for i in col_type]
-            if not columns or len(columns) < 1:
-                continue
-            # 创建表table
-            sql_create_tbl = f"CREATE TABLE IF NOT EXISTS {table} AS SELECT *  FROM {alias}.{table} WHERE 0 = 1;"
-            out_cursor.execute(sql_create_tbl)
-            # 创建包含 NULL 值比较的 UNIQUE 索引
-            index_name = f"{table}_unique_index"
-            coalesce_columns = ','.join(f"COALESCE({column}, '')" for column in columns)
-            sql = f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table} ({coalesce_columns})"
-            out_cursor.execute(sql)
+        out_cursor.execute("BEGIN")  # 每个源数据库一个事务
+        # 表结构没有变化(sqlite_master 的哈希相同)时直接使用上次保存的合并计划，跳过读取表结构、建表和建索引
+        schema_hash = get_schema_hash(outdb, alias)
+        plans = None if is_bulk_load else load_merge_plans(outdb, db_path, schema_hash)
+        if plans is None:
+            plans = {}
+            sql_query_tbl_name = f"SELECT tbl_name, sql FROM {alias}.sqlite_master WHERE type='table' ORDER BY tbl_name;"
+            for table, init_create_sql in execute_sql(outdb, sql_query_tbl_name):
+                table = table if isinstance(table, str) else table.decode()
+                init_create_sql = init_create_sql if isinstance(init_create_sql, str) else init_create_sql.decode()
+                plan = plan_merge_table(outdb, alias, table, init_create_sql, is_bulk_load, partition)
+                if plan:
+                    plans[table] = plan
+            save_merge_plans(outdb, db_path, schema_hash, plans)
+        for table, plan in plans.items():
+            columns, row_key, is_partitioned = plan["columns"], plan["row_key"], plan["partitioned"]
+            if is_bulk_load and row_key:
+                deferred_keys[table] = row_key
 
             # 插入sync_log
-            sql_query_sync_log = f"SELECT src_count FROM sync_log WHERE db_path=? AND tbl_name=?"
-            sync_log = execute_sql(outdb, sql_query_sync_log, (db_path, table))
-            if not sync_log or len(sync_log) < 1:
-                sql_insert_sync_log = "INSERT INTO sync_log (db_path, tbl_name, src_count, current_count) VALUES (?, ?, ?, ?)"
-                out_cursor.execute(sql_insert_sync_log, (db_path, table, 0, 0))
-            outdb.commit()
+            sql_insert_sync_log = ("INSERT OR IGNORE INTO sync_log (db_path, tbl_name, src_count, current_count) "
+                                   "VALUES (?, ?, ?, ?)")
+            out_cursor.execute(sql_insert_sync_log, (db_path, table, 0, 0))
 
             if is_merge_data:
-                # 比较源数据库和合并后的数据库记录数
-                log_src_count = execute_sql(outdb, sql_query_sync_log, (db_path, table))[0][0]
-                src_count = execute_sql(outdb, f"SELECT COUNT(*) FROM {alias}.{table}")[0][0]
-                if src_count <= log_src_count:
+                # 比较源数据库和合并后的数据库记录数，以及上次合并时的水位线(最大rowid/CreateTime)
+                sql_query_watermark = "SELECT src_count, max_rowid, max_create_time FROM sync_log WHERE db_path=? AND tbl_name=?"
+                log_src_count, log_max_rowid, log_max_create_time = execute_sql(outdb, sql_query_watermark,
+                                                                                (db_path, table))[0]
+                has_rowid, has_create_time = plan["has_rowid"], plan["has_create_time"]
+                sql_query_src = (f"SELECT COUNT(*), {'MAX(rowid)' if has_rowid else 'NULL'}, "
+                                 f"{'MAX(CreateTime)' if has_create_time else 'NULL'} FROM {alias}.{table}")
+                src_count, src_max_rowid, src_max_create_time = execute_sql(outdb, sql_query_src)[0]
+
+                # 有水位线时只复制水位线之后的行：有 rowid 的表按 rowid(主键范围查询)，WITHOUT ROWID 的表按 CreateTime；
+                # 源表被重建(水位线变小)、或末尾的行被删除后 rowid 被重新使用(最大rowid不变而最大CreateTime或行数变化)时
+                # 全量复制，由唯一索引去重
+                if has_rowid:
+                    has_watermark = log_max_rowid is not None and src_max_rowid is not None
+                    is_unchanged = (has_watermark and src_max_rowid == log_max_rowid
+                                    and src_max_create_time == log_max_create_time)
+                    is_incremental = has_watermark and src_max_rowid > log_max_rowid
+                    watermark_where, watermark = "rowid > ?", log_max_rowid
+                else:
+                    has_watermark = log_max_create_time is not None and src_max_create_time is not None
+                    is_unchanged = has_watermark and src_max_create_time == log_max_create_time
+                    is_incremental = has_watermark and src_max_create_time > log_max_create_time
+                    watermark_where, watermark = "CreateTime >= ?", log_max_create_time  # 同一秒的行由唯一索引去重
+                if (is_unchanged or not has_watermark) and src_count <= log_src_count:
                     wx_core_loger.info(f"忽略 {db_path} {de_path} {table} {src_count} {log_src_count}")
                     continue
 
                 # 构建数据查询sql
-                sql_base = f"SELECT {','.join([i for i in columns])} FROM {alias}.{table} "
+                select_columns = columns + [row_key["expr"]] if row_key and row_key["column"] else columns
+                sql_base = f"SELECT {','.join(select_columns)} FROM {alias}.{table} "
                 where_clauses, params = [], []
-                if "CreateTime" in columns:
+                if is_incremental:
+                    where_clauses.append(watermark_where)
+                    params.append(watermark)
+                is_time_range = has_create_time and (startCreateTime > 0 or endCreateTime > 0)
+                if has_create_time:
                     if startCreateTime > 0:
                         where_clauses.append("CreateTime > ?")
                         params.append(startCreateTime)
                     if endCreateTime > 0:
                         where_clauses.append("CreateTime < ?")
                         params.append(endCreateTime)
-                # 如果有WHERE子句，将其添加到SQL语句中，并添加ORDER BY子句
-                sql = f"{sql_base} WHERE {' AND '.join(where_clauses)} ORDER BY CreateTime" if where_clauses else sql_base
-                src_data = execute_sql(outdb, sql, tuple(params))
-                if not src_data or len(src_data) < 1:
+                # 如果有WHERE子句，将其添加到SQL语句中，按时间范围合并时添加ORDER BY子句
+                sql = f"{sql_base} WHERE {' AND '.join(where_clauses)}" if where_clauses else sql_base
+                sql = f"{sql} ORDER BY CreateTime" if is_time_range else sql
+                if where_clauses and not execute_sql(outdb, f"SELECT EXISTS({sql})", tuple(params))[0][0]:
                     continue
-                # 插入数据
-                sql = f"INSERT OR IGNORE INTO {table} ({','.join([i for i in columns])}) VALUES ({','.join(['?'] * len(columns))})"
+                # 按时间范围合并时只复制了部分行，不更新水位线，避免之后的全量合并漏掉范围外的行
+                if is_time_range:
+                    src_max_rowid, src_max_create_time = log_max_rowid, log_max_create_time
+                # 插入数据：直接在SQLite中 INSERT ... SELECT，数据不经过Python，内存占用与表大小无关
+                insert_columns = columns + [row_key["column"]] if row_key and row_key["column"] else columns
+                sql = f"INSERT OR IGNORE INTO {table} ({','.join(insert_columns)}) {sql}"
+                out_cursor.execute("SAVEPOINT merge_table")  # 单个表出错时只回滚这个表
                 try:
-                    out_cursor.executemany(sql, src_data)
+                    table_start = time.time()
+                    if is_partitioned:
+                        rows = merge_msg_partitions(outdb, alias, columns, where_clauses, params, partition,
+                                                    deferred_keys if is_bulk_load else None)
+                    else:
+                        rows = out_cursor.execute(sql, tuple(params)).rowcount
+                    table_time = time.time() - table_start
 
-                    # update sync_log
+                    # update sync_log，批量导入模式下去重后才能得到 current_count
+                    current_count = "0" if is_bulk_load else f"(SELECT COUNT(*) FROM {table})"
                     sql_update_sync_log = ("UPDATE sync_log "
-                                           "SET src_count = ? ,"
-                                           f"current_count=(SELECT COUNT(*) FROM {table}) "
+                                           "SET src_count = ? , max_rowid = ?, max_create_time = ?, "
+                                           f"current_count={current_count}, merge_rows = ?, merge_time = ?, "
+                                           "updateTime = strftime('%s', 'now') "
                                            "WHERE db_path=? AND tbl_name=?")
-                    out_cursor.execute(sql_update_sync_log, (src_count, db_path, table))
-
+                    out_cursor.execute(sql_update_sync_log, (src_count, src_max_rowid, src_max_create_time,
+                                                             rows, round(table_time, 3), db_path, table))
+                    out_cursor.execute("RELEASE merge_table")
+                    table_timing = timing.setdefault(table, [0, 0.0])
+                    table_timing[0] += rows
+                    table_timing[1] += table_time
+                    progress.update("merge", db=db_path, table=table, rows=rows, table_time=round(table_time, 3))
                 except Exception as e:
-                    wx_core_loger.error(
-                        f"error: {db_path}\n{de_path}\n{table}\n{sql}\n{src_data}\n{len(src_data)}\n{e}\n",
-                        exc_info=True)
+                    out_cursor.execute("ROLLBACK TO merge_table")
+                    out_cursor.execute("RELEASE merge_table")
+                    wx_core_loger.error(f"error: {db_path}\n{de_path}\n{table}\n{sql}\n{params}\n{e}\n", exc_info=True)
         # 分离数据库
+        outdb.commit()  # INSERT ... SELECT 会锁定附加的数据库，提交后才能分离
         sql_detach = f"DETACH DATABASE {alias}"
         out_cursor.execute(sql_detach)
         outdb.commit()
+        progress.update("merge", db=db_path, add_bytes=os.path.getsize(de_path) if os.path.exists(de_path) else 0)
+
+    # 批量导入完成后去重并创建唯一索引
+    for table, row_key in deferred_keys.items():
+        progress.update("index", table=table)
+        build_row_key_index(outdb, table, row_key)
+    if is_merge_data and (fts or msg_fts_exists(outdb)):
+        progress.update("index", table=FTS_TABLE)
+        if update_msg_fts(outdb) and is_bulk_load:
+            out_cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    if is_bulk_load:
+        for table, in execute_sql(outdb, "SELECT DISTINCT tbl_name FROM sync_log "
+                                         "WHERE tbl_name IN (SELECT name FROM sqlite_master)"):
+            out_cursor.execute(f"UPDATE sync_log SET current_count=(SELECT COUNT(*) FROM {table}) WHERE tbl_name=?",
+                               (table,))
+    outdb.commit()
+
+    if is_bulk_load:
+        # 新建的数据库校验通过并收集统计信息后再替换到 save_path；追加合并时不扫描整个数据库，耗时只与新增数据有关
+        progress.update("check")
+        check_result = execute_sql(outdb, "PRAGMA quick_check")
+        if not check_result or check_result[0][0] != "ok":
+            out_cursor.close()
+            outdb.close()
+            raise sqlite3.DatabaseError(f"合并后的数据库校验失败: {out_path} {check_result}")
+        out_cursor.execute("ANALYZE")
+        outdb.commit()
+    elif journal_mode.lower() != "wal":
+        try:
+            out_cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        except sqlite3.OperationalError as e:  # 其他连接正在使用该数据库时无法退出WAL模式，不影响数据
+            wx_core_loger.warning(f"恢复日志模式失败: {save_path} {e}")
     out_cursor.close()
     outdb.close()
+    if is_bulk_load:
+        os.replace(out_path, save_path)
+    tables = sorted(({"table": table, "rows": rows, "time": round(seconds, 3)}
+                     for table, (rows, seconds) in timing.items()), key=lambda t: t["time"], reverse=True)
+    progress.update("done", rows=sum(t["rows"] for t in tables), tables=tables, save_path=save_path)
     return save_path
 
 
+@wx_core_error
+def get_merge_timing(merge_path: str):
+    """
+    读取 sync_log 中各表最近一次合并写入的行数和用时，汇总所有源数据库，用于找出合并耗时最多的表
+    :param merge_path: 合并后的数据库路径
+    :return: [{"table": 表名, "rows": 行数, "time": 用时(秒)},...] 按用时从多到少排序
+    """
+    connection = sqlite3.connect(merge_path)
+    try:
+        columns = [i[1] for i in connection.execute("PRAGMA main.table_info(sync_log)")]
+        if "merge_time" not in columns:
+            return []
+        rows = connection.execute("SELECT tbl_name, SUM(merge_rows), SUM(merge_time) FROM sync_log "
+                                  "WHERE merge_time IS NOT NULL GROUP BY tbl_name ORDER BY SUM(merge_time) DESC")
+        return [{"table": table, "rows": rows or 0, "time": round(seconds, 3)} for table, rows, seconds in rows]
+    finally:
+        connection.close()
+
+
+def _merge_group_worker(args):
+    """
+    进程池任务：把一组数据库合并到中间文件（merge_db 被装饰器包装后无法在进程间传递，这里单独定义）
+    """
+    db_paths, save_path, kwargs = args
+    return merge_db(db_paths, save_path, **kwargs)
+
+
+@wx_core_error
+def combine_merged_db(merged_paths: List[str], save_path: str):
+    """
+    合并 merge_db 生成的多个数据库（parallel_merge_db 的第二阶段）
+    以最大的一个为基础直接重命名，其余的附加后复制：基础库中没有的表连同唯一索引一起复制，已有的表 INSERT OR IGNORE，
+    同时复制 sync_log，保证之后在合并结果上追加合并时仍能使用水位线
+    :param merged_paths: merge_db 生成的数据库路径
+    :param save_path: 输出文件路径(不能已存在)
+    :return: save_path
+    """
+    merged_paths = sorted(merged_paths, key=os.path.getsize, reverse=True)
+    out_path = f"{save_path}.tmp"
+    os.replace(merged_paths[0], out_path)
+
+    outdb = sqlite3.connect(out_path)
+    is_done = False
+    try:
+        set_bulk_load_pragmas(outdb, True)
+        out_cursor = outdb.cursor()
+        sync_log_columns = ("db_path, tbl_name, src_count, current_count, max_rowid, max_create_time, "
+                            "merge_rows, merge_time, createTime, updateTime")
+        for i, merged_path in enumerate(merged_paths[1:]):
+            alias = f"dbm_{i}"
+            out_cursor.execute(f"ATTACH DATABASE '{merged_path}' AS {alias}")
+            out_cursor.execute("BEGIN")  # 每个中间文件一个事务
+            tables = execute_sql(outdb, f"SELECT name FROM {alias}.sqlite_master WHERE type='table'")
+            for table, in tables:
+                if table.startswith("sqlite_") or table in ("sync_log", MSG_PARTITION_TABLE, SCHEMA_CACHE_TABLE):
+                    continue
+                if table.startswith(FTS_TABLE) or table == FTS_LOG_TABLE:  # 全文索引的 rowid 对应各自的数据库，合并后重建
+                    continue
+                out_cursor.execute("SAVEPOINT combine_table")  # 单个表出错时只回滚这个表
+                sql = None
+                try:
+                    columns = ','.join(row[1] for row in execute_sql(outdb, f"PRAGMA {alias}.table_info({table})"))
+                    is_new_table = table not in {row[0] for row in execute_sql(
+                        outdb, "SELECT name FROM main.sqlite_master WHERE type='table'")}
+                    if is_new_table:
+                        sql = f"CREATE TABLE {table} AS SELECT * FROM {alias}.{table} WHERE 0 = 1"
+                        out_cursor.execute(sql)
+                    sql = f"INSERT OR IGNORE INTO {table} ({columns}) SELECT {columns} FROM {alias}.{table}"
+                    out_cursor.execute(sql)
+                    if is_new_table:  # 连同索引一起复制，导入数据后再建索引更快；同名索引已存在时跳过
+                        sql_query_index = (f"SELECT sql FROM {alias}.sqlite_master "
+                                           f"WHERE type='index' AND tbl_name=? AND sql IS NOT NULL")
+                        for index_sql, in execute_sql(outdb, sql_query_index, (table,)):
+                            sql = CREATE_INDEX_PATTERN.sub(r"CREATE \1INDEX IF NOT EXISTS ", index_sql, count=1)
+                            out_cursor.execute(sql)
+                    out_cursor.execute("RELEASE combine_table")
+                except Exception as e:
+                    out_cursor.execute("ROLLBACK TO combine_table")
+                    out_cursor.execute("RELEASE combine_table")
+                    wx_core_loger.error(f"error: {merged_path}\n{table}\n{sql}\n{e}\n", exc_info=True)
+            out_cursor.execute(f"INSERT OR REPLACE INTO sync_log ({sync_log_columns}) "
+                               f"SELECT {sync_log_columns} FROM {alias}.sync_log")
+            if SCHEMA_CACHE_TABLE in {row[0] for row in tables}:
+                check_create_schema_cache(outdb)
+                out_cursor.execute(f"INSERT OR REPLACE INTO {SCHEMA_CACHE_TABLE} "
+                                   f"SELECT * FROM {alias}.{SCHEMA_CACHE_TABLE}")
+            if MSG_PARTITION_TABLE in {row[0] for row in tables}:
+                check_msg_partition(outdb, "year")  # 基础库中没有分区记录表时创建，分区方式以分区表名为准
+                out_cursor.execute(f"INSERT OR IGNORE INTO {MSG_PARTITION_TABLE} (name, start_time, end_time) "
+                                   f"SELECT name, start_time, end_time FROM {alias}.{MSG_PARTITION_TABLE}")
+                create_msg_view(outdb)
+            outdb.commit()
+            out_cursor.execute(f"DETACH DATABASE {alias}")
+
+        for table, in execute_sql(outdb, "SELECT DISTINCT tbl_name FROM sync_log "
+                                         "WHERE tbl_name IN (SELECT name FROM sqlite_master)"):
+            out_cursor.execute(f"UPDATE sync_log SET current_count=(SELECT COUNT(*) FROM {table}) WHERE tbl_name=?",
+                               (table,))
+        outdb.commit()
+        check_result = execute_sql(outdb, "PRAGMA quick_check")
+        if not check_result or check_result[0][0] != "ok":
+            raise sqlite3.DatabaseError(f"合并后的数据库校验失败: {out_path} {check_result}")
+        out_cursor.execute("ANALYZE")
+        outdb.commit()
+        out_cursor.close()
+        outdb.close()
+        os.replace(out_path, save_path)
+        is_done = True
+    finally:
+        if not is_done:  # 出错时删除临时文件，不留下不完整的数据库
+            outdb.close()
+            for path in (out_path, f"{out_path}-journal", f"{out_path}-wal", f"{out_path}-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
+    return save_path
+
+
+@wx_core_error
+def parallel_merge_db(db_groups: List[List[dict]], save_path: str, workers: int = None, is_merge_data: bool = True,
+                      startCreateTime: int = 0, endCreateTime: int = 0, partition: str = None,
+                      progress_callback=None, fts: bool = False):
+    """
+    分组并行合并：第一阶段每组数据库(如 MSG0~MSGn、MediaMSG0~n、MicroMsg 等)在各自的进程中合并为中间文件，
+    第二阶段由 combine_merged_db 合并中间文件。只用于生成新的数据库，save_path 已存在时请使用 merge_db 追加合并
+    :param db_groups: [[{"db_path": "xxx", "de_path": "xxx"},...],...] 每组的格式同 merge_db 的 db_paths
+    :param save_path: 输出文件路径
+    :param workers: 并行的进程数，0 或 None 表示使用全部CPU核心
+    :param is_merge_data: 参考 merge_db
+    :param startCreateTime: 参考 merge_db
+    :param endCreateTime: 参考 merge_db
+    :param partition: 参考 merge_db
+    :param progress_callback: 参考 merge_db，各组在子进程中合并，每合并完一组发送一次 merge 事件(db 为该组的数据库)
+    :param fts: 参考 merge_db，全文索引在合并所有组之后建立
+    :return: save_path
+    """
+    if os.path.isdir(save_path):
+        save_path = os.path.join(save_path, f"merge_{int(time.time())}.db")
+    if os.path.exists(save_path):
+        raise FileExistsError(f"{save_path} 已存在，请使用 merge_db 追加合并")
+    db_groups = [group for group in db_groups if group]
+    if len(db_groups) < 2:
+        return merge_db(db_groups[0] if db_groups else [], save_path, is_merge_data=is_merge_data,
+                        startCreateTime=startCreateTime, endCreateTime=endCreateTime, partition=partition,
+                        progress_callback=progress_callback, fts=fts)
+
+    parts_path = f"{save_path}.parts"
+    if os.path.exists(parts_path):
+        shutil.rmtree(parts_path, True)  # 上次合并中断留下的中间文件
+    os.makedirs(parts_path)
+
+    # 数据量大的组先开始，减少最后只剩一个进程在运行的时间
+    db_groups.sort(key=lambda group: sum(os.path.getsize(db.get("de_path", db["db_path"])) for db in group),
+                   reverse=True)
+    kwargs = {"is_merge_data": is_merge_data, "startCreateTime": startCreateTime, "endCreateTime": endCreateTime,
+              "partition": partition}
+    tasks = [(group, os.path.join(parts_path, f"part_{i}.db"), kwargs) for i, group in enumerate(db_groups)]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    progress = progress_callback if isinstance(progress_callback, MergeProgress) else MergeProgress(progress_callback)
+    group_bytes = [sum(os.path.getsize(db.get("de_path", db["db_path"])) for db in group) for group in db_groups]
+    progress.start_phase(sum(group_bytes))
+    try:
+        merged_paths = [None] * len(tasks)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_merge_group_worker, task): i for i, task in enumerate(tasks)}
+            for future in as_completed(futures):
+                i = futures[future]
+                merged_paths[i] = future.result()
+                progress.update("merge", db=[db["db_path"] for db in db_groups[i]], add_bytes=group_bytes[i])
+        if not all(isinstance(path, str) for path in merged_paths):
+            raise sqlite3.DatabaseError(f"分组合并失败: {merged_paths}")
+        progress.update("combine")
+        combined_path = combine_merged_db(merged_paths, save_path)
+        if not isinstance(combined_path, str):  # 出错原因已由 combine_merged_db 记录到日志
+            raise sqlite3.DatabaseError(f"合并中间文件失败: {merged_paths} -> {save_path}")
+        save_path = combined_path
+        if fts and is_merge_data:
+            progress.update("index", table=FTS_TABLE)
+            build_msg_fts(save_path)
+        tables = get_merge_timing(save_path)
+        progress.update("done", rows=sum(t["rows"] for t in tables), tables=tables, save_path=save_path)
+        return save_path
+    finally:
+        shutil.rmtree(parts_path, True)
+
+
 # @wx_core_error
 # def merge_db1(db_paths: list[dict], save_path: str = "merge.db", is_merge_data: bool = True,
 #               startCreateTime: int = 0, endCreateTime: int = 0):
@@ -323,26 +971,36 @@ def decrypt_merge(wx_path: str, key: str, outpath: str = "",
                   merge_save_path: str = None,
                   is_merge_data=True, is_del_decrypted: bool = True,
                   startCreateTime: int = 0, endCreateTime: int = 0,
-                  db_type=None) -> (bool, str):
+                  db_type=None, workers: int = 1, is_incremental: bool = False,
+                  partition: str = None, progress_callback=None, fts: bool = False) -> (bool, str):
     """
     解密合并数据库 msg.db, microMsg.db, media.db,注意：会删除原数据库
     :param wx_path: 微信路径 eg: C:\\*******\\WeChat Files\\wxid_*********
     :param key: 解密密钥
     :param outpath: 输出路径
-    :param merge_save_path: 合并后的数据库路径
+    :param merge_save_path: 合并后的数据库路径，默认为 outpath/merge_时间戳.db，增量解密时为 outpath/merge_all.db
     :param is_merge_data: 是否合并数据(如果为False，则只解密，并创建表，不插入数据)
     :param is_del_decrypted: 是否删除解密后的数据库（除了合并后的数据库）
     :param startCreateTime: 开始时间戳 主要用于MSG数据库的合并
     :param endCreateTime:  结束时间戳 主要用于MSG数据库的合并
     :param db_type: 数据库类型，从核心数据库中选择
+    :param workers: 并行解密的进程数，参考 batch_decrypt；不为1且合并到新的数据库时，各类数据库也分组并行合并(parallel_merge_db)
+    :param is_incremental: 增量解密，保留 outpath/decrypted 中上次解密的结果，只重新解密发生变化的页
+                            (此时不会删除解密后的数据库)
+    :param partition: MSG 按时间分区("year" 或 "quarter")，参考 merge_db
+    :param progress_callback: 进度回调 progress_callback(event)，参考 MergeProgress；
+                            解密阶段每解密完一个文件发送一次 decrypt 事件，合并阶段参考 merge_db
+    :param fts: 建立聊天记录的全文索引，参考 merge_db
     :return: (true,解密后的数据库路径) or (false,错误信息)
     """
     if db_type is None:
         db_type = []
 
     outpath = outpath if outpath else "decrypt_merge_tmp"
-    merge_save_path = os.path.join(outpath,
-                                   f"merge_{int(time.time())}.db") if merge_save_path is None else merge_save_path
+    if merge_save_path is None:
+        # 增量解密时每次合并到同一个数据库，只追加新增的行；否则每次新建数据库
+        merge_name = "merge_all.db" if is_incremental else f"merge_{int(time.time())}.db"
+        merge_save_path = os.path.join(outpath, merge_name)
     decrypted_path = os.path.join(outpath, "decrypted")
 
     if not wx_path or not key or not os.path.exists(wx_path):
@@ -350,13 +1008,14 @@ def decrypt_merge(wx_path: str, key: str, outpath: str = "",
         return False, "参数错误"
 
     # 解密
+    from .wx_info import get_core_db  # 仅支持Windows，不在模块顶部导入，其他平台也能使用合并等功能
     code, wxdbpaths = get_core_db(wx_path, db_type)
     if not code:
         wx_core_loger.error(f"获取数据库路径失败{wxdbpaths}", exc_info=True)
         return False, wxdbpaths
 
     # 判断out_path是否为空目录
-    if os.path.exists(decrypted_path) and os.listdir(decrypted_path):
+    if not is_incremental and os.path.exists(decrypted_path) and os.listdir(decrypted_path):
         for root, dirs, files in os.walk(decrypted_path, topdown=False):
             for name in files:
                 os.remove(os.path.join(root, name))
@@ -368,8 +1027,18 @@ def decrypt_merge(wx_path: str, key: str, outpath: str = "",
 
     wxdbpaths = {i["db_path"]: i for i in wxdbpaths}
 
+    progress = progress_callback if isinstance(progress_callback, MergeProgress) else MergeProgress(progress_callback)
+    progress.start_phase(sum(os.path.getsize(path) for path in wxdbpaths))
+
+    def on_decrypted(done_count, total_count, result):
+        code1, ret1 = result
+        db_path = ret1[0] if code1 else None
+        progress.update("decrypt", db=db_path, add_bytes=os.path.getsize(db_path) if code1 else 0,
+                        done_count=done_count, total_count=total_count)
+
     # 调用 decrypt 函数，并传入参数   # 解密
-    code, ret = batch_decrypt(key=key, db_path=list(wxdbpaths.keys()), out_path=decrypted_path, is_print=False)
+    code, ret = batch_decrypt(key=key, db_path=list(wxdbpaths.keys()), out_path=decrypted_path, is_print=False,
+                              workers=workers, progress_callback=on_decrypted, incremental=is_incremental)
     if not code:
         wx_core_loger.error(f"解密失败{ret}", exc_info=True)
         return False, ret
@@ -380,11 +1049,21 @@ def decrypt_merge(wx_path: str, key: str, outpath: str = "",
             out_dbs.append(ret1)
 
     parpare_merge_db_path = []
+    db_groups = {}  # {db_type: [{"db_path": "xxx", "de_path": "xxx"},...]}
     for db_path, out_path, _ in out_dbs:
         parpare_merge_db_path.append({"db_path": db_path, "de_path": out_path})
-    merge_save_path = merge_db(parpare_merge_db_path, merge_save_path, is_merge_data=is_merge_data,
-                               startCreateTime=startCreateTime, endCreateTime=endCreateTime)
-    if is_del_decrypted:
+        db_groups.setdefault(wxdbpaths[db_path].get("db_type"), []).append(parpare_merge_db_path[-1])
+    if workers != 1 and len(db_groups) > 1 and not os.path.exists(merge_save_path):
+        # 新建合并数据库时，各类数据库分组并行合并
+        merge_save_path = parallel_merge_db(list(db_groups.values()), merge_save_path, workers=workers,
+                                            is_merge_data=is_merge_data, startCreateTime=startCreateTime,
+                                            endCreateTime=endCreateTime, partition=partition,
+                                            progress_callback=progress, fts=fts)
+    else:
+        merge_save_path = merge_db(parpare_merge_db_path, merge_save_path, is_merge_data=is_merge_data,
+                                   startCreateTime=startCreateTime, endCreateTime=endCreateTime,
+                                   partition=partition, progress_callback=progress, fts=fts)
+    if is_del_decrypted and not is_incremental:
         shutil.rmtree(decrypted_path, True)
     if isinstance(merge_save_path, str):
         return True, merge_save_path
@@ -395,66 +1074,39 @@ def decrypt_merge(wx_path: str, key: str, outpath: str = "",
 @wx_core_error
 def merge_real_time_db(key, merge_path: str, db_paths: [dict] or dict, real_time_exe_path: str = None):
     """
-    合并实时数据库消息,暂时只支持64位系统
+    合并实时数据库消息：增量解密发生变化的页(包括WAL中尚未写回数据库文件的新数据)，只把新增的行合并到 merge_path
+    同一个 merge_path 多次调用时复用上次的文件状态和解密结果，参考 RealTimeSync
     :param key:  解密密钥
     :param merge_path:  合并后的数据库路径
     :param db_paths:  [dict] or dict eg: {'wxid': 'wxid_***', 'db_type': 'MicroMsg',
                         'db_path': 'C:\**\wxid_***\Msg\MicroMsg.db', 'wxid_dir': 'C:\***\wxid_***'}
-    :param real_time_exe_path:  实时数据库合并工具路径
-    :return:
+    :param real_time_exe_path:  已不再使用(原 realTime.exe 的路径)，保留该参数兼容旧的调用
+    :return: (True, merge_path) or (False, 错误信息)
     """
-    try:
-        import platform
-    except:
-        raise ImportError("未找到模块 platform")
-    # 判断系统位数是否为64位，如果不是则抛出异常
-    if platform.architecture()[0] != '64bit':
-        raise Exception("System is not 64-bit.")
+    from .real_time import get_real_time_sync
 
     if isinstance(db_paths, dict):
         db_paths = [db_paths]
+    db_paths = [db for db in db_paths if os.path.exists(db["db_path"] if isinstance(db, dict) else db)]
 
     merge_path = os.path.abspath(merge_path)  # 合并后的数据库路径，必须为绝对路径
     merge_path_base = os.path.dirname(merge_path)  # 合并后的数据库路径
     if not os.path.exists(merge_path_base):
         os.makedirs(merge_path_base)
 
-    endbs = []
-    for db_info in db_paths:
-        db_path = os.path.abspath(db_info['db_path'])
-        if not os.path.exists(db_path):
-            # raise FileNotFoundError("数据库不存在")
-            continue
-        endbs.append(os.path.abspath(db_path))
-    endbs = '" "'.join(list(set(endbs)))
-
-    if not os.path.exists(real_time_exe_path if real_time_exe_path else ""):
-        current_path = os.path.dirname(__file__)  # 获取当前文件夹路径
-        real_time_exe_path = os.path.join(current_path, "tools", "realTime.exe")
-    if not os.path.exists(real_time_exe_path):
-        raise FileNotFoundError("未找到实时数据库合并工具")
-    real_time_exe_path = os.path.abspath(real_time_exe_path)
-
-    # 调用cmd命令
-    cmd = f'{real_time_exe_path} "{key}" "{merge_path}" "{endbs}"'
-    # os.system(cmd)
-    # wx_core_loger.info(f"合并实时数据库命令：{cmd}")
-    p = subprocess.Popen(cmd, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=merge_path_base,
-                         creationflags=subprocess.CREATE_NO_WINDOW)
-    out, err = p.communicate()  # 查看返回值
-    if out and out.decode("utf-8").find("SUCCESS") >= 0:
-        wx_core_loger.info(f"合并实时数据库成功{out}")
+    code, ret = get_real_time_sync(key, merge_path, db_paths).sync_once()
+    if code:
+        wx_core_loger.info(f"合并实时数据库成功 {ret}")
         return True, merge_path
     else:
-        wx_core_loger.error(f"合并实时数据库失败\n{out}\n{err}")
-        return False, (out, err)
+        wx_core_loger.error(f"合并实时数据库失败 {ret}")
+        return False, ret
 
 
 @wx_core_error
 def all_merge_real_time_db(key, wx_path, merge_path: str, real_time_exe_path: str = None):
     """
-    合并所有实时数据库
-    注：这是全量合并，会有可能产生重复数据，需要自行去重
+    合并所有实时数据库(只合并新增的行，按天然主键去重)
     :param key:  解密密钥
     :param wx_path:  微信文件夹路径 eg：C:\*****\WeChat Files\wxid*******
     :param merge_path:  合并后的数据库路径 eg: C:\\*******\\WeChat Files\\wxid_*********\\merge.db
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-#
+# -------------------------------------------------------------------------------
+# Name:         merge_estimate.py
+# Description:  解密合并前的预估(dry-run)：只解密 sqlite_master 和各表 b-tree 中抽样的少量页，按表估算行数、输出大小、磁盘占用和耗时
+# Date:         2026/10/18
+# 用法：
+#     code, ret = estimate_decrypt_merge(r"C:\***\WeChat Files\wxid_***", key, workers=4)
+#     ret["total"]  # {"size": ..., "rows": ..., "out_bytes": ..., "disk_bytes": ..., "seconds": ...}
+# -------------------------------------------------------------------------------
+import os
+import random
+import time
+
+from .decryption import DEFAULT_PAGESIZE, SALT_SIZE, RESERVE_SIZE, page_hmac, _decrypt_pages
+from .utils import wx_core_error, wx_core_loger, derive_keys, cache_derived_keys
+
+# 默认的处理速度(单进程)，calibrate=True 时解密速度按本机实际测量
+DECRYPT_BYTES_PER_SECOND = 250 * 1024 * 1024
+MERGE_ROWS_PER_SECOND = 250000
+MERGE_BYTES_PER_SECOND = 150 * 1024 * 1024
+INDEX_BYTES_PER_ROW = 40  # 合并时去重唯一索引每行约占用的字节数
+CALIBRATE_PAGES = 2048  # 测量解密速度时解密的页数(8MB)
+
+# SQLite b-tree 页类型
+TABLE_INTERIOR, TABLE_LEAF = 0x05, 0x0d
+MAX_DESCENTS = 64  # 每个表随机下探的最多次数
+
+
+def _read_page(f, enc_key: bytes, pgno: int):
+    """
+    读取并解密一页，返回明文页(不完整的页返回 None)
+    """
+    f.seek((pgno - 1) * DEFAULT_PAGESIZE)
+    data = f.read(DEFAULT_PAGESIZE)
+    if len(data) < DEFAULT_PAGESIZE:
+        return None
+    page = memoryview(bytearray(DEFAULT_PAGESIZE))
+    _decrypt_pages(enc_key, memoryview(data), page, pgno)
+    return page
+
+
+def _varint(buf, offset: int):
+    """
+    读取 SQLite 的变长整数
+    :return: (值, 下一个字节的偏移)
+    """
+    value = 0
+    for i in range(8):
+        byte = buf[offset + i]
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, offset + i + 1
+    return (value << 8) | buf[offset + 8], offset + 9
+
+
+def _record(payload: bytes):
+    """
+    解析 SQLite 记录(行)为值列表，只用于读取 sqlite_master
+    """
+    header_size, offset = _varint(payload, 0)
+    serial_types = []
+    while offset < header_size:
+        serial_type, offset = _varint(payload, offset)
+        serial_types.append(serial_type)
+    values, offset = [], header_size
+    int_sizes = {1: 1, 2: 2, 3: 3, 4: 4, 5: 6, 6: 8}
+    for serial_type in serial_types:
+        if serial_type in int_sizes:
+            size = int_sizes[serial_type]
+            values.append(int.from_bytes(payload[offset:offset + size], "big", signed=True))
+        elif serial_type in (8, 9):
+            size = 0
+            values.append(serial_type - 8)
+        elif serial_type >= 12:
+            size = (serial_type - 12) // 2
+            data = bytes(payload[offset:offset + size])
+            values.append(data.decode("utf-8", errors="ignore") if serial_type % 2 else data)
+        else:  # NULL、浮点数(sqlite_master 中不会出现)
+            size = 8 if serial_type == 7 else 0
+            values.append(None)
+        offset += size
+    return values
+
+
+class _BtreeSampler:
+    """
+    按需解密页并读取 b-tree：完整读取 sqlite_master，对每个表从根页随机下探到叶子页，
+    按路径上各层的子页数之积估算叶子页数(Knuth 估计)，从而估算表的行数、页数(含溢出页)
+    """
+
+    def __init__(self, f, enc_key: bytes, pages: int, usable_size: int, rng):
+        self.f = f
+        self.enc_key = enc_key
+        self.pages = pages
+        self.usable_size = usable_size
+        self.rng = rng
+        self._cache = {}
+
+    @property
+    def sampled_pages(self):
+        return len(self._cache)
+
+    def page(self, pgno: int):
+        """
+        :return: (明文页, b-tree 页头的偏移)，页号无效时返回 (None, 0)
+        """
+        if not 1 <= pgno <= self.pages:
+            return None, 0
+        if pgno not in self._cache:
+            self._cache[pgno] = _read_page(self.f, self.enc_key, pgno)
+        return self._cache[pgno], 100 if pgno == 1 else 0  # 第一页的 b-tree 页头在100字节的文件头之后
+
+    @staticmethod
+    def cells(page, offset: int):
+        """
+        页中各单元的偏移
+        """
+        count = int.from_bytes(page[offset + 3:offset + 5], "big")
+        start = offset + (12 if page[offset] == TABLE_INTERIOR else 8)
+        return [int.from_bytes(page[start + 2 * i:start + 2 * i + 2], "big") for i in range(count)]
+
+    def local_size(self, payload_size: int):
+        """
+        表叶子页单元中保存在本页的数据长度，其余部分保存在溢出页中
+        """
+        max_local = self.usable_size - 35
+        if payload_size <= max_local:
+            return payload_size
+        min_local = (self.usable_size - 12) * 32 // 255 - 23
+        local = min_local + (payload_size - min_local) % (self.usable_size - 4)
+        return local if local <= max_local else min_local
+
+    def overflow_pages(self, payload_size: int):
+        overflow = payload_size - self.local_size(payload_size)
+        return -(-overflow // (self.usable_size - 4)) if overflow > 0 else 0
+
+    def leaf_cells(self, page, offset: int):
+        """
+        表叶子页中各单元的 (数据长度, 数据在页中的起始偏移)
+        """
+        result = []
+        for cell in self.cells(page, offset):
+            payload_size, pos = _varint(page, cell)
+            _, pos = _varint(page, pos)  # rowid
+            result.append((payload_size, pos))
+        return result
+
+    def payload(self, page, pos: int, payload_size: int):
+        """
+        读取单元的完整数据(沿溢出页链表读取)
+        """
+        local = self.local_size(payload_size)
+        data = bytearray(page[pos:pos + local])
+        if local < payload_size:
+            next_pgno = int.from_bytes(page[pos + local:pos + local + 4], "big")
+            while next_pgno and len(data) < payload_size:
+                overflow, _ = self.page(next_pgno)
+                if overflow is None:
+                    break
+                next_pgno = int.from_bytes(overflow[:4], "big")
+                data += overflow[4:min(self.usable_size, 4 + payload_size - len(data))]
+        return bytes(data)
+
+    def children(self, page, offset: int):
+        """
+        表内部页的子页号
+        """
+        pgnos = [int.from_bytes(page[cell:cell + 4], "big") for cell in self.cells(page, offset)]
+        return pgnos + [int.from_bytes(page[offset + 8:offset + 12], "big")]
+
+    def read_master(self):
+        """
+        读取 sqlite_master 中的所有表
+        :return: [(表名, 根页号, 建表语句),...]
+        """
+        tables, stack, visited = [], [1], set()
+        while stack:
+            pgno = stack.pop()
+            page, offset = self.page(pgno)
+            if page is None or pgno in visited:
+                continue
+            visited.add(pgno)
+            if page[offset] == TABLE_INTERIOR:
+                stack += self.children(page, offset)
+                continue
+            for payload_size, pos in self.leaf_cells(page, offset):
+                values = _record(self.payload(page, pos, payload_size))
+                if len(values) >= 5 and values[0] == "table" and isinstance(values[3], int) and values[3] > 0:
+                    tables.append((values[1], values[3], values[4]))
+        return tables
+
+    def estimate_table(self, root: int, descents: int):
+        """
+        估算一个表的行数和页数(内部页、叶子页和溢出页)，根页就是叶子页时结果是准确的
+        :return: (行数, 页数)
+        """
+        rows = pages = 0.0
+        count = 0
+        for _ in range(max(descents, 1)):
+            pgno, weight, nodes = root, 1, 1
+            while True:
+                page, offset = self.page(pgno)
+                if page is None or page[offset] not in (TABLE_INTERIOR, TABLE_LEAF):
+                    weight = 0  # 损坏的页，本次下探不计入
+                    break
+                if page[offset] == TABLE_LEAF:
+                    break
+                children = self.children(page, offset)
+                weight *= len(children)
+                nodes += weight
+                pgno = self.rng.choice(children)
+            if not weight:
+                continue
+            cells = self.leaf_cells(page, offset)
+            overflow = sum(self.overflow_pages(size) for size, _ in cells)
+            if nodes == 1:  # 根页就是叶子页
+                return len(cells), 1 + overflow
+            rows += weight * len(cells)
+            pages += nodes + weight * overflow
+            count += 1
+        if not count:
+            return 0, 0
+        return int(rows / count), min(int(pages / count), self.pages)
+
+
+@wx_core_error
+def estimate_db(key: str, db_path: str, sample_pages: int = 128, seed: int = 0):
+    """
+    估算单个加密数据库：验证密钥后解密 sqlite_master 得到各表的根页，再从每个表的根页随机下探到叶子页
+    (共解密约 sample_pages 页)，按各表 b-tree 的分支数估算每个表的行数和页数
+    :param key: 密钥 64位16进制字符串
+    :param db_path: 加密数据库路径
+    :param sample_pages: 随机下探时最多解密的页数(不含 sqlite_master 和各表的根页)
+    :param seed: 抽样的随机种子，相同的文件和种子得到相同的结果
+    :return: (True, {"db_path", "size", "pages", "free_pages", "sampled_pages": 实际解密的页数,
+                     "tables": {表名: {"rows": 估算的行数, "pages": 估算的页数}},
+                     "rows": 估算的行数, "out_bytes": 估算合并后占用的字节数}) or (False, 错误信息)
+    """
+    if not os.path.isfile(db_path):
+        return False, f"[-] db_path:'{db_path}' File not found!"
+    if len(key) != 64:
+        return False, f"[-] key:'{key}' Len Error!"
+    password = bytes.fromhex(key.strip())
+    size = os.path.getsize(db_path)
+    pages = size // DEFAULT_PAGESIZE
+    with open(db_path, "rb") as f:
+        first = f.read(DEFAULT_PAGESIZE)
+        salt = first[:SALT_SIZE]
+        if len(first) < DEFAULT_PAGESIZE:
+            return False, f"[-] db_path:'{db_path}' File Error!"
+        enc_key, mac_key = derive_keys(password, salt)
+        hash_mac, stored_mac = page_hmac(mac_key, first, 1)
+        if hash_mac != stored_mac:
+            return False, f"[-] Key Error! (key:'{key}'; db_path:'{db_path}')"
+        cache_derived_keys(password, salt, (enc_key, mac_key))
+
+        sampler = _BtreeSampler(f, enc_key, pages, DEFAULT_PAGESIZE - RESERVE_SIZE, random.Random(seed))
+        header, _ = sampler.page(1)
+        if header is None:
+            return False, f"[-] db_path:'{db_path}' File Error!"
+        free_pages = int.from_bytes(header[36:40], "big")  # 文件头中的空闲页数
+        # 合并时只复制表(内部页、叶子页和溢出页)，不复制源数据库的索引和 sqlite_ 开头的内部表
+        tables = [(name, root) for name, root, _ in sampler.read_master() if not str(name).startswith("sqlite_")]
+        # 根页是内部页的表按根页的子页数分配下探次数(每次下探约解密2页)，根页是叶子页的表直接读取
+        fanouts = {}
+        for name, root in tables:
+            page, offset = sampler.page(root)
+            if page is not None and page[offset] == TABLE_INTERIOR:
+                fanouts[name] = len(sampler.children(page, offset))
+        total_fanout = sum(fanouts.values()) or 1
+        table_estimates = {}
+        for name, root in tables:
+            descents = min(max(sample_pages * fanouts.get(name, 0) // (2 * total_fanout), 2), MAX_DESCENTS)
+            rows, table_pages = sampler.estimate_table(root, descents if name in fanouts else 1)
+            table_estimates[name] = {"rows": rows, "pages": table_pages}
+
+    rows = sum(t["rows"] for t in table_estimates.values())
+    table_pages = sum(t["pages"] for t in table_estimates.values())
+    out_bytes = int(table_pages * DEFAULT_PAGESIZE + rows * INDEX_BYTES_PER_ROW)
+    return True, {"db_path": db_path, "size": size, "pages": pages, "free_pages": free_pages,
+                  "sampled_pages": sampler.sampled_pages, "tables": table_estimates, "rows": rows,
+                  "out_bytes": out_bytes}
+
+
+def calibrate_decrypt(key: str, db_path: str, pages: int = CALIBRATE_PAGES):
+    """
+    测量本机解密速度：从 db_path 开头解密最多 pages 页
+    :return: 每秒解密的字节数，测量失败时返回 DECRYPT_BYTES_PER_SECOND
+    """
+    try:
+        password = bytes.fromhex(key.strip())
+        with open(db_path, "rb") as f:
+            salt = f.read(SALT_SIZE)
+            enc_key, _ = derive_keys(password, salt)
+            f.seek(0)
+            buf = bytearray(pages * DEFAULT_PAGESIZE)
+            start = time.perf_counter()
+            n = f.readinto(buf)
+            n -= n % DEFAULT_PAGESIZE
+            if n < 16 * DEFAULT_PAGESIZE:  # 文件太小，测量结果不可靠
+                return DECRYPT_BYTES_PER_SECOND
+            _decrypt_pages(enc_key, memoryview(buf)[:n], memoryview(bytearray(n)))
+            elapsed = time.perf_counter() - start
+        return n / elapsed if elapsed > 0 else DECRYPT_BYTES_PER_SECOND
+    except Exception as e:
+        wx_core_loger.warning(f"测量解密速度失败: {db_path} {e}")
+        return DECRYPT_BYTES_PER_SECOND
+
+
+@wx_core_error
+def estimate_merge(key: str, db_paths: list, workers: int = 1, sample_pages: int = 128, calibrate: bool = True):
+    """
+    估算解密并合并 db_paths 的行数、输出大小、磁盘占用和耗时，不写入任何文件
+    :param key: 密钥 64位16进制字符串
+    :param db_paths: 加密数据库路径列表，元素可以是路径或 get_core_db 返回的 {"db_path": "xxx", "db_type": "xxx", ...}
+    :param workers: 解密的进程数，参考 batch_decrypt
+    :param sample_pages: 每个数据库随机下探时最多解密的页数，参考 estimate_db
+    :param calibrate: 按本机实际解密速度估算(解密预估成功的数据库中最大的一个的开头 CALIBRATE_PAGES 页)
+    :return: (True, {"dbs": [estimate_db 的结果 + "db_type", "decrypt_seconds", "merge_seconds"],
+                     "total": {"size", "rows", "out_bytes", "disk_bytes": 解密文件与合并结果同时存在时的磁盘占用,
+                               "decrypt_seconds", "merge_seconds", "seconds"},
+                     "throughput": {"decrypt_bytes", "merge_rows", "merge_bytes"} 每秒的处理速度}) or (False, 错误信息)
+    """
+    db_infos = [db if isinstance(db, dict) else {"db_path": db} for db in db_paths]
+    db_infos = [db for db in db_infos if os.path.isfile(db["db_path"])]
+    if not db_infos:
+        return False, "未获取到数据库路径"
+
+    dbs = []
+    for db in db_infos:
+        code, ret = estimate_db(key, db["db_path"], sample_pages=sample_pages) or (False, "estimate error")
+        if not code:
+            wx_core_loger.warning(f"预估失败: {ret}")
+            continue
+        ret["db_type"] = db.get("db_type")
+        ret["merge_seconds"] = round(ret["rows"] / MERGE_ROWS_PER_SECOND + ret["out_bytes"] / MERGE_BYTES_PER_SECOND, 2)
+        dbs.append(ret)
+    if not dbs:
+        return False, "所有数据库预估失败(密钥错误?)"
+
+    # 只在已验证密钥的数据库上测量，密钥错误时解密出的是无效数据，测量结果没有意义
+    decrypt_speed = DECRYPT_BYTES_PER_SECOND
+    if calibrate:
+        decrypt_speed = calibrate_decrypt(key, max(dbs, key=lambda db: db["size"])["db_path"])
+    for db in dbs:
+        db["decrypt_seconds"] = round(db["size"] / decrypt_speed, 2)
+
+    # 并行解密时，总耗时至少为最大的单个文件的解密时间
+    workers = max(min(workers or os.cpu_count() or 1, len(dbs)), 1)
+    decrypt_seconds = max(sum(db["decrypt_seconds"] for db in dbs) / workers,
+                          max(db["decrypt_seconds"] for db in dbs))
+    merge_seconds = sum(db["merge_seconds"] for db in dbs)
+    size = sum(db["size"] for db in dbs)
+    out_bytes = sum(db["out_bytes"] for db in dbs)
+    total = {"size": size, "rows": sum(db["rows"] for db in dbs), "out_bytes": out_bytes,
+             "disk_bytes": size + out_bytes, "decrypt_seconds": round(decrypt_seconds, 2),
+             "merge_seconds": round(merge_seconds, 2), "seconds": round(decrypt_seconds + merge_seconds, 2)}
+    throughput = {"decrypt_bytes": int(decrypt_speed), "merge_rows": MERGE_ROWS_PER_SECOND,
+                  "merge_bytes": MERGE_BYTES_PER_SECOND}
+    return True, {"dbs": dbs, "total": total, "throughput": throughput}
+
+
+@wx_core_error
+def estimate_decrypt_merge(wx_path: str, key: str, db_type: list = None, workers: int = 1, sample_pages: int = 128,
+                           calibrate: bool = True):
+    """
+    decrypt_merge 的预估(dry-run)，参数与 decrypt_merge 相同，结果参考 estimate_merge
+    :return: (True, 预估结果) or (False, 错误信息)
+    """
+    if not wx_path or not key or not os.path.exists(wx_path):
+        return False, "参数错误"
+    from .wx_info import get_core_db  # 仅支持Windows
+    code, wxdbpaths = get_core_db(wx_path, db_type or [])
+    if not code:
+        return False, wxdbpaths
+    return estimate_merge(key, wxdbpaths, workers=workers, sample_pages=sample_pages, calibrate=calibrate)
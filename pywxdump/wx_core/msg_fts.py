@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-#
+# -------------------------------------------------------------------------------
+# Name:         msg_fts.py
+# Description:  合并后数据库中聊天记录的 FTS5 全文索引：文本消息的 StrContent 和 appmsg(Type=49) 的标题、描述
+# Date:         2026/10/18
+# 注：unicode61 分词器把连续的中日韩文字当作一个词，写入索引前在每个中日韩字符两侧插入零宽空格(分隔符)，
+#     查询时把中日韩文字按字拆成短语("吃饭" -> "吃 饭")，即可按任意连续的字匹配；snippet 返回前去掉零宽空格
+#     StrTalker、CreateTime 保存在带普通索引的 FTS_META_TABLE 中(rowid 与全文索引相同)，按联系人、时间过滤和排序时
+#     不需要读取全文索引的内容
+# 用法：
+#     build_msg_fts(r"C:\***\merge_all.db")  # 之后 merge_db 追加合并时自动增量更新
+#     MsgHandler.search_msgs("关键词")
+# -------------------------------------------------------------------------------
+import re
+import sqlite3
+
+from pywxdump.db.utils import FTS_TABLE, FTS_META_TABLE, fts_split  # 与查询(MsgHandler.search_msgs)共用
+from .utils import wx_core_error, wx_core_loger
+
+FTS_LOG_TABLE = "msg_fts_log"  # 各消息表已建立索引的最大 rowid
+FTS_TYPES = (1, 49)  # 文本消息、appmsg(链接、文件、引用等)
+FTS_BATCH_SIZE = 5000
+
+APPMSG_TEXT_PATTERN = re.compile(r"<(title|des)>(.*?)</\1>", re.S)
+
+
+def appmsg_text(compress_content):
+    """
+    从 appmsg 的 CompressContent(lz4 压缩的 xml)中提取标题和描述
+    """
+    if not isinstance(compress_content, bytes):
+        return ""
+    import lz4.block  # 只在建立索引时需要
+    try:
+        data = lz4.block.decompress(compress_content, uncompressed_size=len(compress_content) << 8)
+        xml = data.replace(b"\x00", b"").decode("utf-8", errors="ignore")
+    except Exception:
+        xml = compress_content.decode("utf-8", errors="ignore")
+    texts = []
+    for _, value in APPMSG_TEXT_PATTERN.findall(xml):
+        value = value.strip()
+        if value.startswith("<![CDATA[") and value.endswith("]]>"):
+            value = value[9:-3].strip()
+        if value and value not in texts:
+            texts.append(value)
+    return "\n".join(texts)
+
+
+def msg_fts_text(msg_type, str_content, compress_content):
+    """
+    消息中需要建立索引的文本(已经过 fts_split 处理)，没有时返回 ""
+    """
+    if msg_type == 1:
+        text = str_content if isinstance(str_content, str) else ""
+    elif msg_type == 49:
+        text = appmsg_text(compress_content)
+    else:
+        text = ""
+    return fts_split(text)
+
+
+def check_create_msg_fts(connection):
+    """
+    创建全文索引表、StrTalker/CreateTime 表和记录表
+    """
+    connection.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                       "content, tbl UNINDEXED, msg_rowid UNINDEXED, tokenize='unicode61 remove_diacritics 2')")
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {FTS_META_TABLE} "
+                       "(fts_rowid INTEGER PRIMARY KEY, StrTalker TEXT, CreateTime INT)")
+    connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{FTS_META_TABLE}_CreateTime ON {FTS_META_TABLE}(CreateTime)")
+    connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{FTS_META_TABLE}_StrTalker_CreateTime "
+                       f"ON {FTS_META_TABLE}(StrTalker, CreateTime)")
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {FTS_LOG_TABLE} (tbl TEXT PRIMARY KEY, max_rowid INT)")
+
+
+def msg_fts_exists(connection, schema: str = "main"):
+    """
+    数据库中是否已有全文索引
+    """
+    sql = f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name=?"
+    return connection.execute(sql, (FTS_TABLE,)).fetchone() is not None
+
+
+def update_msg_fts(connection):
+    """
+    增量更新全文索引：只处理各消息表(MSG 或其时间分区表、PublicMsg)中 rowid 大于上次记录的行，调用者负责提交
+    :param connection: 合并后数据库的连接
+    :return: 新增的索引行数
+    """
+    check_create_msg_fts(connection)
+    names = {row[0] for row in connection.execute("SELECT name FROM main.sqlite_master WHERE type='table'")}
+    tables = ["MSG"]
+    if "msg_partitions" in names:
+        tables = [row[0] for row in connection.execute("SELECT name FROM msg_partitions ORDER BY start_time")]
+    tables = [table for table in tables + ["PublicMsg"] if table in names]
+
+    total = 0
+    next_rowid = connection.execute(f"SELECT COALESCE(MAX(fts_rowid), 0) + 1 FROM {FTS_META_TABLE}").fetchone()[0]
+    for table in tables:
+        row = connection.execute(f"SELECT max_rowid FROM {FTS_LOG_TABLE} WHERE tbl=?", (table,)).fetchone()
+        last_rowid = row[0] if row and row[0] is not None else 0
+        max_rowid = connection.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]
+        if max_rowid is None or max_rowid <= last_rowid:
+            continue
+        types = ",".join(str(t) for t in FTS_TYPES)
+        rows = connection.execute(f"SELECT rowid, Type, StrContent, CompressContent, StrTalker, CreateTime "
+                                  f"FROM {table} "
+                                  f"WHERE rowid > ? AND rowid <= ? AND Type IN ({types})", (last_rowid, max_rowid))
+        while True:
+            batch = rows.fetchmany(FTS_BATCH_SIZE)
+            if not batch:
+                break
+            values = [(rowid, talker, create_time, content) for rowid, msg_type, str_content, compress_content,
+                      talker, create_time in batch
+                      for content in (msg_fts_text(msg_type, str_content, compress_content),) if content]
+            fts_rowids = range(next_rowid, next_rowid + len(values))
+            next_rowid += len(values)
+            connection.executemany(f"INSERT INTO {FTS_TABLE} (rowid, content, tbl, msg_rowid) VALUES (?, ?, ?, ?)",
+                                   [(fts_rowid, content, table, rowid)
+                                    for fts_rowid, (rowid, _, _, content) in zip(fts_rowids, values)])
+            connection.executemany(f"INSERT INTO {FTS_META_TABLE} (fts_rowid, StrTalker, CreateTime) VALUES (?, ?, ?)",
+                                   [(fts_rowid, talker, create_time)
+                                    for fts_rowid, (_, talker, create_time, _) in zip(fts_rowids, values)])
+            total += len(values)
+        connection.execute(f"INSERT OR REPLACE INTO {FTS_LOG_TABLE} (tbl, max_rowid) VALUES (?, ?)",
+                           (table, max_rowid))
+    wx_core_loger.info(f"全文索引新增 {total} 条")
+    return total
+
+
+@wx_core_error
+def build_msg_fts(merge_path: str, optimize: bool = True):
+    """
+    在合并后的数据库中建立(或增量更新)聊天记录的全文索引，之后 merge_db 追加合并时会自动增量更新
+    :param merge_path: 合并后的数据库路径
+    :param optimize: 更新后合并索引的 b-tree，查询更快
+    :return: (True, 新增的索引行数) or (False, 错误信息)
+    """
+    connection = sqlite3.connect(merge_path)
+    try:
+        total = update_msg_fts(connection)
+        if optimize and total:
+            connection.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        connection.commit()
+    finally:
+        connection.close()
+    return True, total
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-#
+# -------------------------------------------------------------------------------
+# Name:         real_time.py
+# Description:  实时同步：轮询加密数据库的变化，增量解密后只把新增的行合并到合并后的数据库
+# Date:         2026/10/18
+# 用法：
+#     sync = RealTimeSync(key, r"C:\***\merge_all.db", [r"C:\***\Msg\Multi\MSG0.db", ...])
+#     sync.sync_once()  # 同步一次
+#     sync.start()  # 后台线程每 interval 秒检查一次，sync.stop() 停止
+# -------------------------------------------------------------------------------
+import hashlib
+import os
+import threading
+import time
+from typing import List, Union
+
+from .decryption import decrypt, decrypt_wal, WAL_SUFFIX
+from .merge_db import merge_db
+from .utils import wx_core_loger
+
+DEFAULT_INTERVAL = 2  # 默认的轮询间隔(秒)
+
+
+class RealTimeSync:
+    """
+    轮询加密数据库及其WAL的大小和修改时间(只调用 os.stat，没有变化时几乎不占用CPU)：
+    数据库文件变化时增量解密(只解密密文变化的页，参考 decrypt 的 incremental)，只有WAL变化时只解密WAL中已提交的页；
+    解密后由 merge_db 按水位线和天然主键把新增的行写入 merge_path，不会产生重复数据
+    """
+
+    def __init__(self, key: str, merge_path: str, db_paths: Union[List[Union[str, dict]], str, dict],
+                 work_path: str = None, interval: float = DEFAULT_INTERVAL, progress_callback=None):
+        """
+        :param key: 解密密钥
+        :param merge_path: 合并后的数据库路径，不存在时新建
+        :param db_paths: 加密数据库路径列表，元素可以是路径或 get_core_db 返回的 {"db_path": "xxx", ...}
+        :param work_path: 解密后的数据库保存目录(保留用于下次增量解密)，默认为 merge_path 同目录下的 realtime 文件夹
+        :param interval: 轮询间隔(秒)
+        :param progress_callback: 传给 merge_db 的进度回调
+        """
+        self.key = key
+        self.merge_path = os.path.abspath(merge_path)
+        self.db_paths = self.abs_db_paths(db_paths)
+        self.work_path = work_path or os.path.join(os.path.dirname(self.merge_path), "realtime")
+        self.interval = interval
+        self.progress_callback = progress_callback
+        self.stats = {}  # 上次同步时的文件状态 {db_path: ((size, mtime_ns), (wal_size, wal_mtime_ns))}
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def abs_db_paths(db_paths: Union[List[Union[str, dict]], str, dict]):
+        """
+        数据库路径列表转为去重、排序后的绝对路径，参数格式同 __init__ 的 db_paths
+        """
+        if isinstance(db_paths, (str, dict)):
+            db_paths = [db_paths]
+        return sorted({os.path.abspath(db["db_path"] if isinstance(db, dict) else db) for db in db_paths})
+
+    def update(self, db_paths: Union[List[Union[str, dict]], str, dict], work_path: str = None):
+        """
+        更新需要同步的数据库列表(后台线程正在同步时，等待本次同步结束)，删除已移除的数据库的文件状态
+        :param db_paths: 参考 __init__
+        :param work_path: 新的解密目录，None 或 "" 表示保持不变
+        """
+        db_paths = self.abs_db_paths(db_paths)
+        with self.lock:
+            for db_path in set(self.db_paths) - set(db_paths):
+                self.stats.pop(db_path, None)
+            self.db_paths = db_paths
+            if work_path:
+                self.work_path = work_path
+
+    def de_path(self, db_path: str):
+        """
+        解密后的文件路径，加上原路径的哈希，避免不同目录下的同名数据库冲突
+        """
+        digest = hashlib.md5(db_path.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.work_path, f"de_{digest}_{os.path.basename(db_path)}")
+
+    @staticmethod
+    def file_stat(path: str):
+        try:
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def sync_once(self):
+        """
+        检查一次变化并同步
+        :return: (True, 本次同步的数据库路径列表) or (False, 错误信息)
+        """
+        with self.lock:
+            if not os.path.exists(self.work_path):
+                os.makedirs(self.work_path)
+            changed = []
+            for db_path in self.db_paths:
+                stat = (self.file_stat(db_path), self.file_stat(db_path + WAL_SUFFIX))
+                if stat[0] is None:
+                    continue
+                old_stat = self.stats.get(db_path)
+                if old_stat == stat:
+                    continue
+                de_path = self.de_path(db_path)
+                if old_stat and old_stat[0] == stat[0] and os.path.exists(de_path):
+                    ret = decrypt_wal(self.key, db_path, de_path)  # 数据库文件没有变化，只有WAL中的新数据
+                else:
+                    ret = decrypt(self.key, db_path, de_path, incremental=True, wal=True)
+                if not ret or not ret[0]:
+                    wx_core_loger.error(f"实时同步解密失败 {db_path} {ret}")
+                    continue
+                changed.append((db_path, de_path, stat))
+            if not changed:
+                return True, []
+
+            db_paths = [{"db_path": db_path, "de_path": de_path} for db_path, de_path, _ in changed]
+            ret = merge_db(db_paths, self.merge_path, progress_callback=self.progress_callback)
+            if not isinstance(ret, str):
+                return False, f"合并失败: {[db_path for db_path, _, _ in changed]}"
+            # 合并成功后才记录文件状态，失败时下次重试
+            self.stats.update({db_path: stat for db_path, _, stat in changed})
+            return True, [db_path for db_path, _, _ in changed]
+
+    def run(self, max_rounds: int = None):
+        """
+        循环同步，直到调用 stop 或达到 max_rounds 次
+        """
+        rounds = 0
+        while not self._stop_event.is_set() and (max_rounds is None or rounds < max_rounds):
+            start = time.time()
+            try:
+                code, ret = self.sync_once()
+                if code and ret:
+                    wx_core_loger.info(f"实时同步 {ret} 用时 {time.time() - start:.2f}s")
+            except Exception as e:
+                wx_core_loger.error(f"实时同步出错: {e}", exc_info=True)
+            rounds += 1
+            self._stop_event.wait(max(self.interval - (time.time() - start), 0))
+
+    def start(self):
+        """
+        在后台线程中循环同步
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name="RealTimeSync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+_syncs = {}  # {(merge_path, key): RealTimeSync}，多次调用 merge_real_time_db 时复用文件状态
+_syncs_lock = threading.Lock()
+
+
+def get_real_time_sync(key: str, merge_path: str, db_paths, work_path: str = None):
+    """
+    获取(或创建)合并到 merge_path 的实时同步对象，已存在时更新数据库列表和解密目录(参考 RealTimeSync.update)
+    :param work_path: 解密目录，None 或 "" 时新建的对象使用默认目录，已存在的对象保持原来的目录
+    """
+    merge_path = os.path.abspath(merge_path)
+    with _syncs_lock:
+        sync = _syncs.get((merge_path, key))
+        if sync is None:
+            sync = _syncs[(merge_path, key)] = RealTimeSync(key, merge_path, db_paths, work_path=work_path)
+        else:
+            sync.update(db_paths, work_path=work_path)
+    return sync
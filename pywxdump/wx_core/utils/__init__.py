@@ -5,11 +5,20 @@
 # Author:       xaoyaoo
 # Date:         2024/07/23
 # -------------------------------------------------------------------------------
+import sys
 
-from .common_utils import verify_key, get_exe_version, get_exe_bit, wx_core_error
-from .ctypes_utils import get_process_list, get_memory_maps, get_process_exe_path, \
-    get_file_version_info
-from .memory_search import search_memory
+from .common_utils import verify_key, get_exe_version, get_exe_bit, wx_core_error, derive_keys, cache_derived_keys, \
+    set_key_cache_path, windows_only_getattr
+
+if sys.platform == "win32":  # 读取进程内存相关的工具仅支持Windows，其他平台只能使用解密等功能
+    from .ctypes_utils import get_process_list, get_memory_maps, get_process_exe_path, \
+        get_file_version_info
+    from .memory_search import search_memory
+else:  # 其他平台上使用时再导入，导入失败时提示仅支持Windows
+    __getattr__ = windows_only_getattr(__name__, {
+        "get_process_list": ".ctypes_utils", "get_memory_maps": ".ctypes_utils",
+        "get_process_exe_path": ".ctypes_utils", "get_file_version_info": ".ctypes_utils",
+        "search_memory": ".memory_search"})
 from ._loger import wx_core_loger
 
 CORE_DB_TYPE = ["MicroMsg", "MSG", "MediaMSG", "OpenIMContact", "OpenIMMsg", "PublicMsg", "OpenIMMedia",
@@ -9,8 +9,17 @@ import os
 import re
 import hmac
 import sys
+import json
+import threading
+import time
 import traceback
 import hashlib
+import importlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from Cryptodome.Cipher import AES
+
 from ._loger import wx_core_loger
 
 if sys.platform == "win32":
@@ -34,24 +43,203 @@ def wx_core_error(func):
     return wrapper
 
 
+class WindowsOnlyError(ImportError):
+    """
+    在其他平台上使用仅支持Windows的功能
+    """
+
+
+def windows_only_getattr(package: str, names: dict):
+    """
+    生成包的 __getattr__(PEP 562)：其他平台上按需导入仅支持Windows的功能，导入失败时给出明确的错误
+    :param package: 包名(__name__)
+    :param names: {属性名: 定义该属性的模块(相对于 package)}
+    :return: __getattr__ 函数
+    """
+
+    def __getattr__(name):
+        if name not in names:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        try:
+            value = getattr(importlib.import_module(names[name], package), name)
+        except (ImportError, AttributeError, OSError) as e:  # 缺少 winreg/pymem、ctypes.windll 等
+            cause = e.__cause__ if isinstance(e, WindowsOnlyError) else e  # 依赖的模块同样仅支持Windows时，给出最初的原因
+            raise WindowsOnlyError(f"{name} 仅支持Windows(当前平台: {sys.platform}): {cause!r}",
+                                   name=names[name]) from cause
+        setattr(sys.modules[package], name, value)
+        return value
+
+    return __getattr__
+
+
+KEY_SIZE = 32
+DEFAULT_ITER = 64000
+DERIVED_KEY_CACHE_SIZE = 1024  # 内存中最多缓存的派生密钥数
+KEY_CACHE_ENV = "PYWXDUMP_KEY_CACHE_FILE"  # 派生密钥持久化文件路径，通过环境变量传递给子进程
+KEY_CACHE_LOCK_TIMEOUT = 5  # 等待持久化文件锁的最长时间(秒)，超过该时间的锁文件视为进程异常退出后遗留的
+
+_derived_keys = OrderedDict()  # {sha256(password + salt): (enc_key, mac_key)}
+_persisted_keys = {}  # {cache_file: {sha256(password + salt): nonce + tag + ciphertext(hex)}}
+_derived_keys_lock = threading.Lock()
+
+
+def set_key_cache_path(path: str = None):
+    """
+    设置派生密钥的持久化文件，设置后验证通过的派生密钥会加密保存到该文件中（文件权限为600）
+    :param path: 文件路径，None 或 "" 表示关闭持久化
+    :return:
+    """
+    os.environ[KEY_CACHE_ENV] = path or ""
+
+
+def _key_cache_file_keys(cache_file: str):
+    """
+    读取持久化的派生密钥（每个文件只读取一次）
+    """
+    if cache_file not in _persisted_keys:
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                _persisted_keys[cache_file] = json.load(f)
+        except (OSError, ValueError):
+            _persisted_keys[cache_file] = {}
+    return _persisted_keys[cache_file]
+
+
+@contextmanager
+def _key_cache_file_lock(cache_file: str, timeout: float = KEY_CACHE_LOCK_TIMEOUT):
+    """
+    持久化文件的跨进程锁(batch_decrypt 的多个子进程同时写入)：独占创建 cache_file.lock，
+    超时仍未获得锁时抛出 TimeoutError
+    """
+    lock_file = f"{cache_file}.lock"
+    deadline = time.time() + timeout
+    while True:
+        try:
+            os.close(os.open(lock_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_file) > timeout:  # 遗留的锁文件
+                    os.remove(lock_file)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"等待锁文件超时: {lock_file}")
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock_file)
+        except OSError:
+            pass
+
+
+def _key_cache_wrap_key(password: bytes):
+    """
+    持久化文件中的派生密钥使用由原始密钥计算出的密钥加密，没有原始密钥无法使用该文件
+    """
+    return hmac.new(password, b"pywxdump derived key cache", hashlib.sha256).digest()
+
+
+def _remember_derived_keys(cache_key: str, keys: tuple):
+    """
+    写入内存中的 LRU 缓存，超出 DERIVED_KEY_CACHE_SIZE 时淘汰最久未使用的，调用者需持有 _derived_keys_lock
+    """
+    _derived_keys[cache_key] = keys
+    _derived_keys.move_to_end(cache_key)
+    while len(_derived_keys) > DERIVED_KEY_CACHE_SIZE:
+        _derived_keys.popitem(last=False)
+
+
+def derive_keys(password: bytes, salt: bytes):
+    """
+    由密钥和盐值派生出解密密钥与HMAC密钥，优先从缓存中读取，跳过 64000 次迭代的 PBKDF2
+    注：这里不写入缓存，密钥验证通过后再调用 cache_derived_keys 写入，避免错误密钥占满缓存
+    :param password: 密钥 bytes
+    :param salt: 数据库文件开头16字节盐值
+    :return: (enc_key, mac_key)
+    """
+    cache_key = hashlib.sha256(password + salt).hexdigest()
+    with _derived_keys_lock:
+        if cache_key in _derived_keys:
+            _derived_keys.move_to_end(cache_key)
+            return _derived_keys[cache_key]
+
+        cache_file = os.environ.get(KEY_CACHE_ENV)
+        data = _key_cache_file_keys(cache_file).get(cache_key) if cache_file else None
+    if data:
+        try:
+            data = bytes.fromhex(data)
+            cipher = AES.new(_key_cache_wrap_key(password), AES.MODE_GCM, nonce=data[:16])
+            keys = cipher.decrypt_and_verify(data[32:], data[16:32])
+            keys = keys[:KEY_SIZE], keys[KEY_SIZE:]
+            with _derived_keys_lock:  # 已通过 GCM 校验，放入内存缓存，之后不再解密文件中的记录
+                _remember_derived_keys(cache_key, keys)
+            return keys
+        except ValueError:
+            wx_core_loger.warning(f"派生密钥缓存校验失败: {cache_file}")
+
+    enc_key = hashlib.pbkdf2_hmac("sha1", password, salt, DEFAULT_ITER, KEY_SIZE)
+    mac_salt = bytes([(salt[i] ^ 58) for i in range(16)])
+    mac_key = hashlib.pbkdf2_hmac("sha1", enc_key, mac_salt, 2, KEY_SIZE)
+    return enc_key, mac_key
+
+
+def cache_derived_keys(password: bytes, salt: bytes, keys: tuple):
+    """
+    缓存验证通过的派生密钥，如果设置了持久化文件(set_key_cache_path)，同时加密写入文件
+    :param password: 密钥 bytes
+    :param salt: 盐值
+    :param keys: (enc_key, mac_key)
+    :return:
+    """
+    cache_key = hashlib.sha256(password + salt).hexdigest()
+    with _derived_keys_lock:
+        is_new = cache_key not in _derived_keys
+        _remember_derived_keys(cache_key, keys)
+
+        cache_file = os.environ.get(KEY_CACHE_ENV)
+        if not cache_file or not is_new:
+            return
+        persisted = _key_cache_file_keys(cache_file)
+        if cache_key in persisted:
+            return
+        cipher = AES.new(_key_cache_wrap_key(password), AES.MODE_GCM)
+        ciphertext, tag = cipher.encrypt_and_digest(keys[0] + keys[1])
+        persisted[cache_key] = (cipher.nonce + tag + ciphertext).hex()
+        try:
+            # 其他进程可能在本进程读取之后写入了新的派生密钥，加锁后重新读取文件并合并，避免互相覆盖
+            with _key_cache_file_lock(cache_file):
+                try:
+                    with open(cache_file, "r", encoding="utf-8") as f:
+                        persisted.update({k: v for k, v in json.load(f).items() if k not in persisted})
+                except (OSError, ValueError):
+                    pass
+                tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+                with os.fdopen(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+                    json.dump(persisted, f)
+                os.replace(tmp_file, cache_file)
+        except OSError as e:  # 包括 TimeoutError
+            wx_core_loger.warning(f"写入派生密钥缓存失败: {cache_file} {e}")
+
+
 def verify_key(key, wx_db_path):
     """
     验证key是否正确
     """
-    KEY_SIZE = 32
     DEFAULT_PAGESIZE = 4096
-    DEFAULT_ITER = 64000
     with open(wx_db_path, "rb") as file:
         blist = file.read(5000)
     salt = blist[:16]
-    pk = hashlib.pbkdf2_hmac("sha1", key, salt, DEFAULT_ITER, KEY_SIZE)
+    keys = derive_keys(key, salt)
     first = blist[16:DEFAULT_PAGESIZE]
-    mac_salt = bytes([(salt[i] ^ 58) for i in range(16)])
-    pk = hashlib.pbkdf2_hmac("sha1", pk, mac_salt, 2, KEY_SIZE)
-    hash_mac = hmac.new(pk, first[:-32], hashlib.sha1)
+    hash_mac = hmac.new(keys[1], first[:-32], hashlib.sha1)
     hash_mac.update(b'\x01\x00\x00\x00')
     if hash_mac.digest() != first[-32:-12]:
         return False
+    cache_derived_keys(key, salt, keys)
     return True
 
 @wx_core_error
@@ -59,7 +59,7 @@ setup(
                  },
     # include_package_data=True,
     package_data={
-        'pywxdump': ['WX_OFFS.json', 'ui/web/*', 'ui/web/assets/*', 'wx_core/tools/*',
+        'pywxdump': ['WX_OFFS.json', 'ui/web/*', 'ui/web/assets/*',
                      ]
     },
     classifiers=[
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-#
+# -------------------------------------------------------------------------------
+# Name:         bench_decrypt.py
+# Description:  解密性能基准测试：生成与微信格式一致的加密数据库，测试 decrypt / batch_decrypt 的吞吐量和内存峰值
+# Date:         2026/10/18
+# 用法：
+#     python tests/bench_decrypt.py --sizes 16,64,256 --workers 1,4 --output bench.json
+#     python tests/bench_decrypt.py --baseline bench.json          # 与之前的结果对比，吞吐量下降超过容差时返回1
+# 注：不需要安装微信，Linux 下也可以运行；每次测试都在新的子进程中进行，内存峰值互不影响
+# -------------------------------------------------------------------------------
+import argparse
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from Cryptodome.Cipher import AES
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_PATH not in sys.path:
+    sys.path.insert(0, ROOT_PATH)
+
+from pywxdump.wx_core.decryption import decrypt, batch_decrypt, SQLITE_FILE_HEADER, DEFAULT_PAGESIZE, SALT_SIZE, \
+    RESERVE_SIZE, KEY_SIZE
+
+DEFAULT_KEY = hashlib.sha256(b"pywxdump bench").hexdigest()  # 测试用的固定密钥
+MB = 1024 * 1024
+
+
+def gen_encrypted_db(db_path: str, size_mb: float, key: str = DEFAULT_KEY, seed: int = 0):
+    """
+    生成加密数据库：每页 AES-256-CBC 加密，页尾保留段为 IV(16) + HMAC-SHA1(20) + 填充(12)，第一页开头16字节为盐值
+    :param db_path: 输出路径
+    :param size_mb: 文件大小(MB)，按页向上取整
+    :param key: 密钥 64位16进制字符串
+    :param seed: 随机种子，相同参数生成的文件完全相同
+    :return: (页数, 解密后文件的sha256)，用于校验解密结果
+    """
+    rng = random.Random(seed)
+    password = bytes.fromhex(key)
+    salt = rng.randbytes(SALT_SIZE)
+    enc_key = hashlib.pbkdf2_hmac("sha1", password, salt, 64000, KEY_SIZE)
+    mac_salt = bytes([(salt[i] ^ 58) for i in range(16)])
+    mac_key = hashlib.pbkdf2_hmac("sha1", enc_key, mac_salt, 2, KEY_SIZE)
+
+    page_count = max(1, int(size_mb * MB + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE)
+    data_end = DEFAULT_PAGESIZE - RESERVE_SIZE
+    expected = hashlib.sha256()
+    with open(db_path, "wb") as f:
+        for pgno in range(1, page_count + 1):
+            start = SALT_SIZE if pgno == 1 else 0
+            if pgno == 1:  # 文件头：页大小4096，每页保留48字节，其余内容均为随机数据(不是可查询的数据库)
+                header = (DEFAULT_PAGESIZE.to_bytes(2, "big") + b"\x01\x01" + bytes([RESERVE_SIZE]) + b"\x40\x20\x20"
+                          + (1).to_bytes(4, "big") + page_count.to_bytes(4, "big")).ljust(100 - SALT_SIZE, b"\x00")
+                plain = header + rng.randbytes(data_end - start - len(header))
+            else:
+                plain = rng.randbytes(data_end)
+            iv = rng.randbytes(16)
+            encrypted = AES.new(enc_key, AES.MODE_CBC, iv).encrypt(plain)
+            page = (salt if pgno == 1 else b"") + encrypted + iv
+            mac = hmac.new(mac_key, page[start:], hashlib.sha1)
+            mac.update(pgno.to_bytes(4, "little"))
+            tail = mac.digest() + rng.randbytes(RESERVE_SIZE - 16 - 20)
+            f.write(page + tail)
+
+            expected.update((SQLITE_FILE_HEADER.encode() if pgno == 1 else b"") + plain + iv + tail)
+    return page_count, expected.hexdigest()
+
+
+def file_sha256(path: str):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MB), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def peak_rss_mb():
+    """
+    当前进程及已结束的子进程(多进程解密的工作进程)的内存峰值(MB)
+    :return: (self_peak, children_peak)，无法获取时为 None
+    """
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024  # macOS 单位为字节，Linux 为KB
+        self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / MB
+        children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / MB
+        return round(self_peak, 1), round(children_peak, 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / MB, 1), None
+    except (ImportError, AttributeError):
+        return None, None
+
+
+def _bench_child(func_name: str, kwargs: dict, queue):
+    """
+    在子进程中执行一次解密，返回耗时和内存峰值
+    """
+    base_rss, _ = peak_rss_mb()
+    func = {"decrypt": decrypt, "batch_decrypt": batch_decrypt}[func_name]
+    t0 = time.perf_counter()
+    ret = func(**kwargs)
+    seconds = time.perf_counter() - t0
+    rss, children_rss = peak_rss_mb()
+    ok = isinstance(ret, tuple) and ret[0] is True
+    queue.put({"seconds": seconds, "ok": ok, "error": None if ok else str(ret),
+               "base_rss_mb": base_rss, "peak_rss_mb": rss, "children_peak_rss_mb": children_rss})
+
+
+def run_once(func_name: str, kwargs: dict):
+    ctx = multiprocessing.get_context()
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_bench_child, args=(func_name, kwargs, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def bench(name: str, func_name: str, kwargs: dict, outputs: list, expected: list, total_bytes: int,
+          total_pages: int, repeat: int):
+    """
+    重复执行 repeat 次，耗时取最小值，内存取最大值，并校验解密结果
+    """
+    runs = []
+    for _ in range(repeat):
+        for out in outputs:
+            if os.path.exists(out):
+                os.remove(out)
+        runs.append(run_once(func_name, kwargs))
+    seconds = min(r["seconds"] for r in runs)
+    ok = all(r["ok"] for r in runs) and [file_sha256(out) if os.path.exists(out) else None for out in
+                                          outputs] == expected
+
+    def max_of(field):
+        values = [r[field] for r in runs if r[field] is not None]
+        return max(values) if values else None
+
+    return {
+        "name": name,
+        "size_mb": round(total_bytes / MB, 2),
+        "files": len(outputs),
+        "workers": kwargs.get("workers", 1),
+        "seconds": round(seconds, 4),
+        "mb_s": round(total_bytes / MB / seconds, 2),
+        "pages_s": round(total_pages / seconds, 1),
+        "base_rss_mb": max_of("base_rss_mb"),
+        "peak_rss_mb": max_of("peak_rss_mb"),
+        "children_peak_rss_mb": max_of("children_peak_rss_mb"),
+        "ok": ok,
+        "error": next((r["error"] for r in runs if r["error"]), None),
+    }
+
+
+def compare(results: list, baseline: dict, tolerance: float):
+    """
+    与基线结果对比吞吐量，返回下降超过容差的测试项
+    """
+    base = {(r["name"], r["size_mb"], r["workers"]): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"{'name':<16}{'size_mb':>9}{'workers':>9}{'base MB/s':>12}{'MB/s':>10}{'ratio':>8}")
+    for r in results:
+        old = base.get((r["name"], r["size_mb"], r["workers"]))
+        if not old:
+            continue
+        ratio = r["mb_s"] / old["mb_s"] if old["mb_s"] else 0
+        flag = "" if ratio >= 1 - tolerance else "  <-- regression"
+        print(f"{r['name']:<16}{r['size_mb']:>9}{r['workers']:>9}{old['mb_s']:>12}{r['mb_s']:>10}{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pywxdump 解密性能基准测试")
+    parser.add_argument("--sizes", default="16,64", help="单个数据库大小(MB)，逗号分隔")
+    parser.add_argument("--workers", default="1,4", help="并行进程数，逗号分隔，0 表示全部CPU核心")
+    parser.add_argument("--batch-files", type=int, default=4, help="batch_decrypt 测试时把数据拆分成的文件数")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测试的重复次数")
+    parser.add_argument("--workdir", default=None, help="生成测试数据的目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--output", default=None, help="结果保存为JSON文件，默认输出到标准输出")
+    parser.add_argument("--baseline", default=None, help="基线结果JSON文件，吞吐量下降超过容差时返回1")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="对比基线时允许的吞吐量下降比例")
+    args = parser.parse_args()
+
+    sizes = [float(s) for s in args.sizes.split(",") if s]
+    workers_list = [int(w) for w in args.workers.split(",") if w]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pywxdump_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = []
+    try:
+        for size in sizes:
+            # 单个文件：decrypt
+            db_path = os.path.join(workdir, f"MSG_{size:g}MB.db")
+            out_path = os.path.join(workdir, f"de_MSG_{size:g}MB.db")
+            pages, digest = gen_encrypted_db(db_path, size, seed=int(size * 1000))
+            for workers in workers_list:
+                kwargs = {"key": DEFAULT_KEY, "db_path": db_path, "out_path": out_path, "workers": workers}
+                r = bench("decrypt", "decrypt", kwargs, [out_path], [digest], pages * DEFAULT_PAGESIZE, pages,
+                          args.repeat)
+                results.append(r)
+                print(json.dumps(r, ensure_ascii=False), file=sys.stderr)
+            os.remove(db_path)
+
+            # 多个文件：batch_decrypt，总大小与单个文件相同
+            src_dir = os.path.join(workdir, f"batch_{size:g}MB")
+            out_dir = os.path.join(workdir, f"de_batch_{size:g}MB")
+            os.makedirs(src_dir, exist_ok=True)
+            os.makedirs(out_dir, exist_ok=True)
+            outputs, digests, total_pages = [], [], 0
+            for i in range(args.batch_files):
+                name = f"MSG{i}.db"
+                pages, digest = gen_encrypted_db(os.path.join(src_dir, name), size / args.batch_files,
+                                                 seed=int(size * 1000) + i + 1)
+                outputs.append(os.path.join(out_dir, "de_" + name))
+                digests.append(digest)
+                total_pages += pages
+            for workers in workers_list:
+                kwargs = {"key": DEFAULT_KEY, "db_path": src_dir, "out_path": out_dir, "workers": workers}
+                r = bench("batch_decrypt", "batch_decrypt", kwargs, outputs, digests, total_pages * DEFAULT_PAGESIZE,
+                          total_pages, args.repeat)
+                results.append(r)
+                print(json.dumps(r, ensure_ascii=False), file=sys.stderr)
+            shutil.rmtree(src_dir)
+            shutil.rmtree(out_dir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    failed = [r for r in results if not r["ok"]]
+    for r in failed:
+        print(f"[-] {r['name']} size_mb={r['size_mb']} workers={r['workers']} 解密结果错误: {r['error']}", file=sys.stderr)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
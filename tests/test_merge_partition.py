@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-#
+# -------------------------------------------------------------------------------
+# Name:         test_merge_partition.py
+# Description:  MSG 按时间分区合并测试：不同版本(列不同)的 MSG 分组并行合并，合并结果可以被 ATTACH、追加合并
+# Date:         2026/10/18
+# 用法：
+#     python tests/test_merge_partition.py
+#     python tests/test_merge_partition.py --partition quarter --workdir ./partition_test   # 保留测试数据
+# 注：不需要安装微信，Linux 下也可以运行；全部检查通过返回0，否则返回1
+# -------------------------------------------------------------------------------
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_PATH not in sys.path:
+    sys.path.insert(0, ROOT_PATH)
+
+from pywxdump.wx_core.merge_db import merge_db, parallel_merge_db
+
+MSG_SQL = ("CREATE TABLE MSG (localId INTEGER PRIMARY KEY AUTOINCREMENT, TalkerId INT DEFAULT 0, MsgSvrID INT, "
+           "Type INT, SubType INT, IsSender INT, CreateTime INT, Sequence INT DEFAULT 0, StrTalker TEXT, "
+           "StrContent TEXT, CompressContent BLOB, BytesExtra BLOB{extra})")
+CONTACT_SQL = "CREATE TABLE Contact (UserName TEXT PRIMARY KEY, Alias TEXT, Remark TEXT, NickName TEXT)"
+YEAR = 365 * 24 * 3600
+
+
+def new_msg_db(path: str, start: int, rows: int, create_time: int, extra: str = ""):
+    """
+    新建 MSG 数据库，extra 为新版本微信额外的列
+    """
+    connection = sqlite3.connect(path)
+    connection.execute(MSG_SQL.format(extra=extra))
+    connection.executemany("INSERT INTO MSG (MsgSvrID, Type, SubType, IsSender, CreateTime, StrTalker, StrContent) "
+                           "VALUES (?, 1, 0, ?, ?, ?, ?)",
+                           [(1000000 + i, i % 2, create_time + i * 3600, f"wxid_{i % 7}", f"消息 {i}")
+                            for i in range(start, start + rows)])
+    connection.commit()
+    connection.close()
+
+
+def new_micro_db(path: str):
+    connection = sqlite3.connect(path)
+    connection.execute(CONTACT_SQL)
+    connection.executemany("INSERT INTO Contact VALUES (?, ?, ?, ?)",
+                           [(f"wxid_{i}", f"alias_{i}", "", f"好友 {i}") for i in range(7)])
+    connection.commit()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pywxdump MSG 分区合并测试")
+    parser.add_argument("--partition", default="year", choices=["year", "quarter"], help="分区方式")
+    parser.add_argument("--rows", type=int, default=500, help="每个 MSG 数据库的消息数")
+    parser.add_argument("--workdir", default=None, help="生成测试数据的目录，默认使用临时目录并在结束后删除")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pywxdump_partition_")
+    os.makedirs(workdir, exist_ok=True)
+    failures = []
+
+    def check(name: str, ok: bool, detail=""):
+        print(f"{name:<32}{'ok' if ok else 'FAILED'}  {detail}")
+        if not ok:
+            failures.append(name)
+
+    try:
+        msg_paths = [os.path.join(workdir, f"MSG{i}.db") for i in range(3)]
+        new_msg_db(msg_paths[0], 0, args.rows, 1600000000)
+        new_msg_db(msg_paths[1], args.rows, args.rows, 1600000000 + YEAR, extra=", Extra TEXT")  # 列不同
+        new_msg_db(msg_paths[2], args.rows * 2, args.rows, 1600000000 + YEAR * 2)
+        micro_path = os.path.join(workdir, "MicroMsg.db")
+        new_micro_db(micro_path)
+        merge_path = os.path.join(workdir, "merge_all.db")
+
+        # 两组 MSG 分别合并为分区的中间文件，combine_merged_db 时 ATTACH 其中一个
+        db_groups = [[{"db_path": msg_paths[0]}], [{"db_path": msg_paths[1]}], [{"db_path": micro_path}]]
+        ret = parallel_merge_db(db_groups, merge_path, workers=2, partition=args.partition)
+        check("parallel merge", ret == merge_path, ret)
+        if ret != merge_path:
+            return 1
+
+        connection = sqlite3.connect(":memory:")  # 分区视图在被 ATTACH 时也能加载
+        try:
+            connection.execute("ATTACH DATABASE ? AS merged", (merge_path,))
+            count, extra = connection.execute("SELECT COUNT(*), COUNT(Extra) FROM merged.MSG").fetchone()
+            check("attach", count == args.rows * 2 and extra == 0, f"{count} rows")
+        except sqlite3.DatabaseError as e:
+            check("attach", False, e)
+        finally:
+            connection.close()
+
+        ret = merge_db([{"db_path": msg_paths[2]}], merge_path)  # 追加合并时附加源数据库，沿用原来的分区方式
+        connection = sqlite3.connect(merge_path)
+        try:
+            count, distinct = connection.execute("SELECT COUNT(*), COUNT(DISTINCT MsgSvrID) FROM MSG").fetchone()
+            partitions = connection.execute("SELECT COUNT(*) FROM msg_partitions").fetchone()[0]
+            contacts = connection.execute("SELECT COUNT(*) FROM Contact").fetchone()[0]
+        finally:
+            connection.close()
+        check("append", ret == merge_path and count == distinct == args.rows * 3,
+              f"{count} rows, {partitions} partitions")
+        check("other tables", contacts == 7, f"{contacts} contacts")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("ok" if not failures else f"失败: {', '.join(failures)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
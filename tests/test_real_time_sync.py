@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-#
+# -------------------------------------------------------------------------------
+# Name:         test_real_time_sync.py
+# Description:  实时同步测试：生成与微信格式一致的 WAL 模式加密数据库，不断写入新消息，检查 RealTimeSync 同步后的合并结果
+# Date:         2026/10/18
+# 用法：
+#     python tests/test_real_time_sync.py
+#     python tests/test_real_time_sync.py --rounds 5 --rows 500 --workdir ./rt_test   # 保留测试数据
+# 注：不需要安装微信，Linux 下也可以运行；全部检查通过返回0，否则返回1
+# -------------------------------------------------------------------------------
+import argparse
+import hashlib
+import hmac
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from Cryptodome.Cipher import AES
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_PATH not in sys.path:
+    sys.path.insert(0, ROOT_PATH)
+
+from pywxdump import RealTimeSync
+from pywxdump.wx_core.decryption import DEFAULT_PAGESIZE, SALT_SIZE, RESERVE_SIZE, KEY_SIZE, WAL_SUFFIX
+
+DEFAULT_KEY = hashlib.sha256(b"pywxdump realtime").hexdigest()  # 测试用的固定密钥
+SALT = hashlib.md5(b"pywxdump realtime").digest()[:SALT_SIZE]
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+MSG_SQL = ("CREATE TABLE MSG (localId INTEGER PRIMARY KEY AUTOINCREMENT, TalkerId INT DEFAULT 0, MsgSvrID INT, "
+           "Type INT, SubType INT, IsSender INT, CreateTime INT, Sequence INT DEFAULT 0, StrTalker TEXT, "
+           "StrContent TEXT, CompressContent BLOB, BytesExtra BLOB)")
+
+
+class PageEncryptor:
+    """
+    按微信的格式加密页：AES-256-CBC，页尾保留段为 IV(16) + HMAC-SHA1(20) + 填充(12)，第一页开头16字节为盐值
+    """
+
+    def __init__(self, key: str = DEFAULT_KEY, salt: bytes = SALT):
+        self.salt = salt
+        self.enc_key = hashlib.pbkdf2_hmac("sha1", bytes.fromhex(key), salt, 64000, KEY_SIZE)
+        mac_salt = bytes([(salt[i] ^ 58) for i in range(16)])
+        self.mac_key = hashlib.pbkdf2_hmac("sha1", self.enc_key, mac_salt, 2, KEY_SIZE)
+
+    def page(self, plain: bytes, pgno: int):
+        start = SALT_SIZE if pgno == 1 else 0
+        data_end = DEFAULT_PAGESIZE - RESERVE_SIZE
+        iv = hashlib.md5(plain + pgno.to_bytes(4, "little")).digest()  # 相同内容的页密文相同，便于增量解密
+        encrypted = AES.new(self.enc_key, AES.MODE_CBC, iv).encrypt(plain[start:data_end])
+        page = (self.salt if pgno == 1 else b"") + encrypted + iv
+        mac = hmac.new(self.mac_key, page[start:], hashlib.sha1)
+        mac.update(pgno.to_bytes(4, "little"))
+        return page + mac.digest() + b"\x00" * (RESERVE_SIZE - 16 - 20)
+
+    def db(self, src: str, dst: str):
+        with open(src, "rb") as f:
+            data = f.read()
+        with open(dst, "wb") as f:
+            for offset in range(0, len(data), DEFAULT_PAGESIZE):
+                f.write(self.page(data[offset:offset + DEFAULT_PAGESIZE], offset // DEFAULT_PAGESIZE + 1))
+
+    def wal(self, src: str, dst: str):
+        """
+        加密 WAL：文件头和帧头保持明文，只加密帧中的页
+        """
+        with open(src, "rb") as f:
+            data = f.read()
+        out = bytearray(data[:WAL_HEADER_SIZE])
+        frame_size = WAL_FRAME_HEADER_SIZE + DEFAULT_PAGESIZE
+        for offset in range(WAL_HEADER_SIZE, len(data) - frame_size + 1, frame_size):
+            frame_header = data[offset:offset + WAL_FRAME_HEADER_SIZE]
+            pgno = int.from_bytes(frame_header[:4], "big")
+            out += frame_header + self.page(data[offset + WAL_FRAME_HEADER_SIZE:offset + frame_size], pgno)
+        with open(dst, "wb") as f:
+            f.write(out)
+
+
+def new_plain_db(path: str):
+    """
+    新建明文数据库：页大小4096，每页保留48字节(与解密后的数据库一致)，WAL 模式且不自动 checkpoint
+    """
+    connection = sqlite3.connect(path)
+    connection.execute(f"PRAGMA page_size={DEFAULT_PAGESIZE}")
+    connection.execute("CREATE TABLE t (x)")  # 生成只有第一页的空数据库
+    connection.execute("DROP TABLE t")
+    connection.execute("VACUUM")
+    connection.close()
+    with open(path, "r+b") as f:  # 修改文件头中每页的保留字节数，以及第一页的单元内容区起始位置
+        f.seek(20)
+        f.write(bytes([RESERVE_SIZE]))
+        f.seek(105)
+        f.write((DEFAULT_PAGESIZE - RESERVE_SIZE).to_bytes(2, "big"))
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA wal_autocheckpoint=0")
+    connection.execute(MSG_SQL)
+    connection.commit()
+    return connection
+
+
+def insert_msgs(connection, start: int, rows: int):
+    sql = ("INSERT INTO MSG (MsgSvrID, Type, SubType, IsSender, CreateTime, StrTalker, StrContent) "
+           "VALUES (?, 1, 0, ?, ?, ?, ?)")
+    connection.executemany(sql, [(1000000 + i, i % 2, 1600000000 + i, f"wxid_{i % 7}", f"消息 {i}")
+                                 for i in range(start, start + rows)])
+    connection.commit()
+
+
+def snapshot(encryptor: PageEncryptor, plain_path: str, enc_path: str):
+    """
+    把明文数据库和 WAL 加密后写到 enc_path，模拟微信正在写入的数据库
+    """
+    encryptor.db(plain_path, enc_path)
+    wal_path = plain_path + WAL_SUFFIX
+    if os.path.exists(wal_path) and os.path.getsize(wal_path):
+        encryptor.wal(wal_path, enc_path + WAL_SUFFIX)
+    elif os.path.exists(enc_path + WAL_SUFFIX):
+        os.remove(enc_path + WAL_SUFFIX)
+
+
+def merged_msgs(merge_path: str):
+    connection = sqlite3.connect(merge_path)
+    try:
+        return connection.execute("SELECT COUNT(*), COUNT(DISTINCT MsgSvrID), MAX(MsgSvrID) FROM MSG").fetchone()
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pywxdump 实时同步测试")
+    parser.add_argument("--rounds", type=int, default=3, help="写入新消息的轮数")
+    parser.add_argument("--rows", type=int, default=200, help="每轮写入的消息数")
+    parser.add_argument("--workdir", default=None, help="生成测试数据的目录，默认使用临时目录并在结束后删除")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pywxdump_rt_")
+    os.makedirs(os.path.join(workdir, "Multi"), exist_ok=True)
+    plain_path = os.path.join(workdir, "plain_MSG0.db")
+    enc_path = os.path.join(workdir, "Multi", "MSG0.db")
+    merge_path = os.path.join(workdir, "merge_all.db")
+    encryptor = PageEncryptor()
+    failures = []
+
+    def check(name: str, expected: int):
+        count, distinct, max_id = merged_msgs(merge_path)
+        ok = count == distinct == expected and max_id == 1000000 + expected - 1
+        print(f"{name:<24}{'expected':>10}{expected:>8}{'merged':>8}{count:>8}  {'ok' if ok else 'FAILED'}")
+        if not ok:
+            failures.append(name)
+
+    try:
+        connection = new_plain_db(plain_path)
+        insert_msgs(connection, 0, args.rows)
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        snapshot(encryptor, plain_path, enc_path)
+
+        sync = RealTimeSync(DEFAULT_KEY, merge_path, [enc_path], interval=0.1)
+        code, ret = sync.sync_once()
+        if not code:
+            print(f"同步失败: {ret}")
+            return 1
+        total = args.rows
+        check("initial", total)
+
+        for i in range(args.rounds):  # 新消息只写入 WAL，数据库文件不变
+            insert_msgs(connection, total, args.rows)
+            total += args.rows
+            snapshot(encryptor, plain_path, enc_path)
+            sync.sync_once()
+            check(f"wal round {i + 1}", total)
+
+        code, ret = sync.sync_once()  # 没有变化时不应同步任何数据库
+        if not code or ret:
+            failures.append("unchanged")
+            print(f"unchanged: {ret}")
+
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # checkpoint 后 WAL 清空，变化转移到数据库文件
+        insert_msgs(connection, total, args.rows)
+        total += args.rows
+        snapshot(encryptor, plain_path, enc_path)
+        sync.sync_once()
+        check("after checkpoint", total)
+
+        insert_msgs(connection, total, args.rows)
+        total += args.rows
+        snapshot(encryptor, plain_path, enc_path)
+        sync.start()  # 后台线程轮询
+        deadline = time.time() + 30
+        while merged_msgs(merge_path)[0] < total and time.time() < deadline:
+            time.sleep(0.1)
+        sync.stop(timeout=10)
+        check("background thread", total)
+        connection.close()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("ok" if not failures else f"失败: {', '.join(failures)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())